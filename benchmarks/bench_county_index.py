@@ -0,0 +1,110 @@
+'''
+Latency of update_map_state for the largest state, filtering with boolean
+masks over the whole county table (before) and through the CountyIndex.
+
+    python benchmarks/bench_county_index.py --days 300 --counties 3200
+'''
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import setup_app_data  # noqa: E402
+
+
+def legacy_frame(df):
+    '''The county table as the masks saw it before the compact schema: datetime dates, float new_cases.'''
+    return df.assign(date=df['date'].values.astype('datetime64[D]').astype('datetime64[ns]'),
+                     new_cases=df['new_cases'].astype(float))
+
+
+def legacy_filters(counties_df, state_value, input_date):
+    nj_test = counties_df[(counties_df.state==state_value) & (counties_df.date==input_date)]
+    state_df = counties_df[(counties_df.state==state_value) & (counties_df.new_cases >= 0) & (counties_df.county != 'Unknown')]
+    county_list = sorted(counties_df[(counties_df.state==state_value)].county.unique())
+    return nj_test, [state_df[state_df.county == county] for county in county_list]
+
+
+def legacy_update_map_state(counties_df, geojson, state_value, input_date, input_counties):
+    # update_map_state before the index, for comparison
+    import dash_bootstrap_components as dbc
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    nj_test = counties_df[(counties_df.state==state_value) & (counties_df.date==input_date)]
+    fig_nj = px.choropleth(nj_test, geojson=geojson, locations='fips', color='new_cases',
+                           color_continuous_scale="Blues", range_color=(0, max(nj_test["new_cases"])),
+                           scope="usa", hover_name="county", hover_data=["date", "new_cases"],
+                           labels={'new_cases':'new cases'})
+    fig_nj.update_geos(fitbounds="locations", visible=False)
+    fig_nj.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
+    fig_nj.update_coloraxes(showscale=False)
+
+    state_df = counties_df[(counties_df.state==state_value) & (counties_df.new_cases >= 0) & (counties_df.county != 'Unknown')]
+    county_list = sorted(counties_df[(counties_df.state==state_value)].county.unique())
+    fig_line = go.Figure()
+    for county in county_list:
+        visible = True if county in input_counties or input_counties==[] else 'legendonly'
+        fig_line.add_trace(go.Scatter(x=state_df[state_df.county == county].date, y=state_df[state_df.county == county].new_cases,
+                                      name=county, visible=visible,
+                                      hovertemplate='<b>Date</b>: %{x}<br><b>New Cases</b>: %{y}<br><b>County</b>: %{text}',
+                                      text=[county for i in range(len(state_df[state_df.county == county].new_cases))]))
+
+    state_table = dbc.Table.from_dataframe(nj_test.sort_values('new_cases', ascending=False)[['county', 'new_cases']])
+    dropdown_options = [{'label': c, 'value': c} for c in county_list]
+    return fig_nj, fig_line, '{} Counties'.format(state_value), state_table, dropdown_options
+
+
+def indexed_filters(index, state_value, input_date):
+    nj_test = index.state_date(state_value, input_date)
+    state_df = index.state_rows(state_value)
+    dates = state_df.date.values
+    new_cases = state_df.new_cases.to_numpy(dtype=float, na_value=np.nan)
+    keep = (new_cases >= 0) & (state_df.county != 'Unknown').values
+    return nj_test, [(dates[rows][keep[rows]], new_cases[rows][keep[rows]])
+                     for county, rows in index.county_slices(state_value)]
+
+
+def update_state_view(covid19_dash, state_value, input_date, input_counties):
+    '''The map and the line chart, now two callbacks, without the callback cache.'''
+    fig_nj, header, table, options = covid19_dash.update_map_state.uncached(state_value, input_date)
+    fig_line = covid19_dash.state_lines.uncached(state_value, tuple(input_counties), 'new_cases', None)
+    return fig_nj, fig_line, header, table, options
+
+
+def best_of(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        import covid19_dash
+
+        data = covid19_dash.us_counties.current
+        df = legacy_frame(data.df)
+        geojson = covid19_dash.sources.load_json('geojson')
+        date = covid19_dash.available_dates(covid19_dash.us_counties)[-1]
+        print('{} rows'.format(len(data.df)))
+        for state in ('Texas', 'New Jersey'):
+            legacy = best_of(lambda: legacy_filters(df, state, date), args.repeat)
+            indexed = best_of(lambda: indexed_filters(data.index, state, date), args.repeat)
+            before = best_of(lambda: legacy_update_map_state(df, geojson, state, date, []), args.repeat)
+            after = best_of(lambda: update_state_view(covid19_dash, state, date, []), args.repeat)
+            print('{:<11} filters: masks {:7.1f} ms  index {:7.1f} ms   callback: before {:7.1f} ms  after {:7.1f} ms'.format(
+                state, legacy * 1000, indexed * 1000, before * 1000, after * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Response size and cost of the line charts for the largest state (Texas, 254
+counties) and the NYC cases chart over a long history: every point, bucketed
+to COVID19_MAX_POINTS per trace, and a 30-day zoom at full resolution.
+Rendering can't be timed headless, so points shipped and the browser-side
+JSON parse stand in for it.
+
+    python benchmarks/bench_downsample.py --days 1000 --counties 1000
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import setup_app_data, write_nyc_csv  # noqa: E402
+
+
+def best_of(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def check_extremes(full, sampled):
+    '''Every trace keeps its first, last, lowest and highest point.'''
+    for a, b in zip(full['data'], sampled['data']):
+        assert len(b['x']) <= len(a['x'])
+        if len(a['y']):
+            assert (b['x'][0], b['x'][-1]) == (a['x'][0], a['x'][-1]), a['name']
+            assert np.nanmax(b['y']) == np.nanmax(a['y']) and np.nanmin(b['y']) == np.nanmin(a['y']), a['name']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=1000)
+    parser.add_argument('--counties', type=int, default=1000)
+    parser.add_argument('--zoom', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        write_nyc_csv(os.path.join(tmp, 'data-by-day.csv'), args.days)
+        import covid19_dash
+        from covid19_index import day_number
+
+        last = day_number(covid19_dash.available_dates(covid19_dash.us_counties)[-1])
+        zoom = (last - args.zoom + 1, last)
+        charts = [('Texas', covid19_dash.county_lines, lambda x_range: covid19_dash.state_lines.uncached('Texas', (), 'new_cases', x_range)),
+                  ('NYC cases', covid19_dash.borough_lines, lambda x_range: covid19_dash.nyc_line.uncached('line-nyc', x_range))]
+        print('{} days, up to {} points per trace'.format(args.days, covid19_dash.county_lines.max_points))
+        for chart, factory, build in charts:
+            max_points = factory.max_points
+            factory.max_points = 0
+            full = build(None)
+            factory.max_points = max_points
+            check_extremes(full, build(None))
+
+            views = [('every point', None, 0), ('downsampled', None, max_points),
+                     ('{}-day zoom'.format(args.zoom), zoom, max_points)]
+            for label, x_range, points in views:
+                factory.max_points = points
+                payload = json.dumps(build(x_range), cls=PlotlyJSONEncoder)
+                server = best_of(lambda: json.dumps(build(x_range), cls=PlotlyJSONEncoder), args.repeat)
+                parse = best_of(lambda: json.loads(payload), args.repeat)
+                shipped = sum(len(trace['x']) for trace in json.loads(payload)['data'])
+                print('{:<10} {:<12} {:8d} points {:9.1f} KB   server {:7.1f} ms   parse {:6.1f} ms'.format(
+                    chart, label, shipped, len(payload) / 1024, server * 1000, parse * 1000))
+            factory.max_points = max_points
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''
+The static export: time to render every view with one worker and with one
+per CPU, the size of the export, and requests per second through the Flask
+test client for the Texas map rendered live (local cache cleared), answered
+from the local callback cache, and served from the export. Every exported
+view checked against the live response must decode to the same JSON.
+
+    python benchmarks/bench_export.py --days 300 --counties 3200
+'''
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import setup_app_data  # noqa: E402
+
+
+def requests_per_second(client, body, seconds, headers=None, before=None):
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if before is not None:
+            before()
+        response = client.post('/_dash-update-component', json=body, headers=headers)
+        assert response.status_code == 200, response.status_code
+        count += 1
+    return count / (time.perf_counter() - start), response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--export-days', type=int, default=14, help='most recent dates exported for every state map')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seconds', type=float, default=3, help='duration of each serving run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties, synthetic_states=True)
+        export_dir = os.path.join(tmp, 'exports')
+        # No shared backend, so clearing the local cache forces a miss
+        os.environ['COVID19_CACHE_TYPE'] = 'null'
+        import covid19_dash
+        from bench_startup import LINE_STATE, MAP_STATE, callback_body
+        from covid19_export import export
+
+        for workers in sorted({1, args.workers}):
+            manifest, elapsed = export(export_dir, args.export_days, workers)
+            views = manifest['views'].values()
+            print('export, {:>2} worker(s): {} views in {:6.1f} s, {:6.1f} views/s'.format(
+                workers, len(views), elapsed, len(views) / elapsed))
+        print('export size: {:.1f} MB of JSON, {:.1f} MB gzip{}'.format(
+            sum(v['bytes'] for v in views) / 2 ** 20, sum(v['gzip'] for v in views) / 2 ** 20,
+            ', {:.1f} MB brotli'.format(sum(v['br'] for v in views) / 2 ** 20) if all('br' in v for v in views) else ''))
+
+        client = covid19_dash.server.test_client()
+        client.get('/_dash-layout')
+        date = covid19_dash.available_dates(covid19_dash.us_counties)[-1]
+        map_body = callback_body(MAP_STATE, [('value-state', 'value', 'Texas'), ('date-state', 'date', date)])
+        line_body = callback_body(LINE_STATE, [('value-state', 'value', 'Texas'),
+                                               ('state-dropdown', 'value', covid19_dash.STATE_COUNTIES),
+                                               ('state-metric', 'value', 'new_cases'),
+                                               ('line-state', 'relayoutData', None)])
+        gzipped = {'Accept-Encoding': 'gzip'}
+
+        # Live responses first, with no export in place
+        store = covid19_dash.static_views_store
+        store.export_dir, store.manifest_path = os.path.join(tmp, 'none'), os.path.join(tmp, 'none', 'manifest.json')
+        store._checked_at = 0
+        live = {}
+        for name, body in (('map', map_body), ('line', line_body)):
+            response = client.post('/_dash-update-component', json=body)
+            assert 'Content-Encoding' not in response.headers
+            live[name] = json.loads(response.data)
+        results = [('live, rendered', requests_per_second(client, map_body, args.seconds, before=covid19_dash.callback_cache.clear)),
+                   ('live, local cache hit', requests_per_second(client, map_body, args.seconds))]
+
+        store.export_dir, store.manifest_path = export_dir, os.path.join(export_dir, 'manifest.json')
+        store._checked_at = 0
+        for name, body in (('map', map_body), ('line', line_body)):
+            response = client.post('/_dash-update-component', json=body, headers=gzipped)
+            assert response.headers.get('Content-Encoding') == 'gzip', 'Texas {} not served from the export'.format(name)
+            assert json.loads(gzip.decompress(response.data)) == live[name], 'Texas {} differs from live'.format(name)
+            assert json.loads(client.post('/_dash-update-component', json=body).data) == live[name]
+        results.append(('static, gzip', requests_per_second(client, map_body, args.seconds, gzipped)))
+        results.append(('static, identity', requests_per_second(client, map_body, args.seconds)))
+
+        for label, (rps, response) in results:
+            print('Texas map, {:<22} {:8.1f} requests/s, {:8.1f} KB on the wire'.format(label, rps, len(response.data) / 1024))
+        print('exported Texas map and line chart match the live responses; {} static hits'.format(store.hits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+'''
+Refreshing every source from a local HTTP stand-in that serves the fixtures
+gzip-encoded, each slow to answer: serial against concurrent fetch time.
+tests/test_sources.py covers conditional GETs and the flaky, failing and
+trickling endpoints.
+
+    python benchmarks/bench_fetch.py --latency 0.5
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_sources import SOURCE_URLS, DataSources  # noqa: E402
+from tests.upstream import Upstream, same_as_upstream  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds every source waits before answering')
+    args = parser.parse_args()
+
+    upstream = Upstream()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every source slow to answer: one at a time, then all at once
+        for label, workers in (('serial', 1), ('concurrent', None)):
+            upstream.reset()
+            upstream.modes = {upstream.filename(name): ('slow', args.latency) for name in SOURCE_URLS}
+            sources = DataSources(data_dir=os.path.join(tmp, label), offline=False, urls=upstream.urls())
+            start = time.perf_counter()
+            changed = sources.refresh(workers=workers)
+            elapsed = time.perf_counter() - start
+            assert all(changed.values()) and same_as_upstream(upstream, sources)
+            print('{:<10} {} sources, {:.1f} s latency each: {:5.2f} s'.format(label, len(changed), args.latency, elapsed))
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Wall time and serialized size of the state map and line chart, building figures with
+plotly.express per request (before) and from the figure factories.
+
+    python benchmarks/bench_figures.py --days 300 --counties 3200
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_county_index import legacy_frame, legacy_update_map_state, update_state_view  # noqa: E402
+from synthetic import setup_app_data  # noqa: E402
+
+
+def serialize(outputs):
+    return json.dumps(outputs, cls=PlotlyJSONEncoder)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        import covid19_dash
+
+        df = legacy_frame(covid19_dash.us_counties.df)
+        date = covid19_dash.available_dates(covid19_dash.us_counties)[-1]
+        for state in ('Texas', 'New Jersey'):
+            geojson = covid19_dash.county_geometry().for_fips(covid19_dash.us_counties.index.state_date(state, date)['fips'])
+            cases = [('px, state geometry', lambda: legacy_update_map_state(df, geojson, state, date, [])),
+                     ('factories', lambda: update_state_view(covid19_dash, state, date, []))]
+            for label, callback in cases:
+                wall = min(timeit.repeat(lambda: serialize(callback()), number=1, repeat=args.repeat))
+                size = len(serialize(callback()))
+                print('{:<11} {:<18} {:8.1f} ms  {:8.1f} KB'.format(state, label, wall * 1000, size / 1024))
+        print('(wall time includes JSON serialization)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''
+Response size and server-side build time of the county choropleth per
+state, with the full US GeoJSON, the state's subset, and the simplified
+subset.
+
+    python benchmarks/bench_geometry.py --days 30 --counties 3200 [--all]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import plotly.express as px
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import setup_app_data  # noqa: E402
+
+
+def map_figure(df, geojson):
+    fig = px.choropleth(df, geojson=geojson, locations='fips', color='new_cases',
+                        color_continuous_scale="Blues", range_color=(0, max(df["new_cases"])),
+                        scope="usa", hover_name="county", hover_data=["date", "new_cases"],
+                        labels={'new_cases':'new cases'})
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
+    fig.update_coloraxes(showscale=False)
+    return fig
+
+
+def measure(df, geojson, repeat):
+    best_build = best_encode = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fig = map_figure(df, geojson)
+        built = time.perf_counter()
+        payload = fig.to_json()
+        best_build = min(best_build, built - start)
+        best_encode = min(best_encode, time.perf_counter() - built)
+    return len(payload), best_build, best_encode
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--all', action='store_true', help='every state instead of Texas and New Jersey')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        from covid19_data import DatasetCache, Counties, unique_dates
+        from covid19_figures import CountyGeometry
+        from covid19_sources import DataSources
+
+        sources = DataSources()
+        index = DatasetCache(sources).get(Counties).index
+        full = sources.load_json('geojson')
+        date = unique_dates(index.df['date'])[-1]
+
+        print('{:<11} {:>24} {:>24} {:>24}'.format('', 'full GeoJSON', 'state subset', 'simplified subset'))
+        for state in (index.states() if args.all else ['Texas', 'New Jersey']):
+            df = index.state_date(state, date)
+            row = []
+            for geojson in (full,
+                            CountyGeometry(full, simplify=False).for_fips(df['fips']),
+                            CountyGeometry(full).for_fips(df['fips'])):
+                size, build, encode = measure(df, geojson, args.repeat)
+                row.append('{:8.1f} KB {:5.0f}+{:4.0f} ms'.format(size / 1024, build * 1000, encode * 1000))
+            print('{:<11} {}'.format(state, ' '.join(row)))
+        print('(times are figure build + JSON encode)')
+
+
+if __name__ == '__main__':
+    main()
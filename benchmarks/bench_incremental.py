@@ -0,0 +1,86 @@
+'''
+Refresh cost of appending new days to the county and state tables, against
+a full rebuild, and a check that both give identical frames.
+
+    python benchmarks/bench_incremental.py --days 300 --new-days 1
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_data import Counties, DatasetCache, States  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from synthetic import write_counties_csv, write_population_csv  # noqa: E402
+
+
+def split_csv(path, days, new_days):
+    '''Writes the first `days - new_days` days to `path`, returns the rest as text.'''
+    with open(path) as f:
+        header, *lines = f.readlines()
+    dates = sorted({line[:10] for line in lines})
+    cutoff = dates[days - new_days]
+    old = [line for line in lines if line[:10] < cutoff]
+    new = [line for line in lines if line[:10] >= cutoff]
+    with open(path, 'w') as f:
+        f.writelines([header] + old)
+    return ''.join(new)
+
+
+def write_states_csv(path, days):
+    counties_path = path + '.counties'
+    write_counties_csv(counties_path, days, 1100)
+    counties = pd.read_csv(counties_path, dtype={'fips': str})
+    states = counties.groupby(['date', 'state'], as_index=False)[['cases', 'deaths']].sum()
+    states['fips'] = states['state'].rank(method='dense').astype(int)
+    states[['date', 'state', 'fips', 'cases', 'deaths']].to_csv(path, index=False)
+    os.remove(counties_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--new-days', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = DataSources(data_dir=tmp, offline=True)
+        counties = write_counties_csv(sources['counties'].local_path, args.days, args.counties)
+        write_population_csv(sources['population'].local_path, counties['fips'].unique())
+        write_states_csv(sources['states'].local_path, args.days)
+        appended = {name: split_csv(sources[name].local_path, args.days, args.new_days)
+                    for name in ('counties', 'states')}
+
+        cache = DatasetCache(sources, os.path.join(tmp, 'snapshots'))
+        previous = {cls: cache.get(cls) for cls in (Counties, States)}
+        for name, text in appended.items():
+            with open(sources[name].local_path, 'a') as f:
+                f.write(text)
+
+        for cls in (Counties, States):
+            start = time.perf_counter()
+            incremental = cache.build(cls, previous[cls])
+            incremental_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            full = cls.from_sources(sources)
+            full_time = time.perf_counter() - start
+
+            assert cache.increments, 'incremental path was not taken'
+            pd.testing.assert_frame_equal(incremental.df, full.df, check_exact=True, check_categorical=True)
+            for column in cls.categories:
+                assert list(incremental.df[column].cat.categories) == list(full.df[column].cat.categories)
+            assert incremental.manifest == full.manifest
+
+            print('{:<9} {:8d} rows  +{} day(s): incremental {:7.3f}s   full rebuild {:7.3f}s   identical'.format(
+                cls.name, len(full.df), args.new_days, incremental_time, full_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+The per-series metrics engine against pandas groupby/rolling on the county
+table. tests/test_metrics.py checks its results against a per-county
+reference.
+
+    python benchmarks/bench_metrics.py --days 300 --counties 3200
+'''
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_data import Counties, read_population  # noqa: E402
+from covid19_metrics import WINDOW, series_metrics  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from synthetic import write_counties_csv, write_population_csv  # noqa: E402
+
+
+def pandas_metrics(df):
+    # groupby/rolling, for speed only: it windows by row, not by date
+    grouped = df.groupby(['state', 'county'], sort=False, observed=True)['cases']
+    new_cases = grouped.diff()
+    avg7 = new_cases.groupby([df['state'], df['county']], sort=False, observed=True).transform(lambda s: s.rolling(WINDOW).mean())
+    return new_cases, avg7
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = DataSources(data_dir=tmp, offline=True)
+        counties = write_counties_csv(sources['counties'].local_path, args.days, args.counties)
+        write_population_csv(sources['population'].local_path, counties['fips'].unique())
+        df = Counties.from_sources(sources).df
+
+        population = read_population(sources.path('population'))['fips']
+        df_population = population.reindex(df['fips'].astype(object)).values
+        codes = Counties.series_codes(df)
+        engine = min(timeit.repeat(lambda: series_metrics(codes, df['date'].values, df['cases'].values, df_population),
+                                   number=1, repeat=args.repeat))
+        grouped = min(timeit.repeat(lambda: pandas_metrics(df), number=1, repeat=args.repeat))
+        print('all four metrics: engine {:7.1f} ms   pandas diff + rolling mean {:7.1f} ms'.format(engine * 1000, grouped * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Cleaning the NYC borough file: the original per-metric melt with per-row
+list comprehensions against the single-pass transformer, on a synthetic
+multi-year file. Also checks each borough's values against the raw columns.
+
+    python benchmarks/bench_nyc.py --years 5
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_data import NYCData  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from synthetic import ROOT, write_nyc_csv  # noqa: E402
+
+
+def legacy_clean_nyc_data_by_metric(nyc_boro_df, metric):
+    # NYCData.clean_nyc_data_by_metric before the single-pass transformer
+    column_filter = nyc_boro_df.columns.to_series().str.endswith(metric)
+    column_filter.date_of_interest = True
+    nyc_cases = nyc_boro_df[nyc_boro_df.columns[column_filter]]
+
+    original_prefixes = {'da': 'date', 'BX': 'Bronx', 'BK': 'Brooklyn', 'MN': 'Manhattan', 'QN': 'Queens', 'SI': 'Staten Island'}
+    new_column_names, columns_to_keep = [], []
+    for column_name in nyc_cases.columns:
+        prefix = column_name[:2]
+        if prefix in original_prefixes:
+            new_column_names.append(original_prefixes[prefix])
+            columns_to_keep.append(original_prefixes[prefix])
+        else:
+            new_column_names.append(column_name)
+    nyc_cases.columns = new_column_names
+    nyc_cases = nyc_cases[columns_to_keep]
+
+    nyc_cases_tidy = pd.melt(nyc_cases, ["date"], var_name="county", value_name="new_cases")
+    nyc_cases_tidy['state'] = ['New York' for i in range(len(nyc_cases_tidy))]
+    nyc_cases_tidy['fips'] = [NYCData.borough_to_fips[borough] for borough in nyc_cases_tidy['county'].values]
+    nyc_cases_tidy['date'] = pd.to_datetime(nyc_cases_tidy['date'])
+    return NYCData.compact(nyc_cases_tidy)
+
+
+def legacy_from_sources(sources):
+    nyc = NYCData()
+    nyc.nyc_boro_df = pd.read_csv(sources.path('nyc_boro'))
+    nyc.nyc_tests_df = pd.read_csv(sources.path('nyc_tests'))
+    for frame, metric in NYCData.metrics.items():
+        setattr(nyc, frame, legacy_clean_nyc_data_by_metric(nyc.nyc_boro_df, '_' + metric))
+    return nyc
+
+
+def peak_memory(build):
+    tracemalloc.start()
+    build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def frames_bytes(nyc, frames):
+    return sum(getattr(nyc, frame).memory_usage(deep=True).sum() for frame in frames)
+
+
+def check(nyc, raw):
+    for frame, metric in NYCData.metrics.items():
+        df = getattr(nyc, frame)
+        assert len(df) == len(raw) * len(NYCData.boroughs), (frame, len(df))
+        for prefix, borough in NYCData.boroughs.items():
+            values = df.loc[df['county'] == borough, 'new_cases'].values
+            assert (values == raw['{}_{}'.format(prefix, metric)].values).all(), (frame, borough)
+            assert (df.loc[df['county'] == borough, 'fips'] == NYCData.borough_to_fips[borough]).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_nyc_csv(os.path.join(tmp, 'data-by-day.csv'), 365 * args.years)
+        shutil.copy(os.path.join(ROOT, 'fixtures', 'tests.csv'), tmp)
+        sources = DataSources(data_dir=tmp, offline=True)
+        raw = pd.read_csv(sources.path('nyc_boro'))
+        print('{} days, {} columns'.format(len(raw), len(raw.columns)))
+
+        legacy, nyc = legacy_from_sources(sources), NYCData.from_sources(sources)
+        check(nyc, raw)
+        # The old filter also kept the PROBABLE_ columns, under the same borough names
+        print('rows per metric: before {}, after {}'.format(len(legacy.cases_df), len(nyc.cases_df)))
+
+        metrics = list(NYCData.metrics)
+        for label, build, frames in [('per-metric melt', lambda: legacy_from_sources(sources), metrics),
+                                     ('single pass', lambda: NYCData.from_sources(sources), metrics + ['tests_df'])]:
+            wall = min(timeit.repeat(build, number=1, repeat=args.repeat))
+            print('{:<16} {:8.1f} ms  peak {:7.1f} MB  frames {:7.1f} MB'.format(
+                label, wall * 1000, peak_memory(build) / 2 ** 20, frames_bytes(build(), frames) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
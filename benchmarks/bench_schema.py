@@ -0,0 +1,99 @@
+'''
+Memory and filter latency of the county table in three layouts: the
+original object-string columns, the categorical/int64 layout of the first
+snapshots ('category'), and the compact schema (int32 day numbers and
+counts, nullable Int32 new_cases, categorical codes). Defaults are about
+the size of the full NYT county history.
+
+    python benchmarks/bench_schema.py --days 1000 --counties 3200
+'''
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_snapshot import report, run_workers  # noqa: E402
+from covid19_data import Counties  # noqa: E402
+from covid19_index import CountyIndex, day_number  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from synthetic import write_counties_csv, write_population_csv  # noqa: E402
+
+
+def strings_frame(sources):
+    # The original loader: every column read as Python strings (what
+    # dtype=str gives on pandas 1.x), dates left as strings
+    counties_df = pd.read_csv(sources.path('counties'), dtype=object)
+    for col in ('cases', 'deaths'):
+        counties_df[col] = counties_df[col].astype(int)
+    counties_df = counties_df.sort_values(['state', 'county', 'date'], kind='mergesort')
+    counties_df['new_cases'] = counties_df.groupby(['state', 'county'], sort=False)['cases'].diff()
+    return counties_df
+
+
+def categorical_frame(df):
+    # The first snapshots: categorical names, datetime64 dates, int64 counts
+    return df.assign(date=df['date'].values.astype('datetime64[D]').astype('datetime64[ns]'),
+                     cases=df['cases'].astype(np.int64),
+                     deaths=df['deaths'].astype(np.int64),
+                     new_cases=df['new_cases'].astype(float))
+
+
+def best_of(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=1000)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = DataSources(data_dir=tmp, offline=True)
+        counties = write_counties_csv(sources['counties'].local_path, args.days, args.counties)
+        write_population_csv(sources['population'].local_path, counties['fips'].unique())
+        snapshot_dir = os.path.join(tmp, 'snapshots')
+        compact = Counties.from_sources(sources)
+        compact.to_snapshot(snapshot_dir)
+        categorical_snapshot_dir = os.path.join(tmp, 'categorical')
+        Counties(df=categorical_frame(compact.df)).to_snapshot(categorical_snapshot_dir)
+        print('{} rows'.format(len(compact.df)))
+
+        # What a worker holds after loading, as in bench_snapshot; forked
+        # before the parent builds the large frames below
+        report('strings', run_workers(lambda: strings_frame(sources), args.workers))
+        report('category', run_workers(lambda: Counties.from_snapshot(categorical_snapshot_dir).df, args.workers))
+        report('compact', run_workers(lambda: Counties.from_snapshot(snapshot_dir).df, args.workers))
+
+        strings = strings_frame(sources)
+        layouts = [('strings', strings), ('category', categorical_frame(compact.df)), ('compact', compact.df)]
+        for label, df in layouts:
+            print('{:<10} {:8.1f} MB in memory ({:.1f} bytes/row)'.format(
+                label, df.memory_usage(deep=True).sum() / 2 ** 20, df.memory_usage(deep=True).sum() / len(df)))
+
+        state, date = 'Texas', pd.Timestamp('2020-10-15') - pd.Timedelta(days=args.days // 2)
+        date_string = date.strftime('%Y-%m-%d')
+        categorical = layouts[1][1]
+        df = compact.df
+        state_code, day = df['state'].cat.categories.get_loc(state), day_number(date)
+        index = CountyIndex(df)
+        filters = [('strings', lambda: strings[(strings.state == state) & (strings.date == date_string)]),
+                   ('category', lambda: categorical[(categorical.state == state) & (categorical.date == date_string)]),
+                   ('compact codes', lambda: df[(df['state'].cat.codes.values == state_code) & (df['date'].values == day)]),
+                   ('compact index', lambda: index.state_date(state, date_string))]
+        expected = len(filters[0][1]())
+        for label, fn in filters:
+            assert len(fn()) == expected, label
+            print('{:<14} state and date filter {:8.2f} ms'.format(label, best_of(fn, args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+'''
+Load time and per-worker memory of the county table: the original read_csv
+path against the memory-mapped snapshot.
+
+    python benchmarks/bench_snapshot.py --days 600 --counties 3200 --workers 4
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_data import Counties  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from synthetic import write_counties_csv, write_population_csv  # noqa: E402
+
+
+def memory_kb():
+    # Rss counts shared pages in full for every process; Pss splits them
+    # between the processes mapping them, so it is the per-worker cost.
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def run_workers(load, n_workers):
+    # Like gunicorn without --preload: every worker loads on its own.
+    pipes = []
+    for _ in range(n_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            start = time.perf_counter()
+            df = load()
+            elapsed = time.perf_counter() - start
+            # touch every column so the pages are actually resident
+            for column in df.columns:
+                df[column].values[::1024]
+            df['cases'].sum()
+            time.sleep(0.5)  # let every worker map the snapshot before measuring
+            usage = memory_kb()
+            os.write(write_fd, '{} {} {}'.format(elapsed, usage['Rss'], usage['Pss']).encode())
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in pipes:
+        with os.fdopen(read_fd) as f:
+            elapsed, rss, pss = f.read().split()
+        os.waitpid(pid, 0)
+        results.append((float(elapsed), int(rss), int(pss)))
+    return results
+
+
+def report(label, results):
+    elapsed = [r[0] for r in results]
+    rss = [r[1] for r in results]
+    pss = [r[2] for r in results]
+    print('{:<10} load {:7.3f}s   rss/worker {:8.1f} MB   pss/worker {:8.1f} MB'.format(
+        label, np.mean(elapsed), np.mean(rss) / 1024, np.mean(pss) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = DataSources(data_dir=tmp, offline=True)
+        counties = write_counties_csv(sources['counties'].local_path, args.days, args.counties)
+        write_population_csv(sources['population'].local_path, counties['fips'].unique())
+        snapshot_dir = os.path.join(tmp, 'snapshots')
+        Counties.from_sources(sources).to_snapshot(snapshot_dir)
+
+        print('{} rows, {} workers'.format(args.days * args.counties, args.workers))
+        report('read_csv', run_workers(lambda: Counties.from_sources(sources).df, args.workers))
+        report('snapshot', run_workers(lambda: Counties.from_snapshot(snapshot_dir).df, args.workers))
+
+
+if __name__ == '__main__':
+    main()
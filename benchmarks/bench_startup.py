@@ -0,0 +1,141 @@
+'''
+Startup cost of the app: import time, first-request latency and steady-state
+latency per worker, with lazy loading (plain gunicorn) and with --preload
+(the master loads everything once and workers fork from it). Each mode runs
+in a fresh interpreter against prebuilt snapshots, as the Procfile does.
+
+    python benchmarks/bench_startup.py --days 300 --counties 3200 --workers 2
+'''
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_snapshot import memory_kb  # noqa: E402
+from synthetic import setup_app_data  # noqa: E402
+
+STATE_TABLES = [('table-new-cases-state', 'children'), ('table-cases-state', 'children'), ('table-deaths-state', 'children')]
+MAP_NY = [('map-ny', 'figure'), ('table-nyc', 'children')]
+MAP_STATE = [('map-state', 'figure'), ('header-state', 'children'), ('table-states', 'children'), ('state-dropdown', 'options')]
+LINE_STATE = [('line-state', 'figure')]
+
+
+def callback_body(outputs, inputs):
+    if len(outputs) == 1:
+        output, outputs = '{}.{}'.format(*outputs[0]), {'id': outputs[0][0], 'property': outputs[0][1]}
+    else:
+        output = '..' + '...'.join('{}.{}'.format(*output) for output in outputs) + '..'
+        outputs = [{'id': id, 'property': prop} for id, prop in outputs]
+    return {'output': output,
+            'outputs': outputs,
+            'inputs': [{'id': id, 'property': prop, 'value': value} for id, prop, value in inputs],
+            'changedPropIds': ['{}.{}'.format(*inputs[0][:2])],
+            'state': []}
+
+
+def page_requests(date):
+    '''What a browser asks for when the page opens: the layout, then every callback.'''
+    return [('layout', None),
+            ('state tables', callback_body(STATE_TABLES, [('date-state-total', 'date', date)])),
+            ('map ny', callback_body(MAP_NY, [('date-ny', 'date', date)])),
+            ('map Texas', callback_body(MAP_STATE, [('value-state', 'value', 'Texas'), ('date-state', 'date', date)])),
+            ('lines Texas', callback_body(LINE_STATE, [('value-state', 'value', 'Texas'), ('state-dropdown', 'value', []),
+                                                       ('state-metric', 'value', 'new_cases'), ('line-state', 'relayoutData', None)])),
+            ('map New Jersey', callback_body(MAP_STATE, [('value-state', 'value', 'New Jersey'), ('date-state', 'date', date)])),
+            ('lines New Jersey', callback_body(LINE_STATE, [('value-state', 'value', 'New Jersey'), ('state-dropdown', 'value', []),
+                                                            ('state-metric', 'value', 'new_cases'), ('line-state', 'relayoutData', None)]))]
+
+
+def timed_request(client, body):
+    start = time.perf_counter()
+    if body is None:
+        response = client.get('/_dash-layout')
+    else:
+        response = client.post('/_dash-update-component', json=body)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return elapsed
+
+
+def serve(server, date, repeat):
+    client = server.test_client()
+    requests = page_requests(date)
+    first = {label: timed_request(client, body) for label, body in requests}
+    steady = {label: statistics.median(timed_request(client, body) for _ in range(repeat)) for label, body in requests}
+    return {'first': first, 'steady': steady, 'memory': memory_kb()}
+
+
+def child(mode, n_workers, date, repeat):
+    start = time.perf_counter()
+    import covid19_dash
+    result = {'import': time.perf_counter() - start}
+    if mode == 'preload':
+        start = time.perf_counter()
+        covid19_dash.preload()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        result['preload'] = time.perf_counter() - start
+
+    pipes = []
+    for _ in range(n_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, json.dumps(serve(covid19_dash.server, date, repeat)).encode())
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append((pid, read_fd))
+
+    result['workers'] = []
+    for pid, read_fd in pipes:
+        with os.fdopen(read_fd) as f:
+            result['workers'].append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--child', choices=('lazy', 'preload'), help=argparse.SUPPRESS)
+    parser.add_argument('--date', default='2020-10-15', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.workers, args.date, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        # No shared callback cache, so every worker's first request does the work
+        env = dict(os.environ, COVID19_CACHE_TYPE='null', PYTHONWARNINGS='ignore')
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        subprocess.run([sys.executable, os.path.join(root, 'covid19_data.py')], cwd=tmp, env=env, check=True)
+
+        for mode in ('lazy', 'preload'):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode,
+                                     '--workers', str(args.workers), '--repeat', str(args.repeat)],
+                                    cwd=tmp, env=env, check=True, stdout=subprocess.PIPE).stdout
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print('{}: import {:.2f} s{}'.format(mode, result['import'],
+                                                 ', preload {:.2f} s'.format(result['preload']) if 'preload' in result else ''))
+            for i, worker in enumerate(result['workers']):
+                print('  worker {}: Rss {:6.1f} MB  Pss {:6.1f} MB'.format(i, worker['memory']['Rss'] / 1024, worker['memory']['Pss'] / 1024))
+                for label in worker['first']:
+                    print('    {:<16} first {:8.1f} ms   steady {:6.2f} ms'.format(
+                        label, worker['first'][label] * 1000, worker['steady'][label] * 1000))
+
+
+if __name__ == '__main__':
+    main()
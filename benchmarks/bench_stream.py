@@ -0,0 +1,170 @@
+'''
+Ingest of the county table at multiples of a base size: the in-memory build
+(parse the whole CSV, derive the metrics, write the snapshot) against the
+chunked stream straight into the snapshot, and a refresh that appends the
+last day to a loaded snapshot of the days before it, in memory and
+streamed. Each ingest runs in a fresh process that reports its peak RSS,
+what it was before the ingest started, and rows per second. First, a small
+table with missing days, missing fips and a state filter, streamed in tiny
+chunks, must give the in-memory build's snapshot exactly.
+
+    python benchmarks/bench_stream.py --days 300 --counties 3200 --scales 1 5 20
+
+The in-memory build and append only run up to --memory-scale, as they need
+several times the size of the CSV in memory.
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from covid19_data import Counties, read_population, read_snapshot, write_snapshot  # noqa: E402
+from covid19_sources import DataSources  # noqa: E402
+from covid19_stream import write_series_snapshot  # noqa: E402
+from synthetic import write_counties_csv, write_counties_csv_in_blocks, write_population_csv  # noqa: E402
+
+
+def status_kb(key):
+    # VmHWM is this process' peak RSS; ru_maxrss would carry the parent's over exec
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1])
+
+
+def child(args):
+    sources = DataSources(data_dir=args.data_dir, offline=True)
+    if args.child.startswith('append'):
+        # The last day onto the days before, as an hourly refresh does in a
+        # worker that already has the previous version loaded
+        previous = Counties.from_snapshot(args.base_dir)
+    baseline = status_kb('VmHWM')
+    start = time.perf_counter()
+    if args.child == 'stream':
+        Counties.stream_snapshot(sources, args.snapshot_dir)
+    elif args.child == 'memory':
+        Counties.from_sources(sources).to_snapshot(args.snapshot_dir)
+    else:
+        manifest = Counties.source_manifest(sources)
+        rows = Counties.read_appended(sources, previous.manifest)
+        if args.child == 'append-stream':
+            assert previous.stream_append(rows, manifest, sources, args.snapshot_dir)
+        else:
+            previous.append(rows, manifest, sources).to_snapshot(args.snapshot_dir)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'baseline_kb': baseline, 'peak_kb': status_kb('VmHWM')}))
+
+
+def ingest(mode, data_dir, snapshot_dir, base_dir=None):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode, '--data-dir', data_dir,
+               '--snapshot-dir', snapshot_dir]
+    if base_dir is not None:
+        command += ['--base-dir', base_dir]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def take_last_day(path, n_counties):
+    '''Truncates the CSV before its last day and returns that day's rows.'''
+    with open(path, 'rb+') as f:
+        f.seek(max(os.path.getsize(path) - 128 * n_counties, 0))
+        tail = f.read()
+        last = tail.rsplit(b'\n', 2)[-2][:10]
+        offset = f.tell() - len(tail) + tail.index(b'\n' + last) + 1
+        f.truncate(offset)
+    return tail[tail.index(b'\n' + last) + 1:]
+
+
+def check_equal(tmp):
+    '''The stream in 500-row chunks against the in-memory build, on a table with gaps and no fips for some counties.'''
+    data_dir = os.path.join(tmp, 'check')
+    os.makedirs(data_dir)
+    path = os.path.join(data_dir, 'us-counties.csv')
+    counties = write_counties_csv(path, 60, 400)
+    rng = np.random.RandomState(1)
+    counties = counties[rng.rand(len(counties)) > 0.03]
+    counties.loc[counties['county'].isin(['County 0003', 'County 0300']), 'fips'] = np.nan
+    counties.to_csv(path, index=False)
+    write_population_csv(os.path.join(data_dir, 'co-est2019-alldata.csv'), counties['fips'].dropna().unique())
+    sources = DataSources(data_dir=data_dir, offline=True)
+    population = read_population(sources.path('population'))['fips']
+
+    configured = Counties.states
+    for states in ((), ('Texas', 'New Jersey', 'State 05')):
+        Counties.states = states
+        try:
+            full = os.path.join(tmp, 'full.feather')
+            streamed = os.path.join(tmp, 'streamed.feather')
+            write_snapshot(Counties.from_sources(sources).df, full)
+            write_series_snapshot(Counties, Counties.parse_chunks(path, 500), population, streamed, chunk_rows=500)
+            expected, actual = read_snapshot(full), read_snapshot(streamed)
+            pd.testing.assert_frame_equal(expected, actual)
+        finally:
+            Counties.states = configured
+        print('streamed in 500-row chunks == in-memory build: {} rows{}'.format(
+            len(actual), ', states {}'.format(', '.join(states)) if states else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300, help='days at scale 1')
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--memory-scale', type=int, default=5, help='largest scale the in-memory build and append run at')
+    parser.add_argument('--child', choices=['stream', 'memory', 'append-stream', 'append-memory'], help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--base-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        check_equal(tmp)
+        for scale in args.scales:
+            data_dir = os.path.join(tmp, 'x{}'.format(scale))
+            os.makedirs(data_dir)
+            path = os.path.join(data_dir, 'us-counties.csv')
+            fips, rows = write_counties_csv_in_blocks(path, args.days * scale, args.counties)
+            write_population_csv(os.path.join(data_dir, 'co-est2019-alldata.csv'), fips)
+            # A snapshot of every day but the last, for the appends to start from
+            last_day = take_last_day(path, args.counties)
+            base_dir = os.path.join(tmp, 'snapshot-{}-base'.format(scale))
+            ingest('stream', data_dir, base_dir)
+            with open(path, 'ab') as f:
+                f.write(last_day)
+            size = os.path.getsize(path)
+            for mode in ('memory', 'stream', 'append-memory', 'append-stream'):
+                if mode.endswith('memory') and scale > args.memory_scale:
+                    print('{:>3}x {:>10,} rows {:6.0f} MB csv  {:<13}  skipped (over --memory-scale)'.format(
+                        scale, rows, size / 2 ** 20, mode))
+                    continue
+                snapshot_dir = os.path.join(tmp, 'snapshot-{}-{}'.format(scale, mode))
+                result = ingest(mode, data_dir, snapshot_dir, base_dir)
+                print('{:>3}x {:>10,} rows {:6.0f} MB csv  {:<13} {:7.1f} s {:10,.0f} rows/s  peak RSS {:6.0f} MB'
+                      ' ({:.0f} MB before it started)'.format(
+                          scale, rows, size / 2 ** 20, mode, result['seconds'], rows / result['seconds'],
+                          result['peak_kb'] / 1024, result['baseline_kb'] / 1024))
+            if args.memory_scale >= scale:
+                expected = read_snapshot(Counties.snapshot_path('df', os.path.join(tmp, 'snapshot-{}-stream'.format(scale))))
+                for mode in ('memory', 'append-memory', 'append-stream'):
+                    actual = read_snapshot(Counties.snapshot_path('df', os.path.join(tmp, 'snapshot-{}-{}'.format(scale, mode))))
+                    pd.testing.assert_frame_equal(expected, actual)
+                    del actual
+                del expected
+                print('     snapshots identical')
+            for mode in ('base', 'memory', 'stream', 'append-memory', 'append-stream'):
+                shutil.rmtree(os.path.join(tmp, 'snapshot-{}-{}'.format(scale, mode)), ignore_errors=True)
+            shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
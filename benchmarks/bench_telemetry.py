@@ -0,0 +1,80 @@
+'''
+Overhead of the telemetry: the cost of one timer when disabled and enabled,
+and request latency through the Flask test client for a callback answered
+from the local cache (where overhead shows most) and one computed from
+scratch, with telemetry off, on, and on with the Server-Timing header.
+
+    python benchmarks/bench_telemetry.py --days 300 --counties 3200
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import setup_app_data  # noqa: E402
+
+
+def interleaved(client, body, telemetry, modes, repeat, before=None):
+    '''Median latency per mode, alternating modes request by request so drift hits them all alike.'''
+    times = {label: [] for label, _, _ in modes}
+    for _ in range(repeat):
+        for label, enabled, header in modes:
+            telemetry.enabled, telemetry.server_timing = enabled, header
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            response = client.post('/_dash-update-component', json=body)
+            times[label].append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            assert ('Server-Timing' in response.headers) == header
+    return {label: statistics.median(values) for label, values in times.items()}, response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties)
+        # No shared backend, so clearing the local cache forces a miss
+        os.environ['COVID19_CACHE_TYPE'] = 'null'
+        import covid19_dash
+        from bench_startup import MAP_STATE, callback_body
+        from covid19_telemetry import Telemetry
+        telemetry = covid19_dash.telemetry
+
+        for label, enabled in (('disabled', False), ('enabled', True)):
+            probe = Telemetry(enabled=enabled)
+
+            def timed():
+                with probe.phase('filter'):
+                    pass
+            per_call = min(timeit.repeat(timed, number=100000, repeat=5)) / 100000
+            print('timer {:<9} {:6.0f} ns per phase'.format(label, per_call * 1e9))
+
+        client = covid19_dash.server.test_client()
+        date = covid19_dash.available_dates(covid19_dash.us_counties)[-1]
+        body = callback_body(MAP_STATE, [('value-state', 'value', 'Texas'), ('date-state', 'date', date)])
+        client.get('/_dash-layout')
+        client.post('/_dash-update-component', json=body)
+
+        modes = [('off', False, False), ('on', True, False), ('on + header', True, True)]
+        for case, before, repeat in (('local hit', None, args.repeat),
+                                     ('miss', covid19_dash.callback_cache.clear, max(args.repeat // 5, 5))):
+            results, response = interleaved(client, body, telemetry, modes, repeat, before)
+            print('Texas map, {:<9}'.format(case) + ''.join(
+                '  {} {:7.3f} ms ({:+.1f}%)'.format(label, results[label] * 1000, (results[label] / results['off'] - 1) * 100)
+                for label, _, _ in modes))
+        print('Server-Timing: {}'.format(response.headers['Server-Timing']))
+
+
+if __name__ == '__main__':
+    main()
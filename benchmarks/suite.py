@@ -0,0 +1,182 @@
+'''
+Every loader and callback against synthetic data at a given scale, offline:
+wall time (best and median of --repeat), peak traced memory and response
+bytes per case, written as JSON so two runs can be compared.
+
+    python benchmarks/suite.py --days 300 --counties 3200 --output before.json
+    python benchmarks/suite.py --days 300 --counties 3200 --output after.json
+    python benchmarks/suite.py --compare before.json after.json
+
+Callbacks run without the callback cache (`.uncached`) and include the JSON
+serialization Dash does before responding. Peak memory is what tracemalloc
+sees: Python and numpy allocations, not pyarrow's memory pool.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import ROOT, setup_app_data  # noqa: E402
+
+
+def serialize(outputs):
+    return json.dumps(outputs, cls=PlotlyJSONEncoder)
+
+
+def measure(fn, repeat):
+    '''Times fn() `repeat` times, then runs it once more under tracemalloc.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time_min_ms': min(times) * 1000,
+            'time_median_ms': statistics.median(times) * 1000,
+            'peak_kb': peak / 1024,
+            'bytes': len(result) if isinstance(result, str) else None}
+
+
+def cases(tmp):
+    '''(name, fn) for every loader and callback; callbacks return their serialized response.'''
+    import covid19_dash
+    from covid19_data import Counties, NYCData, States
+
+    sources = covid19_dash.sources
+    date = covid19_dash.yesterday()
+    index = covid19_dash.us_counties.index
+    by_size = sorted(index.state_bounds, key=lambda state: (len(index.counties(state)), state))
+    smallest, largest = by_size[0], by_size[-1]
+
+    def load_snapshot(cls, snapshot_dir):
+        dataset = cls.from_snapshot(snapshot_dir)
+        dataset.prepare()
+        return dataset
+
+    for cls in (Counties, States, NYCData):
+        snapshot_dir = os.path.join(tmp, 'suite', cls.name)
+        cls.from_sources(sources).to_snapshot(snapshot_dir)
+        yield 'load {} from csv'.format(cls.name), lambda cls=cls: cls.from_sources(sources)
+        yield 'load {} from snapshot'.format(cls.name), lambda cls=cls, path=snapshot_dir: load_snapshot(cls, path)
+
+    rankings = covid19_dash.states.rankings
+    for column in ('new_cases', 'cases', 'deaths'):
+        yield 'sort_state_data {}'.format(column), lambda column=column: covid19_dash.sort_state_data(rankings, column, date)
+
+    def state_tables():
+        # state_table is lru-cached on its own; start each run cold
+        covid19_dash.state_table.cache_clear()
+        return serialize(covid19_dash.update_state_tables.uncached(date))
+    yield 'update_state_tables', state_tables
+    yield 'update_map_ny', lambda: serialize(covid19_dash.update_map_ny.uncached(date))
+
+    for size, state in (('smallest', smallest), ('largest', largest)):
+        label = '{} ({}, {} counties)'.format(size, state, len(index.counties(state)))
+        yield 'update_map_state {}'.format(label), lambda state=state: serialize(covid19_dash.update_map_state.uncached(state, date))
+        for selection, counties in (('no', ()), ('all', tuple(index.counties(state)))):
+            yield 'update_state_lines {}, {} counties selected'.format(label, selection), \
+                lambda state=state, counties=counties: serialize(covid19_dash.state_lines.uncached(state, counties, 'new_cases', None))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import numpy
+    import pandas
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_app_data(tmp, args.days, args.counties, synthetic_states=True, nyc_days=args.nyc_days or args.days)
+        # Callbacks run uncached, so keep the app from writing a cache directory
+        os.environ['COVID19_CACHE_TYPE'] = 'null'
+        results = {}
+        for name, fn in cases(tmp):
+            results[name] = measure(fn, args.repeat)
+            print('{:<72} {:9.2f} ms best {:9.2f} ms median {:10.0f} KB peak {:>10}'.format(
+                name, results[name]['time_min_ms'], results[name]['time_median_ms'], results[name]['peak_kb'],
+                '' if results[name]['bytes'] is None else '{:.0f} KB'.format(results[name]['bytes'] / 1024)))
+
+    return {'meta': {'days': args.days, 'counties': args.counties, 'nyc_days': args.nyc_days or args.days,
+                     'repeat': args.repeat, 'commit': git_commit(),
+                     'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(), 'pandas': pandas.__version__, 'numpy': numpy.__version__,
+                     'machine': platform.machine()},
+            'results': results}
+
+
+def compare(before_path, after_path, threshold):
+    '''
+    Prints the change in time, peak memory and bytes per case, and returns
+    the cases whose best time got slower by more than `threshold` (and by
+    more than half a millisecond). Best times are far less noisy than medians
+    on a shared machine.
+    '''
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    for key in ('days', 'counties', 'nyc_days'):
+        if before['meta'][key] != after['meta'][key]:
+            print('warning: runs differ in {}: {} vs {}'.format(key, before['meta'][key], after['meta'][key]))
+
+    def change(old, new):
+        return '{:+7.1f}%'.format((new / old - 1) * 100) if old else '    n/a'
+
+    slower = []
+    print('{:<72} {:>10} {:>10} {:>8}   {:>8}   {:>8}'.format('', 'before ms', 'after ms', 'best', 'peak', 'bytes'))
+    for name in before['results']:
+        if name not in after['results']:
+            print('{:<72} missing from {}'.format(name, after_path))
+            continue
+        old, new = before['results'][name], after['results'][name]
+        if new['time_min_ms'] > old['time_min_ms'] * (1 + threshold) and new['time_min_ms'] - old['time_min_ms'] > 0.5:
+            slower.append(name)
+        print('{:<72} {:10.2f} {:10.2f} {} {} {}{}'.format(
+            name, old['time_min_ms'], new['time_min_ms'], change(old['time_min_ms'], new['time_min_ms']),
+            change(old['peak_kb'], new['peak_kb']),
+            change(old['bytes'], new['bytes']) if old['bytes'] is not None and new['bytes'] is not None else '       ',
+            '  <- slower' if name in slower else ''))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--counties', type=int, default=3200)
+    parser.add_argument('--nyc-days', type=int, help='days of NYC data (default: --days)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown of the best time flagged by --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
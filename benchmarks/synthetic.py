@@ -0,0 +1,158 @@
+'''Synthetic NYT-style county and state data, NYC borough data and county geometry for the benchmarks.'''
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def state_names():
+    # Texas and New Jersey keep their real FIPS prefixes
+    prefixes = ['{:02d}'.format(p) for p in range(1, 80) if p not in (34, 48)][:53]
+    names = ['Texas', 'New Jersey'] + ['State {}'.format(p) for p in prefixes]
+    return names, ['48', '34'] + prefixes
+
+
+def counties_frame(days, n_counties, seed=0):
+    # Texas gets its real 254 counties so the largest state is realistic, and
+    # New Jersey its 21; fewer than 275 counties are split between the two
+    if n_counties < 2:
+        raise ValueError('need at least 2 counties, for Texas and New Jersey')
+    texas = min(254, n_counties * 254 // 275)
+    new_jersey = min(21, n_counties - texas)
+    rng = np.random.RandomState(seed)
+    # Ends on the last day of the fixtures, which the app opens on
+    dates = pd.date_range(end='2020-10-15', periods=days).strftime('%Y-%m-%d')
+    names, prefixes = state_names()
+    state_index = rng.randint(2, len(names), n_counties)
+    state_index[:texas] = 0
+    state_index[texas:texas + new_jersey] = 1
+    county_state = np.array(names)[state_index]
+    seq = pd.Series(state_index).groupby(state_index).cumcount().values
+    fips = np.array(['{}{:03d}'.format(prefixes[s], 2 * n + 1) for s, n in zip(state_index, seq)])
+    county_names = np.array(['County {:04d}'.format(i) for i in range(n_counties)])
+    cases = rng.randint(0, 50, (days, n_counties)).cumsum(axis=0)
+    deaths = rng.randint(0, 2, (days, n_counties)).cumsum(axis=0)
+    return pd.DataFrame({'date': np.repeat(dates, n_counties),
+                         'county': np.tile(county_names, days),
+                         'state': np.tile(county_state, days),
+                         'fips': np.tile(fips, days),
+                         'cases': cases.ravel(),
+                         'deaths': deaths.ravel()})
+
+
+def write_counties_csv(path, days, n_counties, seed=0):
+    counties = counties_frame(days, n_counties, seed)
+    counties.to_csv(path, index=False)
+    return counties
+
+
+def write_counties_csv_in_blocks(path, days, n_counties, block_days=30, seed=0):
+    '''
+    A county table too large to build at once, written `block_days` at a
+    time in the NYT layout (rows by date, then state and county). Returns
+    the fips codes and the number of rows.
+    '''
+    rng = np.random.RandomState(seed)
+    first = counties_frame(1, n_counties, seed)
+    dates = pd.date_range(end='2020-10-15', periods=days).strftime('%Y-%m-%d')
+    order = np.lexsort((first['county'].values, first['state'].values))
+    first = first.take(order).reset_index(drop=True)
+    cases, deaths = np.zeros(n_counties, dtype=np.int64), np.zeros(n_counties, dtype=np.int64)
+    with open(path, 'w') as f:
+        for start in range(0, days, block_days):
+            block = dates[start:start + block_days]
+            daily_cases = rng.randint(0, 50, (len(block), n_counties)).cumsum(axis=0) + cases
+            daily_deaths = rng.randint(0, 2, (len(block), n_counties)).cumsum(axis=0) + deaths
+            cases, deaths = daily_cases[-1], daily_deaths[-1]
+            pd.DataFrame({'date': np.repeat(block, n_counties),
+                          'county': np.tile(first['county'].values, len(block)),
+                          'state': np.tile(first['state'].values, len(block)),
+                          'fips': np.tile(first['fips'].values, len(block)),
+                          'cases': daily_cases.ravel(),
+                          'deaths': daily_deaths.ravel()}).to_csv(f, index=False, header=start == 0)
+    return first['fips'].unique(), days * n_counties
+
+
+def write_states_csv(path, counties):
+    '''us-states.csv for a synthetic county table: every state's counties summed per day.'''
+    names, prefixes = state_names()
+    states = counties.groupby(['date', 'state'], sort=True)[['cases', 'deaths']].sum().reset_index()
+    states.insert(2, 'fips', states['state'].map(dict(zip(names, prefixes))))
+    states.to_csv(path, index=False)
+    return states
+
+
+def write_population_csv(path, fips_codes, seed=0):
+    '''Census-style estimates for these counties, every synthetic state and every state in the fixtures.'''
+    rng = np.random.RandomState(seed)
+    names, prefixes = state_names()
+    fixture_states = pd.read_csv(os.path.join(ROOT, 'fixtures', 'us-states.csv'), dtype=str)[['state', 'fips']]
+    states = dict(zip(names, prefixes))
+    states.update(zip(fixture_states['state'], fixture_states['fips']))
+    codes = sorted(set(code for code in fips_codes if isinstance(code, str)))
+    rows = [('040', prefix, '000', name) for name, prefix in states.items()]
+    rows += [('050', code[:2], code[2:], names[prefixes.index(code[:2])]) for code in codes if code[:2] in prefixes]
+    df = pd.DataFrame(rows, columns=['SUMLEV', 'STATE', 'COUNTY', 'STNAME'])
+    df['POPESTIMATE2019'] = rng.randint(10000, 1000000, len(df))
+    df.to_csv(path, index=False)
+
+
+def write_nyc_csv(path, days, seed=0):
+    '''A data-by-day.csv with the columns of the fixture, covering `days` days.'''
+    with open(os.path.join(ROOT, 'fixtures', 'data-by-day.csv')) as f:
+        columns = f.readline().strip().split(',')
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range(end='2020-10-15', periods=days).strftime('%m/%d/%Y')
+    df = pd.DataFrame(rng.randint(0, 400, (days, len(columns) - 1)), columns=columns[1:])
+    df.insert(0, columns[0], dates)
+    df.to_csv(path, index=False)
+
+
+def write_geojson(path, fips_codes, vertices=60, seed=0):
+    '''Noisy polygons laid out state by state, roughly the size of real county outlines.'''
+    rng = np.random.RandomState(seed)
+    by_state = {}
+    for fips in sorted(set(fips_codes)):
+        by_state.setdefault(fips[:2], []).append(fips)
+
+    features = []
+    for k, (prefix, codes) in enumerate(sorted(by_state.items())):
+        cx, cy = -125 + (k % 10) * 6, 25 + (k // 10) * 4
+        columns = int(math.ceil(math.sqrt(len(codes))))
+        for j, fips in enumerate(codes):
+            x0, y0 = cx + (j % columns) * 0.4, cy + (j // columns) * 0.4
+            angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+            radius = 0.18 * (1 + 0.1 * rng.randn(vertices))
+            ring = np.round(np.column_stack([x0 + radius * np.cos(angles), y0 + radius * np.sin(angles)]), 6).tolist()
+            ring.append(ring[0])
+            features.append({'type': 'Feature', 'id': fips, 'properties': {'STATE': prefix, 'COUNTY': fips[2:]},
+                             'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+def setup_app_data(tmp, days, n_counties, synthetic_states=False, nyc_days=None):
+    '''
+    Points the app at synthetic county data in `tmp`, with the small NYC and
+    state fixtures unless `synthetic_states` (states summed from the
+    counties) or `nyc_days` ask for data at the same scale. The data
+    directories are read at import time, so call this before importing any
+    covid19_* module.
+    '''
+    os.environ.update({'COVID19_DATA_DIR': tmp,
+                       'COVID19_OFFLINE': '1',
+                       'COVID19_SNAPSHOT_DIR': os.path.join(tmp, 'snapshots')})
+    for name in ('data-by-day.csv', 'tests.csv', 'us-states.csv'):
+        shutil.copy(os.path.join(ROOT, 'fixtures', name), tmp)
+    counties = write_counties_csv(os.path.join(tmp, 'us-counties.csv'), days, n_counties)
+    if synthetic_states:
+        write_states_csv(os.path.join(tmp, 'us-states.csv'), counties)
+    if nyc_days:
+        write_nyc_csv(os.path.join(tmp, 'data-by-day.csv'), nyc_days)
+    write_population_csv(os.path.join(tmp, 'co-est2019-alldata.csv'), counties['fips'].unique())
+    write_geojson(os.path.join(tmp, 'geojson-counties-fips.json'), counties['fips'].unique())
@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from plotly.utils import PlotlyJSONEncoder
+
+from covid19_telemetry import telemetry
+
+# Bump when serialize() changes, so the shared backend's entries in the old format are not reused
+PAYLOAD_FORMAT = 2
+
+
+def serialize(outputs):
+    '''
+    JSON of a callback's outputs. The values of several outputs are written
+    one to a line, so response_body() can pick them apart without decoding;
+    JSON escapes every newline inside a value.
+    '''
+    if isinstance(outputs, (list, tuple)):
+        return '[{}]'.format('\n,'.join(json.dumps(value, cls=PlotlyJSONEncoder, separators=(',', ':'))
+                                         for value in outputs))
+    return json.dumps(outputs, cls=PlotlyJSONEncoder, separators=(',', ':'))
+
+
+def response_body(outputs, payload, multi):
+    '''
+    The JSON Dash sends for a serialized payload of these (id, property)
+    outputs, assembled from the payload's text. `multi` is whether the
+    callback was registered with a list of outputs.
+    '''
+    values = payload[1:-1].split('\n,') if multi else [payload]
+    props = OrderedDict()
+    for (component_id, prop), value in zip(outputs, values):
+        props.setdefault(component_id, []).append('{}:{}'.format(json.dumps(prop), value))
+    response = ','.join('{}:{{{}}}'.format(json.dumps(component_id), ','.join(fields))
+                        for component_id, fields in props.items())
+    return '{{"multi":true,"response":{{{}}}}}'.format(response).encode()
+
+
+class CallbackCache:
+    '''
+    Serialized callback outputs keyed by (callback, inputs, dataset versions).
+
+    An in-process LRU sits in front of a shared Flask-Caching backend, so a
+    view rendered by one gunicorn worker is served by the others from JSON
+    without touching pandas or Plotly. A refreshed dataset changes the
+    version part of every key, which retires the old entries. The LRU is
+    bounded by the total size of its payloads, since a state map weighs a
+    hundred times a table. The app answers hits with the stored text itself
+    (see response_body()); json.loads() is only for direct calls.
+    '''
+    def __init__(self, backend=None, max_bytes=64 * 2 ** 20, timeout=None):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.local = OrderedDict()
+        self.local_bytes = 0
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def key(self, name, args, versions):
+        digest = hashlib.sha1(repr((PAYLOAD_FORMAT, name, args, versions)).encode()).hexdigest()
+        return 'callback:{}:{}'.format(name, digest)
+
+    def memoize(self, *datasets):
+        '''Caches a callback whose output depends only on its inputs and these LiveDatasets.'''
+        def decorator(callback):
+            @functools.wraps(callback)
+            def wrapper(*args):
+                with telemetry.callback(callback.__name__):
+                    payload = self.payload(wrapper, args)
+                    with telemetry.phase('deserialize'):
+                        return json.loads(payload)
+
+            wrapper.uncached = callback
+            wrapper.datasets = datasets
+            return wrapper
+        return decorator
+
+    def payload(self, callback, args):
+        '''
+        The serialized output of a memoized `callback` for `args`, from the
+        local LRU, the shared backend or by calling it. Call inside
+        telemetry.callback().
+        '''
+        name = callback.__name__
+        # Reading current also revalidates a stale dataset in the background
+        versions = tuple(dataset.current.version for dataset in callback.datasets)
+        self._retire(name, versions)
+        key = self.key(name, args, versions)
+
+        payload = self._get_local(key)
+        if payload is not None:
+            self.local_hits += 1
+            telemetry.result('local')
+            return payload
+        with telemetry.phase('shared cache'):
+            payload = self.backend.get(key) if self.backend is not None else None
+        if payload is not None:
+            self.shared_hits += 1
+            telemetry.result('shared')
+        else:
+            self.misses += 1
+            telemetry.result('miss')
+            outputs = callback.uncached(*args)
+            with telemetry.phase('serialize'):
+                payload = serialize(outputs)
+            if self.backend is not None:
+                with telemetry.phase('shared cache'):
+                    self.backend.set(key, payload, timeout=self.timeout)
+        self._set_local(key, payload)
+        return payload
+
+    def _retire(self, name, versions):
+        # Drop this callback's local entries as soon as its data changes
+        if self._versions.get(name, versions) != versions:
+            prefix = 'callback:{}:'.format(name)
+            with self._lock:
+                for key in [key for key in self.local if key.startswith(prefix)]:
+                    self.local_bytes -= len(self.local.pop(key))
+        self._versions[name] = versions
+
+    def _get_local(self, key):
+        with self._lock:
+            payload = self.local.get(key)
+            if payload is not None:
+                self.local.move_to_end(key)
+            return payload
+
+    def _set_local(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self.local.pop(key, None)
+            if previous is not None:
+                self.local_bytes -= len(previous)
+            self.local[key] = payload
+            self.local_bytes += len(payload)
+            while self.local_bytes > self.max_bytes:
+                self.local_bytes -= len(self.local.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self.local.clear()
+            self.local_bytes = 0
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.local_hits + self.shared_hits) / lookups if lookups else 0.0,
+                'entries': len(self.local),
+                'bytes': self.local_bytes}
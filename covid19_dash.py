@@ -2,497 +2,660 @@ import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
+import os
+import time
+import flask
 from flask_caching import Cache
+from dash.exceptions import PreventUpdate
 from datetime import date, datetime, timedelta
-from urllib.request import urlopen
-import json
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    counties = json.load(response)
-
+from functools import lru_cache
+from covid19_cache import CallbackCache, response_body
+from covid19_export import EXPORT_ON_REFRESH, StaticViews, start_export, view_key
+from covid19_sources import DataSources
+from covid19_data import DatasetCache, NYCData, Counties, States, unique_dates
+from covid19_figures import ChoroplethFactory, CountyGeometry, CountyLineFactory, visible_range
+from covid19_index import format_counts
+from covid19_metrics import METRICS
+from covid19_telemetry import memory_kb, telemetry
+
+# Nothing below loads data at import time: datasets load on first attribute
+# access, the geometry and the startup layout on first use. preload() loads
+# everything up front, e.g. in the gunicorn master (see gunicorn.conf.py).
+sources = DataSources()
+datasets = DatasetCache(sources)
+nyc = datasets.live(NYCData)
+us_counties = datasets.live(Counties)
+states = datasets.live(States)
+if EXPORT_ON_REFRESH:
+    # A swap retires the static export; render one for the new versions in the background
+    datasets.on_swap.append(lambda live: start_export())
+county_lines = CountyLineFactory()
+borough_lines = CountyLineFactory(legend='Borough')
+
+# NYC line charts: graph id -> (NYCData frame, y-axis label)
+NYC_LINES = {'line-nyc': ('cases_df', 'New Cases'),
+             'line-nyc-hosp': ('hospitalized_df', 'Hospitalizations'),
+             'line-nyc-deaths': ('deaths_df', 'Deaths')}
+
+# Counties the state line chart starts with; the dropdown keeps them when another state is picked
+STATE_COUNTIES = ['Somerset',' Middlesex']
+
+# Outputs of the callbacks the static export renders, as registered in create_app()
+STATE_TABLES_OUTPUTS = [('table-new-cases-state', 'children'), ('table-cases-state', 'children'),
+                        ('table-deaths-state', 'children')]
+MAP_NY_OUTPUTS = [('map-ny', 'figure'), ('table-nyc', 'children')]
+MAP_STATE_OUTPUTS = [('map-state', 'figure'), ('header-state', 'children'), ('table-states', 'children'),
+                     ('state-dropdown', 'options')]
+LINE_STATE_OUTPUTS = [('line-state', 'figure')]
 
 external_stylesheets = [dbc.themes.BOOTSTRAP, 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-app.title = 'COVID19 Dashboard'
-server = app.server
 
-cache = Cache(app.server, config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': 'cache-directory'
-})
+# Shared by every worker; set COVID19_CACHE_TYPE=redis and CACHE_REDIS_URL to share across dynos
+CACHE_CONFIG = {
+    'CACHE_TYPE': os.environ.get('COVID19_CACHE_TYPE', 'filesystem'),
+    'CACHE_DIR': 'cache-directory',
+    'CACHE_REDIS_URL': os.environ.get('CACHE_REDIS_URL'),
+    'CACHE_THRESHOLD': 1000
+}
 
 TIMEOUT = 60
 
+# Serialized outputs each worker keeps in memory, in MB
+LOCAL_CACHE_MB = int(os.environ.get('COVID19_LOCAL_CACHE_MB', 64))
 
-class NYCData:
-    @cache.memoize(timeout=TIMEOUT)
-    def __init__(self):
-        self.nyc_boro_url = 'https://raw.githubusercontent.com/nychealth/coronavirus-data/master/trends/data-by-day.csv'
-        self.nyc_tests_url = 'https://raw.githubusercontent.com/nychealth/coronavirus-data/master/trends/tests.csv'
-        self.nyc_boro_df = pd.read_csv(self.nyc_boro_url)
-        self.nyc_tests_df = pd.read_csv(self.nyc_tests_url)
-
-        self.borough_to_fips = {'Bronx': '36005',
-                                'Brooklyn': '36047',
-                                'Queens': '36081',
-                                'Manhattan': '36061',
-                                'Staten Island': '36085'}
-
-        self.cases_df = self.clean_nyc_data_by_metric('_CASE_COUNT')
-        self.hospitalized_df = self.clean_nyc_data_by_metric('_HOSPITALIZED_COUNT')
-        self.deaths_df = self.clean_nyc_data_by_metric('_DEATH_COUNT')
-
-    def clean_nyc_data_by_metric(self, metric):
-        column_filter = self.nyc_boro_df.columns.to_series().str.endswith(metric)
-        column_filter.date_of_interest = True
-        columns = self.nyc_boro_df.columns[column_filter]
-        nyc_cases = self.nyc_boro_df[columns]
-        '''
-        Column names after filtering: 
-        ['date_of_interest', 'BX_CASE_COUNT', 'BK_CASE_COUNT', 'MN_CASE_COUNT',
-       'QN_CASE_COUNT', 'SI_CASE_COUNT']
-        '''
-
-        original_prefixes = {'da': 'date', 'BX': 'Bronx', 'BK': 'Brooklyn', 'MN': 'Manhattan', 'QN': 'Queens', 'SI': 'Staten Island'}
-       
-        new_column_names, columns_to_keep = [], []
-        for column_name in nyc_cases.columns:
-            prefix = column_name[:2]
-            if prefix in original_prefixes:
-                new_column_names.append(original_prefixes[prefix])
-                columns_to_keep.append(original_prefixes[prefix])
-            else:
-                new_column_names.append(column_name)
-
-        nyc_cases.columns = new_column_names
-        nyc_cases = nyc_cases[columns_to_keep]
-
-        nyc_cases_tidy = pd.melt(nyc_cases, ["date"], var_name="county", value_name="new_cases")
-        nyc_cases_tidy['state'] = ['New York' for i in range(len(nyc_cases_tidy))]
-        nyc_cases_tidy['fips'] = [self.borough_to_fips[borough] for borough in nyc_cases_tidy['county'].values]
-        nyc_cases_tidy['date'] = pd.to_datetime(nyc_cases_tidy['date']).dt.strftime('%Y-%m-%d')
-        return nyc_cases_tidy
-
-
-class Counties:
-    @cache.memoize(timeout=TIMEOUT)
-    def __init__(self):
-        # counties_url = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv'
-        counties_url = 'https://raw.githubusercontent.com/tlzhu19/covid19-data/master/us-counties-filtered.csv'
-        counties_df = pd.read_csv(counties_url, dtype=str)
-
-        types_dict = {'cases': int, 'deaths': int}
-        for col, col_type in types_dict.items():
-            counties_df[col] = counties_df[col].astype(col_type)
-
-        counties_df['date'] = pd.to_datetime(counties_df['date']).dt.strftime('%Y-%m-%d')
-        counties_df['new_cases'] = counties_df.sort_values(['state', 'county', 'date']).groupby('state')['cases'].diff()
-
-        self.df = counties_df
-
-class States:
-    @cache.memoize(timeout=TIMEOUT)
-    def __init__(self):
-        states_url = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'
-        states_df = pd.read_csv(states_url)
-
-        types_dict = {'cases': int, 'deaths': int}
-        for col, col_type in types_dict.items():
-            states_df[col] = states_df[col].astype(col_type)
-
-        states_df['date'] = pd.to_datetime(states_df['date']).dt.strftime('%Y-%m-%d')
-        states_df['new_cases'] = states_df.sort_values(['state', 'date']).groupby('state')['cases'].diff()
-
-        self.df = states_df
-
-
-# FIGURES
-## NYC
-# YESTERDAY = (date.today() - timedelta(2)).strftime("%Y-%m-%d")
-nyc = NYCData()
-YESTERDAY = nyc.cases_df['date'].unique()[-1]
-nyc_test = nyc.cases_df[nyc.cases_df['date'] == YESTERDAY]
-nyc_new_cases = nyc_test["new_cases"]
-max_new_cases = max(nyc_new_cases) if len(nyc_new_cases) else 0
-fig = px.choropleth(nyc_test,
-                    geojson=counties,
-                    locations='fips',
-                    color='new_cases',
-                    color_continuous_scale="Blues",
-                    range_color=(0, max_new_cases),
-                    scope="usa",
-                    hover_name="county",
-                    hover_data=["date", "new_cases"],
-                    labels={'new_cases':'new cases'},
-                   )
-fig.update_geos(fitbounds="locations", visible=False)
-fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
-fig.update_coloraxes(showscale=False)
-
-
-fig_nyc = px.line(nyc.cases_df, x="date", y="new_cases", color='county',
-                  labels={'date': 'Date', 'new_cases': 'New Cases', 'county': 'Borough'})
-
-fig_nyc_hosp = px.line(nyc.hospitalized_df, x="date", y="new_cases", color='county',
-                  labels={'date': 'Date', 'new_cases': 'Hospitalizations', 'county': 'Borough'})
-
-fig_nyc_deaths = px.line(nyc.deaths_df, x="date", y="new_cases", color='county',
-                  labels={'date': 'Date', 'new_cases': 'Deaths', 'county': 'Borough'})
-
-nyc_dates = [d for d in nyc.cases_df.date.unique()]
-
-
-## NJ
-us_counties = Counties()
-nj_test = us_counties.df[(us_counties.df.state=='New Jersey') & (us_counties.df.date==YESTERDAY)]
-fig_nj = px.choropleth(nj_test,
-                    geojson=counties,
-                    locations='fips',
-                    color='new_cases',
-                    color_continuous_scale="Blues",
-                    range_color=(0, max(nj_test["new_cases"])),
-                    scope="usa",
-                    hover_name="county",
-                    hover_data=["date", "new_cases"],
-                    labels={'new_cases':'new cases'}
-                   )
-fig_nj.update_geos(fitbounds="locations", visible=False)
-fig_nj.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
-fig_nj.update_coloraxes(showscale=False)
-
-nj_df = us_counties.df[(us_counties.df.state=='New Jersey') & (us_counties.df.new_cases >= 0) & (us_counties.df.county != 'Unknown')]
-fig_nj_line = go.Figure()
-
-counties_dates = [d for d in us_counties.df.date.unique()]
-
-## States
-states = States()
-
-def sort_state_data(df, column_name, input_date=YESTERDAY, n=50):
-    new_df = df[df['date']==input_date].sort_values(column_name, ascending=False).head(n)
-    new_df[' '] = range(1, n+1)
-    new_df[column_name] = [ "{:,}".format(int(d)) for d in new_df[column_name].values ]
-    return new_df
-
-top_n_new = sort_state_data(states.df, 'new_cases')
-top_n_total = sort_state_data(states.df, 'cases')
-top_n_deaths = sort_state_data(states.df, 'deaths')
-
-states_dates = states.df.date.unique()
+callback_cache = CallbackCache(max_bytes=LOCAL_CACHE_MB * 2 ** 20, timeout=TIMEOUT)
 
-# LAYOUT
-app.layout = html.Div(children=[
 
-    html.Div(
-        [
-            html.Div(
-                [
-                    html.H1(children='US COVID19 Dashboard'),
-                ],
-            ),
-            html.Div(
-                [
-                    html.H3(children='US States'),
-                    dcc.DatePickerSingle(
-                                            id='date-state-total',
-                                            min_date_allowed=states_dates[0],
-                                            max_date_allowed=states_dates[-1],
-                                            initial_visible_month=states_dates[-1],
-                                            date=states_dates[-1]
-                                        ),
-                    dbc.Row(
-                        [
-                            dbc.Col([
-                                dbc.CardHeader("New Cases"),
-                                dbc.Card(
-                                    dbc.Spinner(
-                                        html.Div(
-                                            dbc.Table.from_dataframe(top_n_new[[' ', 'state', 'new_cases']],  
-                                                className='text-right',
+@lru_cache(maxsize=None)
+def county_geometry():
+    return CountyGeometry(sources.load_json('geojson'))
+
+
+@lru_cache(maxsize=None)
+def choropleths():
+    return ChoroplethFactory(county_geometry())
+
+
+@lru_cache(maxsize=8)
+def _dates(live, version):
+    df = live.current.cases_df if live is nyc else live.current.df
+    return unique_dates(df['date'])
+
+
+def available_dates(live):
+    return _dates(live, live.current.version)
+
+
+def yesterday():
+    # YESTERDAY = (date.today() - timedelta(2)).strftime("%Y-%m-%d")
+    return available_dates(nyc)[-1]
+
+
+def sort_state_data(rankings, column_name, input_date=None, n=50):
+    return rankings.top(input_date or yesterday(), column_name, n)
+
+
+def county_table(df):
+    # Counts stay integer-typed in the data; they only become strings here
+    df = df.sort_values('new_cases', ascending=False)
+    return dbc.Table.from_dataframe(pd.DataFrame({'county': df['county'].astype(str).values,
+                                                  'new_cases': format_counts(df['new_cases'].to_numpy(dtype=float, na_value=np.nan))}))
+
+
+@lru_cache(maxsize=256)
+def state_table(version, input_date, column_name):
+    # version keys the cache to one dataset, so a refresh never serves old tables
+    df = sort_state_data(states.current.rankings, column_name, input_date)
+    return dbc.Table.from_dataframe(df, className='text-right')
+
+
+# LAYOUT
+@lru_cache(maxsize=2)
+def layout_for(versions):
+    # FIGURES
+    ## NYC
+    YESTERDAY = yesterday()
+    nyc_test = nyc.cases_df[nyc.cases_df['date'] == YESTERDAY]
+    fig = choropleths().figure(nyc_test)
+
+
+    fig_nyc = nyc_line('line-nyc', None)
+
+    fig_nyc_hosp = nyc_line('line-nyc-hosp', None)
+
+    fig_nyc_deaths = nyc_line('line-nyc-deaths', None)
+
+    nyc_dates = available_dates(nyc)
+
+
+    ## NJ
+    nj_test = us_counties.index.state_date('New Jersey', YESTERDAY)
+    fig_nj = choropleths().figure(nj_test)
+
+    fig_nj_line = go.Figure()
+
+    counties_dates = available_dates(us_counties)
+
+    ## States
+    top_n_new = sort_state_data(states.rankings, 'new_cases', YESTERDAY)
+    top_n_total = sort_state_data(states.rankings, 'cases', YESTERDAY)
+    top_n_deaths = sort_state_data(states.rankings, 'deaths', YESTERDAY)
+
+    states_dates = available_dates(states)
+
+    return html.Div(children=[
+
+        html.Div(
+            [
+                html.Div(
+                    [
+                        html.H1(children='US COVID19 Dashboard'),
+                    ],
+                ),
+                html.Div(
+                    [
+                        html.H3(children='US States'),
+                        dcc.DatePickerSingle(
+                                                id='date-state-total',
+                                                min_date_allowed=states_dates[0],
+                                                max_date_allowed=states_dates[-1],
+                                                initial_visible_month=states_dates[-1],
+                                                date=states_dates[-1]
+                                            ),
+                        dbc.Row(
+                            [
+                                dbc.Col([
+                                    dbc.CardHeader("New Cases"),
+                                    dbc.Card(
+                                        dbc.Spinner(
+                                            html.Div(
+                                                dbc.Table.from_dataframe(top_n_new[[' ', 'state', 'new_cases']],  
+                                                    className='text-right',
                                                 
-                                            ), id='table-new-cases-state'),
-                                        color='primary'),
-                                    style={'height': '300px', 'overflow-y': 'auto'}
-                                )
-                            ]),
-                            dbc.Col([
-                                dbc.CardHeader("Total Cases"),
-                                dbc.Card(
-                                    dbc.Spinner(
-                                        html.Div(
-                                            dbc.Table.from_dataframe(top_n_total[[' ', 'state', 'cases']], 
-                                                className='text-right',
+                                                ), id='table-new-cases-state'),
+                                            color='primary'),
+                                        style={'height': '300px', 'overflow-y': 'auto'}
+                                    )
+                                ]),
+                                dbc.Col([
+                                    dbc.CardHeader("Total Cases"),
+                                    dbc.Card(
+                                        dbc.Spinner(
+                                            html.Div(
+                                                dbc.Table.from_dataframe(top_n_total[[' ', 'state', 'cases']], 
+                                                    className='text-right',
                                                 
-                                            ), id='table-cases-state'),
-                                        color='primary'),
-                                    style={'height': '300px', 'overflow-y': 'auto'}
-                                )
-                            ]),
-                            dbc.Col([
-                                dbc.CardHeader("Total Deaths"),
-                                dbc.Card(
-                                    dbc.Spinner(
-                                        html.Div(
-                                            dbc.Table.from_dataframe(top_n_deaths[[' ', 'state', 'deaths']],
-                                                className='text-right',
-                                            ), id='table-deaths-state'),
-                                        color='primary'),
-                                    style={'height': '300px', 'overflow-y': 'auto'}
-                                )
-                            ]),
-                        ],
-                    )
-                ],
-            ),
-            html.Div(
-                [
-                    html.H3(children='New York City'),
-                    dbc.Row(
-                        [
-                            dbc.Col([
-                                dbc.CardHeader("New Cases"),
-                                dbc.Card(
-                                    [
-                                        dcc.DatePickerSingle(
-                                            id='date-ny',
-                                            min_date_allowed=nyc_dates[0],
-                                            max_date_allowed=nyc_dates[-1],
-                                            initial_visible_month=nyc_dates[-1],
-                                            date=nyc_dates[-1]
-                                        ),
-                                        dcc.Loading(
-                                            dcc.Graph(id='map-ny', figure=fig, style={'height': '225px', 'overflow-y': 'auto'}),
-                                        ),
-                                        html.Div(
-                                            dbc.Table.from_dataframe(nyc_test.sort_values('new_cases', ascending=False)[['county', 'new_cases']]),
-                                            id='table-nyc',
-                                            style={'height': '200px', 'overflow-y': 'auto'}
-                                        )
-                                    ],
-                                )
-                            ]),
-                            dbc.Col([
-                                dbc.CardHeader("New Cases Over Time"),
-                                dbc.Card(
-                                    [
-                                        # dcc.Dropdown(
-                                        #     options=[
-                                        #         {'label': 'Brooklyn', 'value': 'Brooklyn'},
-                                        #         {'label': 'Bronx', 'value': 'Bronx'},
-                                        #         {'label': 'Manhattan', 'value': 'Manhattan'},
-                                        #         {'label': 'Queens', 'value': 'Queens'},
-                                        #         {'label': 'Staten Island', 'value': 'Staten Island'},
-                                        #     ],
-                                        #     value=['Brooklyn'],
-                                        #     multi=True
-                                        # ),
-                                        dcc.Loading(
-                                            dcc.Graph(figure=fig_nyc)
-                                        )
-                                    ]
-                                )
-                            ]),
-                        ],
-                    ),
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                [
-                                    dbc.CardHeader("Hospitalized"),
+                                                ), id='table-cases-state'),
+                                            color='primary'),
+                                        style={'height': '300px', 'overflow-y': 'auto'}
+                                    )
+                                ]),
+                                dbc.Col([
+                                    dbc.CardHeader("Total Deaths"),
                                     dbc.Card(
-                                        dcc.Loading(
-                                            dcc.Graph(figure=fig_nyc_hosp)
-                                        )
+                                        dbc.Spinner(
+                                            html.Div(
+                                                dbc.Table.from_dataframe(top_n_deaths[[' ', 'state', 'deaths']],
+                                                    className='text-right',
+                                                ), id='table-deaths-state'),
+                                            color='primary'),
+                                        style={'height': '300px', 'overflow-y': 'auto'}
                                     )
-                                ]
-                            ),
-                            dbc.Col(
-                                [
-                                    dbc.CardHeader("Deaths"),
+                                ]),
+                            ],
+                        )
+                    ],
+                ),
+                html.Div(
+                    [
+                        html.H3(children='New York City'),
+                        dbc.Row(
+                            [
+                                dbc.Col([
+                                    dbc.CardHeader("New Cases"),
                                     dbc.Card(
-                                        dcc.Loading(
-                                            dcc.Graph(figure=fig_nyc_deaths)
-                                        )
+                                        [
+                                            dcc.DatePickerSingle(
+                                                id='date-ny',
+                                                min_date_allowed=nyc_dates[0],
+                                                max_date_allowed=nyc_dates[-1],
+                                                initial_visible_month=nyc_dates[-1],
+                                                date=nyc_dates[-1]
+                                            ),
+                                            dcc.Loading(
+                                                dcc.Graph(id='map-ny', figure=fig, style={'height': '225px', 'overflow-y': 'auto'}),
+                                            ),
+                                            html.Div(
+                                                county_table(nyc_test),
+                                                id='table-nyc',
+                                                style={'height': '200px', 'overflow-y': 'auto'}
+                                            )
+                                        ],
+                                    )
+                                ]),
+                                dbc.Col([
+                                    dbc.CardHeader("New Cases Over Time"),
+                                    dbc.Card(
+                                        [
+                                            # dcc.Dropdown(
+                                            #     options=[
+                                            #         {'label': 'Brooklyn', 'value': 'Brooklyn'},
+                                            #         {'label': 'Bronx', 'value': 'Bronx'},
+                                            #         {'label': 'Manhattan', 'value': 'Manhattan'},
+                                            #         {'label': 'Queens', 'value': 'Queens'},
+                                            #         {'label': 'Staten Island', 'value': 'Staten Island'},
+                                            #     ],
+                                            #     value=['Brooklyn'],
+                                            #     multi=True
+                                            # ),
+                                            dcc.Loading(
+                                                dcc.Graph(figure=fig_nyc, id='line-nyc')
+                                            )
+                                        ]
                                     )
-                                ]
-                            )
-                        ]
-                    )
-                ],
-            ),
-            html.Div(
-                [
-                    html.H3('New Jersey Counties', id='header-state'),
-                    dcc.Dropdown(
-                                    id='value-state',
-                                    options=[{'label': s, 'value': s} for s in sorted(us_counties.df.state.unique())],
-                                    value='New Jersey',
-                                    clearable=False
-                    ), 
-                    dbc.Row(
-                        [
-                            dbc.Col([
-                                dbc.CardHeader("New Cases"),
-                                dbc.Card(
+                                ]),
+                            ],
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(
                                     [
-                                        dcc.DatePickerSingle(
-                                            id='date-state',
-                                            min_date_allowed=counties_dates[0],
-                                            max_date_allowed=counties_dates[-1],
-                                            initial_visible_month=counties_dates[-1],
-                                            date=counties_dates[-1]
-                                        ),
-                                        dcc.Loading(
-                                            dcc.Graph(figure=fig_nj, id='map-state', style={'height': '250px', 'overflow-y': 'auto'})
-                                        ),
-                                        html.Div(
-                                            dbc.Table.from_dataframe(nj_test.sort_values('new_cases', ascending=False)[['county', 'new_cases']]),
-                                            id='table-states',
-                                            style={'height': '200px', 'overflow-y': 'auto'}
+                                        dbc.CardHeader("Hospitalized"),
+                                        dbc.Card(
+                                            dcc.Loading(
+                                                dcc.Graph(figure=fig_nyc_hosp, id='line-nyc-hosp')
+                                            )
                                         )
-                                    ],
-                                )
-                            ]),
-                            dbc.Col([
-                                dbc.CardHeader("New Cases Over Time"),
-                                dbc.Card(
+                                    ]
+                                ),
+                                dbc.Col(
                                     [
-                                        dcc.Dropdown(
-                                                options=[{'label': c, 'value': c} for c in sorted(us_counties.df[(us_counties.df.state=='New Jersey')].county.unique())],
-                                                value=['Somerset',' Middlesex'],
-                                                multi=True,
-                                                id='state-dropdown'
-                                        ),
-                                        dcc.Loading(
-                                            dcc.Graph(figure=fig_nj_line, id='line-state')
+                                        dbc.CardHeader("Deaths"),
+                                        dbc.Card(
+                                            dcc.Loading(
+                                                dcc.Graph(figure=fig_nyc_deaths, id='line-nyc-deaths')
+                                            )
                                         )
                                     ]
                                 )
-                            ])
-                        ]
-                    )
-                ]
-            ),
-            html.Footer(
-                [
-                    dcc.Markdown('© 2020 [Github](https://github.com/tlzhu19/covid19-dashboard) | [US Data](https://github.com/nytimes/covid-19-data/) | [NYC Data] (https://github.com/nychealth/coronavirus-data/)'),
-                ]
-            )
-        ],
-        style={'margin': '50px'}
-    ),
+                            ]
+                        )
+                    ],
+                ),
+                html.Div(
+                    [
+                        html.H3('New Jersey Counties', id='header-state'),
+                        dcc.Dropdown(
+                                        id='value-state',
+                                        options=[{'label': s, 'value': s} for s in us_counties.index.states()],
+                                        value='New Jersey',
+                                        clearable=False
+                        ), 
+                        dbc.Row(
+                            [
+                                dbc.Col([
+                                    dbc.CardHeader("New Cases"),
+                                    dbc.Card(
+                                        [
+                                            dcc.DatePickerSingle(
+                                                id='date-state',
+                                                min_date_allowed=counties_dates[0],
+                                                max_date_allowed=counties_dates[-1],
+                                                initial_visible_month=counties_dates[-1],
+                                                date=counties_dates[-1]
+                                            ),
+                                            dcc.Loading(
+                                                dcc.Graph(figure=fig_nj, id='map-state', style={'height': '250px', 'overflow-y': 'auto'})
+                                            ),
+                                            html.Div(
+                                                county_table(nj_test),
+                                                id='table-states',
+                                                style={'height': '200px', 'overflow-y': 'auto'}
+                                            )
+                                        ],
+                                    )
+                                ]),
+                                dbc.Col([
+                                    dbc.CardHeader("New Cases Over Time"),
+                                    dbc.Card(
+                                        [
+                                            dcc.Dropdown(
+                                                    options=[{'label': c, 'value': c} for c in us_counties.index.counties('New Jersey')],
+                                                    value=STATE_COUNTIES,
+                                                    multi=True,
+                                                    id='state-dropdown'
+                                            ),
+                                            dcc.Dropdown(
+                                                    options=[{'label': label, 'value': metric} for metric, label in METRICS.items()],
+                                                    value='new_cases',
+                                                    clearable=False,
+                                                    id='state-metric'
+                                            ),
+                                            dcc.Loading(
+                                                dcc.Graph(figure=fig_nj_line, id='line-state')
+                                            )
+                                        ]
+                                    )
+                                ])
+                            ]
+                        )
+                    ]
+                ),
+                html.Footer(
+                    [
+                        dcc.Markdown('© 2020 [Github](https://github.com/tlzhu19/covid19-dashboard) | [US Data](https://github.com/nytimes/covid-19-data/) | [NYC Data] (https://github.com/nychealth/coronavirus-data/)'),
+                    ]
+                )
+            ],
+            style={'margin': '50px'}
+        ),
     
-])
-
-
-@app.callback(
-    [
-        dash.dependencies.Output('table-new-cases-state', 'children'),
-        dash.dependencies.Output('table-cases-state', 'children'),
-        dash.dependencies.Output('table-deaths-state', 'children')
-    ],
-    [
-        dash.dependencies.Input('date-state-total', 'date')
-    ]
-)
-def update_state_tables(input_date):
-    results = []
-    for name in ['new_cases', 'cases', 'deaths']:
-        df = sort_state_data(states.df, name, input_date)[[' ', 'state', name]]
-        results.append(dbc.Table.from_dataframe(df, className='text-right'))
+    ])
+
+
+def dataset_versions():
+    return tuple(live.current.version for live in (nyc, us_counties, states))
 
-    return results
 
+def serve_layout():
+    # versions key the cache to the loaded datasets, so a refresh rebuilds the page
+    return layout_for(dataset_versions())
 
-@app.callback(
-    [
-        dash.dependencies.Output('map-ny', 'figure'),
-        dash.dependencies.Output('table-nyc', 'children')
-    ],
-    [dash.dependencies.Input('date-ny', 'date')]
-)
+
+@callback_cache.memoize(states)
+def update_state_tables(input_date):
+    version = states.current.version
+    with telemetry.phase('table'):
+        return [state_table(version, input_date, name) for name in ['new_cases', 'cases', 'deaths']]
+
+
+@callback_cache.memoize(nyc)
 def update_map_ny(value):
-    nyc_test = nyc.cases_df[nyc.cases_df['date'] == value]
-    fig = px.choropleth(nyc_test,
-                        geojson=counties,
-                        locations='fips',
-                        color='new_cases',
-                        color_continuous_scale="Blues",
-                        range_color=(0, max(nyc_test["new_cases"])),
-                        scope="usa",
-                        hover_name="county",
-                        hover_data=["date", "new_cases"],
-                        labels={'new_cases':'new cases'}
-                       )
-    fig.update_geos(fitbounds="locations", visible=False)
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
-    fig.update_coloraxes(showscale=False)
-
-    return fig, dbc.Table.from_dataframe(nyc_test.sort_values('new_cases', ascending=False)[['county', 'new_cases']])
-
-
-@app.callback(
-    [
-        dash.dependencies.Output('map-state', 'figure'),
-        dash.dependencies.Output('line-state', 'figure'),
-        dash.dependencies.Output('header-state', 'children'),
-        dash.dependencies.Output('table-states', 'children'),
-        dash.dependencies.Output('state-dropdown', 'options')
-    ],
-    [
-        dash.dependencies.Input('value-state', 'value'), 
-        dash.dependencies.Input('date-state', 'date'),
-        dash.dependencies.Input('state-dropdown', 'value')
-    ]
-)
-def update_map_state(state_value, input_date, input_counties):
+    with telemetry.phase('filter'):
+        cases_df = nyc.cases_df
+        nyc_test = cases_df[cases_df['date'] == value]
+    with telemetry.phase('figure'):
+        fig = choropleths().figure(nyc_test)
+    with telemetry.phase('table'):
+        return fig, county_table(nyc_test)
+
+
+@callback_cache.memoize(nyc)
+def nyc_line(graph_id, x_range):
+    frame, label = NYC_LINES[graph_id]
+    with telemetry.phase('filter'):
+        df = getattr(nyc, frame)
+        dates = df.date.values
+        values = df.new_cases.to_numpy(dtype=float, na_value=np.nan)
+        keep = np.isfinite(values)
+        boroughs = df.county.values
+        series = []
+        for borough in pd.unique(boroughs):
+            rows = keep & (boroughs == borough)
+            series.append((borough, dates[rows], values[rows]))
+    with telemetry.phase('figure'):
+        return borough_lines.figure(series, None, label, x_range, revision=graph_id)
+
+
+def update_nyc_line(graph_id):
+    def update(relayout):
+        x_range = visible_range(relayout)
+        if x_range is False:
+            # The chart keeps its zoom, and the points drawn for it
+            raise PreventUpdate
+        return nyc_line(graph_id, x_range)
+    update.__name__ = 'update_{}'.format(graph_id.replace('-', '_'))
+    return update
+
+
+@callback_cache.memoize(us_counties)
+def update_map_state(state_value, input_date):
+    with telemetry.phase('filter'):
+        index = us_counties.index
+        nj_test = index.state_date(state_value, input_date)
+
     # Map
-    nj_test = us_counties.df[(us_counties.df.state==state_value) & (us_counties.df.date==input_date)]
-    fig_nj = px.choropleth(nj_test,
-                        geojson=counties,
-                        locations='fips',
-                        color='new_cases',
-                        color_continuous_scale="Blues",
-                        range_color=(0, max(nj_test["new_cases"])),
-                        scope="usa",
-                        hover_name="county",
-                        hover_data=["date", "new_cases"],
-                        labels={'new_cases':'new cases'}
-                       )
-    fig_nj.update_geos(fitbounds="locations", visible=False)
-    fig_nj.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h")
-    fig_nj.update_coloraxes(showscale=False)
-
-    # Line chart
-    state_df = us_counties.df[(us_counties.df.state==state_value) & (us_counties.df.new_cases >= 0) & (us_counties.df.county != 'Unknown')]
-
-    county_list = sorted(us_counties.df[(us_counties.df.state==state_value)].county.unique())
-    fig_line = go.Figure()
-    for county in county_list:
-        if county in input_counties or input_counties==[]:
-            fig_line.add_trace(go.Scatter(x=state_df[state_df.county == county].date, y=state_df[state_df.county == county].new_cases, name=county,
-                hovertemplate=
-                '<b>Date</b>: %{x}'+
-                '<br><b>New Cases</b>: %{y}<br>'+
-                '<b>County</b>: %{text}', 
-                text=[county for i in range(len(state_df[state_df.county == county].new_cases))]))
-        else:
-            fig_line.add_trace(go.Scatter(x=state_df[state_df.county == county].date, y=state_df[state_df.county == county].new_cases, name=county, visible='legendonly',
-                hovertemplate=
-                '<b>Date</b>: %{x}'+
-                '<br><b>New Cases</b>: %{y}<br>'+
-                '<b>County</b>: %{text}',
-                text=[county for i in range(len(state_df[state_df.county == county].new_cases))]))
+    with telemetry.phase('figure'):
+        fig_nj = choropleths().figure(nj_test)
 
     # Table
-    state_table = dbc.Table.from_dataframe(nj_test.sort_values('new_cases', ascending=False)[['county', 'new_cases']])
+    with telemetry.phase('table'):
+        state_table = county_table(nj_test)
+        dropdown_options = [{'label': c, 'value': c} for c in index.counties(state_value)]
+
+    return fig_nj, '{} Counties'.format(state_value), state_table, dropdown_options
+
+
+@callback_cache.memoize(us_counties)
+def state_lines(state_value, input_counties, metric, x_range):
+    with telemetry.phase('filter'):
+        index = us_counties.index
+        state_df = index.state_rows(state_value)
+        # Metrics are precomputed per series, so switching between them is a column lookup
+        dates = state_df.date.values
+        values = state_df[metric].to_numpy(dtype=float, na_value=np.nan)
+        keep = np.isfinite(values) & (state_df.county != 'Unknown').values
+        if metric == 'new_cases':
+            keep &= values >= 0
+        series = [(county, dates[rows][keep[rows]], values[rows][keep[rows]]) for county, rows in index.county_slices(state_value)]
+
+    with telemetry.phase('figure'):
+        # A new state or metric resets the zoom; redraws of the same one keep it
+        return county_lines.figure(series, input_counties, METRICS[metric], x_range,
+                                   revision='{}/{}'.format(state_value, metric))
+
+
+def state_line_args(state_value, input_counties, metric='new_cases', relayout=None):
+    return state_value, tuple(input_counties or ()), metric, visible_range(relayout)
+
+
+def update_state_lines(state_value, input_counties, metric='new_cases', relayout=None):
+    # Zooming only redraws the line chart, at the resolution of the visible range
+    args = state_line_args(state_value, input_counties, metric, relayout)
+    if args[-1] is False:
+        if any(changed['prop_id'] == 'line-state.relayoutData' for changed in dash.callback_context.triggered):
+            raise PreventUpdate
+        # Another input changed since an event that left the x-axis alone
+        args = args[:-1] + (None,)
+    return state_lines(*args)
+
+
+# Callbacks answered from the static export, by their first output id:
+# (memoized callback, outputs, input values -> callback arguments)
+STATIC_VIEWS = {
+    'table-new-cases-state': (update_state_tables, STATE_TABLES_OUTPUTS, lambda day: (day,)),
+    'map-ny': (update_map_ny, MAP_NY_OUTPUTS, lambda day: (day,)),
+    'map-state': (update_map_state, MAP_STATE_OUTPUTS, lambda state, day: (state, day)),
+    'line-state': (state_lines, LINE_STATE_OUTPUTS, state_line_args),
+}
+
+
+def static_views(days):
+    '''(name, arguments) of every view the static export renders.'''
+    for day in available_dates(states):
+        yield 'table-new-cases-state', (day,)
+    for day in available_dates(nyc):
+        yield 'map-ny', (day,)
+    for state in us_counties.index.state_bounds:
+        # The line chart as a state first shows it: the starting counties still selected, zoomed out
+        yield 'line-state', state_line_args(state, STATE_COUNTIES)
+        for day in available_dates(us_counties)[-days:]:
+            yield 'map-state', (state, day)
+
+
+# Every memoized callback the app answers itself, the static views and the NYC line charts
+CACHED_VIEWS = dict(STATIC_VIEWS, **{
+    graph_id: (nyc_line, [(graph_id, 'figure')], lambda relayout, graph_id=graph_id: (graph_id, visible_range(relayout)))
+    for graph_id in NYC_LINES})
+
+static_views_store = StaticViews()
+
+
+def callback_request():
+    '''(view name, outputs, whether they are a list, callback arguments) of a request for a cached view, or None.'''
+    if flask.request.path != '/_dash-update-component':
+        return None
+    body = flask.request.get_json(silent=True) or {}
+    try:
+        outputs = body['outputs']
+        multi = isinstance(outputs, list)
+        outputs = [(output['id'], output['property']) for output in (outputs if multi else [outputs])]
+        _, expected, arguments = CACHED_VIEWS[outputs[0][0]]
+        if outputs != expected:
+            return None
+        args = arguments(*[value.get('value') for value in body['inputs']])
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+    if any(arg is False for arg in args):
+        # A relayout that leaves the x-axis alone: the callback decides whether to redraw
+        return None
+    return outputs[0][0], outputs, multi, args
+
+
+def serve_callback():
+    '''
+    Answers a callback request with its exported response, when the export
+    has it, or with the callback cache's JSON text as it is stored.
+    '''
+    request = callback_request()
+    if request is None:
+        return None
+    name, outputs, multi, args = request
+    found = None
+    if name in STATIC_VIEWS and static_views_store.load() is not None:
+        found = static_views_store.lookup(view_key(outputs, args), dataset_versions(),
+                                          flask.request.headers.get('Accept-Encoding', ''))
+    if found is None:
+        callback = CACHED_VIEWS[name][0]
+        with telemetry.callback(callback.__name__):
+            payload = callback_cache.payload(callback, args)
+            with telemetry.phase('respond'):
+                return flask.Response(response_body(outputs, payload, multi), mimetype='application/json')
+    data, encoding = found
+    response = flask.Response(data, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@telemetry.collect
+def gauges():
+    '''Cache hit ratios, dataset ages and memory of this worker, read on every scrape.'''
+    calls, data = callback_cache.stats(), datasets.stats()
+    rows = [('covid19_callback_cache_hits_total', 'counter', 'Callback cache hits', {'tier': 'local'}, calls['local_hits']),
+            ('covid19_callback_cache_hits_total', 'counter', 'Callback cache hits', {'tier': 'shared'}, calls['shared_hits']),
+            ('covid19_callback_cache_misses_total', 'counter', 'Callback cache misses', {}, calls['misses']),
+            ('covid19_callback_cache_hit_ratio', 'gauge', 'Callback cache hit ratio', {}, calls['hit_ratio']),
+            ('covid19_callback_cache_bytes', 'gauge', 'Serialized outputs held in the local callback cache', {},
+             calls['bytes']),
+            ('covid19_snapshot_hit_ratio', 'gauge', 'Dataset loads served from an existing snapshot', {}, data['hit_ratio']),
+            ('covid19_dataset_refreshes_total', 'counter', 'Dataset revalidations', {}, data['refreshes']),
+            ('covid19_dataset_swaps_total', 'counter', 'Dataset versions swapped in', {}, data['swaps']),
+            ('covid19_static_view_hits_total', 'counter', 'Callback requests answered from the static export', {},
+             static_views_store.hits)]
+    for live in (nyc, us_counties, states):
+        if live.loaded():
+            rows.append(('covid19_dataset_age_seconds', 'gauge', 'Seconds since the dataset was loaded or revalidated',
+                         {'dataset': live.cls.name}, time.time() - live.loaded_at))
+    for kind, kb in memory_kb().items():
+        rows.append(('covid19_memory_bytes', 'gauge', 'Memory of this worker', {'kind': kind}, kb * 1024))
+    return rows
+
+
+def metrics():
+    return flask.Response(telemetry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def start_request():
+    if telemetry.enabled:
+        flask.g.started = time.perf_counter()
+        telemetry.start_trace()
+
+
+def finish_request(response):
+    if telemetry.enabled and 'started' in flask.g:
+        rule = flask.request.url_rule
+        telemetry.observe('covid19_request_seconds', (('endpoint', rule.rule if rule else 'unmatched'),),
+                          time.perf_counter() - flask.g.started, 'total')
+        timing = telemetry.end_trace()
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
+
+
+def create_app():
+    '''The Dash app with its layout and callbacks; no data is loaded until the first request.'''
+    # The layout is a function, so skip the layout validation that would call it right away
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
+    app.title = 'COVID19 Dashboard'
+
+    callback_cache.backend = Cache(app.server, config=CACHE_CONFIG)
+    app.layout = serve_layout
+
+    # Prometheus text format; COVID19_SERVER_TIMING=1 also times each request's phases in a header
+    app.server.add_url_rule('/metrics', 'metrics', metrics)
+    app.server.before_request(start_request)
+    app.server.after_request(finish_request)
+    # Pre-rendered responses written by covid19_export.py, then cached outputs,
+    # answered before Dash decodes the request and re-encodes the outputs
+    app.server.before_request(serve_callback)
+
+    app.callback(
+        [dash.dependencies.Output(*output) for output in STATE_TABLES_OUTPUTS],
+        [
+            dash.dependencies.Input('date-state-total', 'date')
+        ]
+    )(update_state_tables)
+
+    app.callback(
+        [dash.dependencies.Output(*output) for output in MAP_NY_OUTPUTS],
+        [dash.dependencies.Input('date-ny', 'date')]
+    )(update_map_ny)
+
+    app.callback(
+        [dash.dependencies.Output(*output) for output in MAP_STATE_OUTPUTS],
+        [
+            dash.dependencies.Input('value-state', 'value'), 
+            dash.dependencies.Input('date-state', 'date')
+        ]
+    )(update_map_state)
+
+    app.callback(
+        dash.dependencies.Output(*LINE_STATE_OUTPUTS[0]),
+        [
+            dash.dependencies.Input('value-state', 'value'),
+            dash.dependencies.Input('state-dropdown', 'value'),
+            dash.dependencies.Input('state-metric', 'value'),
+            dash.dependencies.Input('line-state', 'relayoutData')
+        ]
+    )(update_state_lines)
+
+    # The layout already holds the zoomed-out NYC charts
+    for graph_id in NYC_LINES:
+        app.callback(
+            dash.dependencies.Output(graph_id, 'figure'),
+            [dash.dependencies.Input(graph_id, 'relayoutData')],
+            prevent_initial_call=True
+        )(update_nyc_line(graph_id))
 
-    dropdown_options = [{'label': c, 'value': c} for c in county_list]
+    return app
 
-    return fig_nj, fig_line, '{} Counties'.format(state_value), state_table, dropdown_options
+
+def preload():
+    '''Loads every dataset, the geometry of every state and the startup layout.'''
+    serve_layout()
+    geometry = county_geometry()
+    for prefix in geometry.by_state:
+        geometry.states([prefix])
+
+
+app = create_app()
+server = app.server
 
 
 if __name__ == '__main__':
-    app.run_server(debug=True)  
\ No newline at end of file
+    app.run_server(debug=True)
@@ -0,0 +1,695 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from covid19_index import CountyIndex, StateRankings, day_numbers
+from covid19_metrics import series_metrics
+from covid19_sources import DataSources
+from covid19_stream import CARRY_DAYS, CHUNK_ROWS, OutOfOrder, append_series_snapshot, write_series_snapshot
+from covid19_telemetry import telemetry
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+# Cleaned, typed frames are written here once and memory-mapped by every worker.
+SNAPSHOT_DIR = os.environ.get('COVID19_SNAPSHOT_DIR', 'snapshots')
+# Seconds before a loaded dataset is revalidated against its sources
+CACHE_TTL = int(os.environ.get('COVID19_CACHE_TTL', 60 * 60))
+# Snapshot versions kept on disk per dataset
+MAX_SNAPSHOTS = int(os.environ.get('COVID19_MAX_SNAPSHOTS', 2))
+# States the county table keeps, comma-separated; empty keeps every state
+COUNTY_STATES = tuple(state.strip() for state in os.environ.get('COVID19_COUNTY_STATES', '').split(',') if state.strip())
+
+
+def write_snapshot(df, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    # Uncompressed so that fixed-width columns can be mapped without a copy
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    # Numeric columns stay views onto the mapped file, so gunicorn workers
+    # share one page-cache copy instead of holding private frames.
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def unique_dates(series):
+    # Dates are day numbers in the county and state tables, datetimes elsewhere
+    days = np.unique(day_numbers(series.values))
+    return np.datetime_as_string(days.astype('datetime64[D]'), unit='D').tolist()
+
+
+def parse_days(values, format='%Y-%m-%d'):
+    '''Day numbers (int32) of date strings, parsing each distinct day once.'''
+    inverse, unique = pd.factorize(np.asarray(values, dtype=object))
+    return day_numbers(pd.to_datetime(unique, format=format).values)[inverse].astype(np.int32)
+
+
+def parse_nyc_dates(values):
+    # NYC files use mm/dd/yyyy; parse each distinct day once
+    unique, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return pd.to_datetime(unique, format='%m/%d/%Y').values[inverse]
+
+
+def read_population(path):
+    '''Population estimates keyed by county fips and by state name.'''
+    df = pd.read_csv(path, dtype=str, encoding='latin-1',
+                     usecols=['SUMLEV', 'STATE', 'COUNTY', 'STNAME', 'POPESTIMATE2019'])
+    population = df['POPESTIMATE2019'].astype(float).values
+    counties = df['SUMLEV'] == '050'
+    return {'fips': pd.Series(population[counties.values], index=(df['STATE'] + df['COUNTY'])[counties].values),
+            'state': pd.Series(population[~counties.values], index=df.loc[~counties, 'STNAME'].values)}
+
+
+def concat_categorical(df, rows, categories):
+    '''Appends `rows` to `df`, merging categories into the same sorted order a full build gives.'''
+    df, rows = df.copy(deep=False), rows.copy()
+    for column in categories:
+        merged = union_categoricals([df[column], rows[column].astype('category')], sort_categories=True).categories
+        df[column] = df[column].cat.set_categories(merged)
+        rows[column] = pd.Categorical(rows[column], categories=merged)
+    return pd.concat([df, rows], ignore_index=True)
+
+
+class Dataset:
+    name = None
+    sources = ()
+    frames = ()
+    categories = ()
+    # Narrower types for numeric columns, e.g. {'cases': 'int32'}
+    dtypes = {}
+    incremental = False
+    # Written to its snapshot chunk by chunk (stream_snapshot) instead of built in memory
+    streaming = False
+    # Bump when the cleaned frames change, so snapshots of the old ones are not reused
+    schema = 1
+
+    manifest = None
+
+    def __init__(self, **fields):
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def from_sources(cls, sources):
+        raise NotImplementedError
+
+    @classmethod
+    def snapshot_path(cls, frame, snapshot_dir=SNAPSHOT_DIR):
+        return os.path.join(snapshot_dir, '{}-{}.feather'.format(cls.name, frame))
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir=SNAPSHOT_DIR):
+        dataset = cls(**{frame: read_snapshot(cls.snapshot_path(frame, snapshot_dir)) for frame in cls.frames})
+        try:
+            with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+                dataset.manifest = json.load(f)
+        except OSError:
+            pass
+        return dataset
+
+    def to_snapshot(self, snapshot_dir=SNAPSHOT_DIR):
+        for frame in self.frames:
+            write_snapshot(getattr(self, frame), self.snapshot_path(frame, snapshot_dir))
+        if self.manifest is not None:
+            with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+                json.dump(self.manifest, f)
+
+    @classmethod
+    def options(cls):
+        '''Settings the cleaned frames depend on besides their sources, e.g. a filter.'''
+        return {}
+
+    @classmethod
+    def source_manifest(cls, sources):
+        # How much of each source this version has ingested
+        return {'schema': cls.schema,
+                'options': cls.options(),
+                'sources': {name: {'offset': os.path.getsize(sources.path(name)), 'sha1': sources[name].content_hash()}
+                            for name in cls.sources}}
+
+    def prepare(self):
+        '''Builds in-memory lookup structures once a version is loaded.'''
+
+    def append(self, rows, manifest, sources):
+        return None
+
+    @classmethod
+    def compact(cls, df):
+        for column in cls.categories:
+            df[column] = df[column].astype('category')
+        for column, dtype in cls.dtypes.items():
+            df[column] = df[column].astype(dtype)
+        return df
+
+
+class NYCData(Dataset):
+    name = 'nyc'
+    sources = ('nyc_boro', 'nyc_tests')
+    frames = ('cases_df', 'hospitalized_df', 'deaths_df', 'tests_df')
+    categories = ('county', 'state', 'fips')
+    # The health department revises earlier days in place, and the whole
+    # file is a few thousand rows, so it is always rebuilt.
+    incremental = False
+    schema = 2
+
+    # Alphabetical, which is also fips order, so borough codes line up with
+    # the sorted categories compact() would give
+    boroughs = {'BX': 'Bronx', 'BK': 'Brooklyn', 'MN': 'Manhattan', 'QN': 'Queens', 'SI': 'Staten Island'}
+    borough_to_fips = {'Bronx': '36005',
+                       'Brooklyn': '36047',
+                       'Queens': '36081',
+                       'Manhattan': '36061',
+                       'Staten Island': '36085'}
+    # Frame and the borough column suffix it is built from, e.g. BX_CASE_COUNT
+    metrics = {'cases_df': 'CASE_COUNT',
+               'hospitalized_df': 'HOSPITALIZED_COUNT',
+               'deaths_df': 'DEATH_COUNT'}
+
+    @classmethod
+    def from_sources(cls, sources):
+        columns = {metric: ['{}_{}'.format(prefix, metric) for prefix in cls.boroughs] for metric in cls.metrics.values()}
+        wanted = {column for names in columns.values() for column in names}
+        nyc_boro_df = pd.read_csv(sources.path('nyc_boro'), usecols=lambda column: column == 'date_of_interest' or column in wanted)
+        nyc_tests_df = pd.read_csv(sources.path('nyc_tests'))
+
+        # Every metric shares one parsed date column and one set of borough
+        # codes, laid out borough by borough like pd.melt would.
+        dates = parse_nyc_dates(nyc_boro_df['date_of_interest'])
+        n_dates, n_boroughs = len(dates), len(cls.boroughs)
+        names = list(cls.boroughs.values())
+        codes = np.repeat(np.arange(n_boroughs, dtype=np.int8), n_dates)
+        keys = {'date': np.tile(dates, n_boroughs),
+                'county': pd.Categorical.from_codes(codes, categories=names),
+                'state': pd.Categorical.from_codes(np.zeros(len(codes), dtype=np.int8), categories=['New York']),
+                'fips': pd.Categorical.from_codes(codes, categories=[cls.borough_to_fips[name] for name in names])}
+
+        nyc = cls()
+        for frame, metric in cls.metrics.items():
+            new_cases = nyc_boro_df[columns[metric]].values.T.ravel()
+            setattr(nyc, frame, pd.DataFrame({'date': keys['date'], 'county': keys['county'], 'new_cases': new_cases,
+                                              'state': keys['state'], 'fips': keys['fips']}))
+
+        tests_df = nyc_tests_df.rename(columns=str.lower)
+        tests_df['date'] = parse_nyc_dates(tests_df['date'])
+        nyc.tests_df = tests_df
+        return nyc
+
+
+class SeriesDataset(Dataset):
+    '''
+    Cumulative counts per series from one CSV that only ever grows by new
+    days at the end, so a refresh can parse just the appended rows.
+    '''
+    frames = ('df',)
+    series = []
+    # Dates are day numbers; new_cases is missing on each series' first day,
+    # deaths wherever the source leaves it blank (e.g. Puerto Rico's
+    # municipalities). The float columns are the metrics derived from cases.
+    dtypes = {'date': 'int32', 'cases': 'int32', 'deaths': 'Int32', 'new_cases': 'Int32',
+              'new_cases_avg7': 'float32', 'new_cases_per_100k': 'float32', 'growth_wow': 'float32'}
+    incremental = True
+    schema = 4
+    # Column matched against the population estimates
+    population_key = None
+    # Keep rows sorted by series and date instead of in file order
+    sort_rows = False
+
+    @classmethod
+    def parse(cls, source):
+        raise NotImplementedError
+
+    @classmethod
+    def arrange(cls, df):
+        if cls.sort_rows:
+            return df.sort_values(cls.series + ['date']).reset_index(drop=True)
+        return df
+
+    @classmethod
+    def from_sources(cls, sources):
+        manifest = cls.source_manifest(sources)
+        df = cls.arrange(cls.parse(sources.path(cls.sources[0])))
+        return cls(df=cls.compact(cls.add_metrics(df, sources)), manifest=manifest)
+
+    @classmethod
+    def stream_snapshot(cls, sources, snapshot_dir=SNAPSHOT_DIR):
+        '''
+        Writes the snapshot a chunk of rows at a time, so memory stays bounded
+        however large the source grows; the rows, categories and metrics are
+        those from_sources() gives. Needs the rows of each series in date order.
+        '''
+        manifest = cls.source_manifest(sources)
+        population = read_population(sources.path('population'))[cls.population_key]
+        os.makedirs(snapshot_dir, exist_ok=True)
+        write_series_snapshot(cls, cls.parse_chunks(sources.path(cls.sources[0])), population,
+                              cls.snapshot_path('df', snapshot_dir))
+        with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def series_codes(cls, df):
+        '''One integer per series of `df`, in the order of its categories.'''
+        codes = np.zeros(len(df), dtype=np.int64)
+        for column in cls.series:
+            column = df[column].astype('category')
+            codes = codes * len(column.cat.categories) + column.cat.codes.values
+        return codes
+
+    @classmethod
+    def row_population(cls, df, population):
+        key = df[cls.population_key].astype('category')
+        by_code = np.append(population.reindex(key.cat.categories).values, np.nan)
+        # code -1 (no fips) picks the trailing NaN
+        return by_code[key.cat.codes.values]
+
+    @classmethod
+    def add_metrics(cls, df, sources):
+        '''Derives new_cases and the rolling metrics from cases, for the whole table at once.'''
+        population = read_population(sources.path('population'))[cls.population_key]
+        metrics = series_metrics(cls.series_codes(df), df['date'].values, df['cases'].values,
+                                 cls.row_population(df, population))
+        for name, values in metrics.items():
+            df[name] = values
+        return df
+
+    def carried_rows(self):
+        '''The last CARRY_DAYS of each series: all that the windows of later days reach back to.'''
+        df = self.df
+        dates = df['date'].values
+        last = pd.Series(dates).groupby(self.series_codes(df)).transform('max').values
+        return df[dates >= last - CARRY_DAYS]
+
+    @classmethod
+    def appended_metrics(cls, carried, rows, population):
+        '''
+        `rows` with their metrics, for days after those of the table `carried`
+        was taken from, as a stream carries them between chunks.
+        '''
+        carried = carried[rows.columns]
+        both = concat_categorical(carried, rows, cls.categories)
+        metrics = series_metrics(cls.series_codes(both), both['date'].values, both['cases'].values,
+                                 cls.row_population(both, population))
+        rows = rows.copy()
+        for name, values in metrics.items():
+            rows[name] = values[len(carried):]
+        return rows
+
+    @classmethod
+    def read_appended(cls, sources, manifest):
+        '''Rows appended since `manifest`, or None if earlier rows were rewritten.'''
+        name = cls.sources[0]
+        offset, sha1 = manifest['sources'][name]['offset'], hashlib.sha1()
+        path = sources.path(name)
+        if os.path.getsize(path) < offset:
+            return None
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(0)
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(1 << 20, remaining))
+                sha1.update(chunk)
+                remaining -= len(chunk)
+            if sha1.hexdigest() != manifest['sources'][name]['sha1']:
+                return None
+            tail = f.read()
+        return cls.parse(io.BytesIO(header + tail))
+
+    def appendable(self, rows, manifest):
+        '''
+        Whether `rows` only add days after this version's. Rows already
+        ingested keep their metrics, so the other sources (the population)
+        must be unchanged too.
+        '''
+        if len(rows) and rows['date'].min() <= self.df['date'].max():
+            return False
+        return all(manifest['sources'][name] == self.manifest['sources'][name] for name in self.sources[1:])
+
+    def append(self, rows, manifest, sources):
+        '''
+        The next version with `rows` added, identical to a full rebuild, or
+        None unless appendable().
+        '''
+        df = self.df
+        if not self.appendable(rows, manifest):
+            return None
+
+        population = read_population(sources.path('population'))[self.population_key]
+        rows = self.appended_metrics(self.carried_rows(), rows.sort_values('date', kind='mergesort'), population)
+        combined = concat_categorical(df, self.compact(rows)[df.columns], self.categories)
+        if self.sort_rows and len(rows):
+            # Both parts are already in date order, so a stable sort on the
+            # series alone is a near-linear merge of the two runs.
+            key = self.series_codes(combined)
+            combined = combined.take(np.argsort(key, kind='stable')).reset_index(drop=True)
+        if list(combined.dtypes.astype(str)) != list(df.dtypes.astype(str)):
+            return None
+        return type(self)(df=combined, manifest=manifest)
+
+    def stream_append(self, rows, manifest, sources, snapshot_dir):
+        '''
+        Writes the version append() gives to `snapshot_dir` a batch at a time,
+        without holding the combined table in memory. Returns False unless
+        appendable(); raises OutOfOrder unless the table is sorted by series
+        and date.
+        '''
+        if not self.appendable(rows, manifest):
+            return False
+        population = read_population(sources.path('population'))[self.population_key]
+        os.makedirs(snapshot_dir, exist_ok=True)
+        append_series_snapshot(type(self), self.df, rows.sort_values('date', kind='mergesort'), population,
+                               self.snapshot_path('df', snapshot_dir))
+        with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        return True
+
+
+class Counties(SeriesDataset):
+    name = 'counties'
+    sources = ('counties', 'population')
+    categories = ('state', 'county', 'fips')
+    series = ['state', 'county']
+    # Each county's history is then one contiguous slice
+    sort_rows = True
+    population_key = 'fips'
+    # The full NYT file, several times larger than what the dyno can parse in one go
+    streaming = True
+    states = COUNTY_STATES
+    csv_dtypes = {'date': str, 'county': 'category', 'state': 'category', 'fips': 'category',
+                  'cases': 'Int32', 'deaths': 'Int32'}
+
+    @classmethod
+    def options(cls):
+        return {'states': sorted(cls.states)} if cls.states else {}
+
+    @classmethod
+    def parse(cls, source):
+        return cls.clean(pd.read_csv(source, dtype=cls.csv_dtypes))
+
+    @classmethod
+    def parse_chunks(cls, source, rows=CHUNK_ROWS):
+        for chunk in pd.read_csv(source, dtype=cls.csv_dtypes, chunksize=rows):
+            yield cls.clean(chunk)
+
+    @classmethod
+    def clean(cls, counties_df):
+        if cls.states:
+            counties_df = counties_df[counties_df['state'].isin(cls.states).values].reset_index(drop=True)
+            for column in cls.categories:
+                counties_df[column] = counties_df[column].cat.remove_unused_categories()
+        # A row without cases has nothing to chart; deaths may stay blank
+        if counties_df['cases'].isna().any():
+            counties_df = counties_df[counties_df['cases'].notna().values].reset_index(drop=True)
+        counties_df['cases'] = counties_df['cases'].astype(np.int32)
+        counties_df['date'] = parse_days(counties_df['date'])
+        return counties_df
+
+    def prepare(self):
+        self.index = CountyIndex(self.df)
+        self.df = self.index.df
+
+
+class States(SeriesDataset):
+    name = 'states'
+    sources = ('states', 'population')
+    categories = ('state',)
+    series = ['state']
+    population_key = 'state'
+
+    @classmethod
+    def parse(cls, source):
+        states_df = pd.read_csv(source, dtype={'date': str, 'state': 'category', 'cases': np.int32, 'deaths': 'Int32'})
+        states_df['date'] = parse_days(states_df['date'])
+        return states_df
+
+    def prepare(self):
+        self.rankings = StateRankings(self.df)
+
+
+DATASETS = (NYCData, Counties, States)
+
+
+class LiveDataset:
+    '''
+    Module-level handle on the current version of a dataset. Attribute access
+    is forwarded to that version and swaps to a refreshed one atomically;
+    callbacks should read `current` once to see a consistent version. Nothing
+    is loaded until the first access, and every access starts a background
+    refresh once the version is older than the cache's ttl.
+    '''
+    def __init__(self, cache, cls):
+        self.cache = cache
+        self.cls = cls
+        self.loaded_at = None
+        self.refreshing = False
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        if self._current is None:
+            with self._lock:
+                if self._current is None:
+                    dataset = self.cache.get(self.cls)
+                    self.loaded_at = time.time()
+                    self._current = dataset
+        self.cache.revalidate(self)
+        return self._current
+
+    @current.setter
+    def current(self, dataset):
+        self._current = dataset
+
+    def loaded(self):
+        return self._current is not None
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+
+class DatasetCache:
+    '''
+    Parsed datasets keyed by source URL and content hash. Each version is a
+    snapshot directory; stale datasets are served while a background thread
+    revalidates them, and old versions are evicted beyond `max_snapshots`.
+    Callables in `on_swap` are called with the LiveDataset after each swap.
+    '''
+    def __init__(self, sources=None, snapshot_dir=SNAPSHOT_DIR, ttl=CACHE_TTL, max_snapshots=MAX_SNAPSHOTS):
+        self.sources = sources or DataSources()
+        self.snapshot_dir = snapshot_dir
+        self.ttl = ttl
+        self.max_snapshots = max_snapshots
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.increments = 0
+        self.swaps = 0
+        self.on_swap = []
+        self._lock = threading.Lock()
+
+    def key(self, cls):
+        sha1 = hashlib.sha1('schema {}\n'.format(cls.schema).encode())
+        if cls.options():
+            sha1.update('options {}\n'.format(json.dumps(cls.options(), sort_keys=True)).encode())
+        for name in cls.sources:
+            source = self.sources[name]
+            sha1.update('{}\n{}\n'.format(source.url, source.content_hash()).encode())
+        return sha1.hexdigest()[:16]
+
+    def version_dir(self, cls, key):
+        return os.path.join(self.snapshot_dir, '{}-{}'.format(cls.name, key))
+
+    def get(self, cls, previous=None):
+        key = self.key(cls)
+        version_dir = self.version_dir(cls, key)
+        if feather is None:
+            self.misses += 1
+            with telemetry.timer('covid19_dataset_load_seconds', dataset=cls.name, source='sources'):
+                dataset = cls.from_sources(self.sources)
+        else:
+            version_dir, dataset = self.snapshot(cls, key, previous)
+            if dataset is None:
+                with telemetry.timer('covid19_dataset_load_seconds', dataset=cls.name, source='snapshot'):
+                    dataset = cls.from_snapshot(version_dir)
+        dataset.version = key
+        dataset.prepare()
+        return dataset
+
+    def snapshot(self, cls, key=None, previous=None):
+        '''
+        The snapshot directory of `cls` for its current sources, written first
+        if missing, and the dataset when writing it left one in memory.
+        '''
+        version_dir = self.version_dir(cls, key or self.key(cls))
+        with self._build_lock(cls):
+            if os.path.isdir(version_dir):
+                self.hits += 1
+                return version_dir, None
+            self.misses += 1
+            if previous is None and cls.incremental:
+                previous = self.latest(cls)
+            tmp_dir = '{}.{}.tmp'.format(version_dir, os.getpid())
+            with telemetry.timer('covid19_dataset_load_seconds', dataset=cls.name, source='sources'):
+                dataset = self.build(cls, previous, tmp_dir)
+            if dataset is not None:
+                dataset.to_snapshot(tmp_dir)
+            os.replace(tmp_dir, version_dir)
+            self.evict(cls, keep=version_dir)
+        return version_dir, dataset
+
+    def build(self, cls, previous=None, snapshot_dir=None):
+        '''
+        The current version of `cls`: `previous` plus the rows appended to its
+        source when possible, else a full build. Given `snapshot_dir`, a
+        streaming dataset is written there instead, appended to or in full,
+        returning None.
+        '''
+        if (cls.incremental and previous is not None and previous.manifest is not None
+                and previous.manifest.get('schema') == cls.schema
+                and previous.manifest.get('options', {}) == cls.options()):
+            manifest = cls.source_manifest(self.sources)
+            rows = cls.read_appended(self.sources, previous.manifest)
+            if rows is not None and snapshot_dir is not None and cls.streaming:
+                try:
+                    if previous.stream_append(rows, manifest, self.sources, snapshot_dir):
+                        self.increments += 1
+                        return None
+                except OutOfOrder:
+                    logger.warning('%s is not sorted by series and date, rebuilding it', cls.name)
+            elif rows is not None:
+                dataset = previous.append(rows, manifest, self.sources)
+                if dataset is not None:
+                    self.increments += 1
+                    return dataset
+        if snapshot_dir is not None and cls.streaming:
+            try:
+                cls.stream_snapshot(self.sources, snapshot_dir)
+                return None
+            except OutOfOrder:
+                logger.warning('%s is not in date order per series, building it in memory', cls.name)
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+        return cls.from_sources(self.sources)
+
+    def versions(self, cls):
+        prefix = cls.name + '-'
+        versions = [os.path.join(self.snapshot_dir, entry) for entry in os.listdir(self.snapshot_dir)
+                    if entry.startswith(prefix) and not entry.endswith('.tmp')]
+        return sorted(versions, key=os.path.getmtime, reverse=True)
+
+    def latest(self, cls):
+        versions = self.versions(cls)
+        return cls.from_snapshot(versions[0]) if versions else None
+
+    def _build_lock(self, cls):
+        # Serializes builds across gunicorn workers: one parses the sources,
+        # the rest find its snapshot.
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        return _FileLock(os.path.join(self.snapshot_dir, '.{}.lock'.format(cls.name)))
+
+    def evict(self, cls, keep=None):
+        versions = self.versions(cls)
+        # Workers still mapping an evicted version keep their pages until they swap.
+        for version_dir in versions[self.max_snapshots:]:
+            if version_dir != keep:
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def live(self, cls):
+        return LiveDataset(self, cls)
+
+    def revalidate(self, live):
+        if live.refreshing or time.time() - live.loaded_at < self.ttl:
+            return
+        with self._lock:
+            if live.refreshing:
+                return
+            live.refreshing = True
+        threading.Thread(target=self.refresh, args=(live,), daemon=True).start()
+
+    def refresh(self, live):
+        # Also when called directly, so reading live.current below starts no other refresh
+        live.refreshing = True
+        try:
+            self.refreshes += 1
+            # Publishes nothing unless every source of the dataset validates
+            with telemetry.timer('covid19_dataset_refresh_seconds', dataset=live.cls.name, step='fetch'):
+                self.sources.refresh(live.cls.sources)
+            if self.key(live.cls) != live.current.version:
+                with telemetry.timer('covid19_dataset_refresh_seconds', dataset=live.cls.name, step='swap'):
+                    live.current = self.get(live.cls, previous=live.current)
+                self.swaps += 1
+                for callback in self.on_swap:
+                    callback(live)
+        except Exception:
+            logger.exception('Refreshing %s failed, serving the previous version', live.cls.name)
+        finally:
+            live.loaded_at = time.time()
+            live.refreshing = False
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'refreshes': self.refreshes,
+                'increments': self.increments,
+                'swaps': self.swaps}
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def ingest(sources=None, snapshot_dir=SNAPSHOT_DIR, refresh=False):
+    cache = DatasetCache(sources, snapshot_dir)
+    # Sources without a local copy download together, not one by one as each dataset asks for them
+    missing = [source.name for source in cache.sources if not source.exists()]
+    if refresh or missing:
+        cache.sources.refresh(None if refresh else missing)
+    for dataset in DATASETS:
+        if feather is None:
+            cache.get(dataset)
+        else:
+            # Only writes the snapshots; the app maps them when it starts
+            cache.snapshot(dataset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write typed columnar snapshots of every dataset.')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--refresh', action='store_true', help='conditionally re-fetch the sources first')
+    args = parser.parse_args()
+    ingest(snapshot_dir=args.snapshot_dir, refresh=args.refresh)
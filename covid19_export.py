@@ -0,0 +1,209 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from plotly.utils import PlotlyJSONEncoder
+
+from covid19_data import _FileLock
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Pre-rendered callback responses and their manifest; served when the manifest matches the loaded data
+EXPORT_DIR = os.environ.get('COVID19_EXPORT_DIR', 'exports')
+# Most recent dates exported for every state map
+EXPORT_DAYS = int(os.environ.get('COVID19_EXPORT_DAYS', 14))
+# Seconds between checks for a new manifest
+MANIFEST_TTL = 10
+# Export in the background once gunicorn is listening and after every dataset swap
+EXPORT_ON_REFRESH = os.environ.get('COVID19_EXPORT_ON_REFRESH', '') == '1'
+
+
+def view_key(outputs, args):
+    '''Key of one callback response: its output ids and the callback's arguments.'''
+    return hashlib.sha1(json.dumps([list(outputs), list(args)], cls=PlotlyJSONEncoder).encode()).hexdigest()[:20]
+
+
+def response_body(outputs, values):
+    '''The JSON Dash sends for these output values, so a static view is byte-for-byte a live response.'''
+    if len(outputs) == 1:
+        values = [values]
+    response = {}
+    for (component_id, prop), value in zip(outputs, values):
+        response.setdefault(component_id, {})[prop] = value
+    return json.dumps({'multi': True, 'response': response}, cls=PlotlyJSONEncoder, separators=(',', ':')).encode()
+
+
+def render(task):
+    directory, name, args = task
+    import covid19_dash
+    callback, outputs, _ = covid19_dash.STATIC_VIEWS[name]
+    body = response_body(outputs, callback.uncached(*args))
+    key = view_key(outputs, args)
+    entry = {'callback': name, 'args': list(args), 'bytes': len(body)}
+    encodings = [('gzip', '.json.gz', lambda: gzip.compress(body, 9))]
+    if brotli is not None:
+        encodings.append(('br', '.json.br', lambda: brotli.compress(body, quality=11)))
+    for encoding, suffix, compress in encodings:
+        data = compress()
+        with open(os.path.join(directory, key + suffix), 'wb') as f:
+            f.write(data)
+        entry[encoding] = len(data)
+    return key, entry
+
+
+def export(export_dir=EXPORT_DIR, days=EXPORT_DAYS, workers=None):
+    '''
+    Renders every view listed by covid19_dash.static_views() on a pool of
+    forked workers and swaps the new export in as a whole.
+    '''
+    import covid19_dash
+    # Loaded once here and shared copy-on-write by the forked workers
+    covid19_dash.preload()
+    versions = covid19_dash.dataset_versions()
+    tmp_dir = '{}.{}.tmp'.format(os.path.abspath(export_dir), os.getpid())
+    tasks = [(tmp_dir, name, args) for name, args in covid19_dash.static_views(days)]
+
+    start = time.perf_counter()
+    os.makedirs(tmp_dir)
+    try:
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                entries = dict(pool.imap_unordered(render, tasks, chunksize=4))
+        else:
+            entries = dict(map(render, tasks))
+        manifest = {'versions': list(versions), 'created': time.time(), 'views': entries}
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        old = '{}.{}.old'.format(os.path.abspath(export_dir), os.getpid())
+        if os.path.isdir(export_dir):
+            os.rename(export_dir, old)
+        os.rename(tmp_dir, export_dir)
+        shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    elapsed = time.perf_counter() - start
+    logger.info('Exported %d views in %.1f s', len(entries), elapsed)
+    return manifest, elapsed
+
+
+def stale(export_dir=EXPORT_DIR):
+    '''
+    True unless the export on disk was rendered from the datasets as their
+    sources are now. Compares snapshot keys, so no data is loaded.
+    '''
+    from covid19_data import DATASETS, DatasetCache
+    manifest = StaticViews(export_dir).load()
+    if manifest is None:
+        return True
+    cache = DatasetCache()
+    return manifest['versions'] != tuple(cache.key(cls) for cls in DATASETS)
+
+
+def start_export(export_dir=EXPORT_DIR):
+    '''
+    Runs this module in a background process at low priority. Exports take
+    turns on a lock and skip versions that are already exported, so every
+    worker can ask for one after its swap.
+    '''
+    # The child lowers its own priority; preexec_fn is unsafe in a threaded worker
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--export-dir', export_dir, '--if-stale',
+                                '--nice', '10'])
+    threading.Thread(target=process.wait, daemon=True).start()
+    return process
+
+
+def export_lock(export_dir=EXPORT_DIR):
+    export_dir = os.path.abspath(export_dir)
+    return _FileLock(os.path.join(os.path.dirname(export_dir), '.{}.lock'.format(os.path.basename(export_dir))))
+
+
+class StaticViews:
+    '''
+    The export on disk, as the app serves it: a response is the stored bytes
+    of its view, in the best encoding the client accepts. The manifest is
+    re-read when it changes, and ignored unless it was rendered from the
+    dataset versions the app has loaded.
+    '''
+    def __init__(self, export_dir=EXPORT_DIR):
+        self.export_dir = export_dir
+        self.manifest_path = os.path.join(export_dir, 'manifest.json')
+        self.manifest = None
+        self.hits = 0
+        self._mtime = None
+        self._checked_at = 0
+
+    def load(self):
+        now = time.time()
+        if now - self._checked_at < MANIFEST_TTL:
+            return self.manifest
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+            if mtime != self._mtime:
+                with open(self.manifest_path) as f:
+                    manifest = json.load(f)
+                manifest['versions'] = tuple(manifest['versions'])
+                self.manifest, self._mtime = manifest, mtime
+        except (OSError, ValueError):
+            self.manifest, self._mtime = None, None
+        return self.manifest
+
+    def lookup(self, key, versions, accept_encoding=''):
+        '''(body, content encoding or None) of a view, or None when it is not exported for these versions.'''
+        manifest = self.load()
+        if manifest is None or manifest['versions'] != versions:
+            return None
+        entry = manifest['views'].get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self.export_dir, key)
+        try:
+            if 'br' in entry and 'br' in accept_encoding:
+                encoding, path = 'br', path + '.json.br'
+            else:
+                encoding, path = 'gzip', path + '.json.gz'
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        self.hits += 1
+        if encoding == 'gzip' and 'gzip' not in accept_encoding:
+            return gzip.decompress(body), None
+        return body, encoding
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-render the callback responses most requests ask for.')
+    parser.add_argument('--export-dir', default=EXPORT_DIR)
+    parser.add_argument('--days', type=int, default=EXPORT_DAYS, help='most recent dates exported for every state map')
+    parser.add_argument('--workers', type=int, help='processes rendering views (default: one per CPU)')
+    parser.add_argument('--if-stale', action='store_true', help='skip when the export matches the current datasets')
+    parser.add_argument('--nice', type=int, default=0, help='lower this process\' priority by this much first')
+    args = parser.parse_args()
+    if args.nice and hasattr(os, 'nice'):
+        os.nice(args.nice)
+    with export_lock(args.export_dir):
+        if args.if_stale and not stale(args.export_dir):
+            print('{} is up to date'.format(args.export_dir))
+            sys.exit()
+        manifest, elapsed = export(args.export_dir, args.days, args.workers)
+    views = manifest['views'].values()
+    print('{} views in {:.1f} s ({:.0f} views/s): {:.1f} MB of JSON, {:.1f} MB gzip'.format(
+        len(views), elapsed, len(views) / elapsed, sum(v['bytes'] for v in views) / 2 ** 20,
+        sum(v['gzip'] for v in views) / 2 ** 20))
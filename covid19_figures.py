@@ -0,0 +1,253 @@
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from covid19_index import DAY_NS, day_numbers
+
+# Simplification levels in degrees. A state map is about 250px tall, so a
+# state spanning E degrees can drop detail below roughly E / 500.
+TOLERANCES = (0.001, 0.005, 0.02)
+SIMPLIFY = os.environ.get('COVID19_GEO_SIMPLIFY', '1') == '1'
+# Points per line chart trace before it is bucketed; 0 ships every point
+MAX_POINTS = int(os.environ.get('COVID19_MAX_POINTS', 300))
+
+
+def simplify_ring(ring, tolerance):
+    '''Douglas-Peucker on one closed ring; rings that would collapse are kept as they are.'''
+    points = np.asarray(ring, dtype=float)
+    n = len(points)
+    if n <= 4:
+        return ring
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    if keep.sum() < 4:
+        return ring
+    return np.round(points[keep], 4).tolist()
+
+
+def simplify_geometry(geometry, tolerance):
+    if geometry['type'] == 'Polygon':
+        coordinates = [simplify_ring(ring, tolerance) for ring in geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        coordinates = [[simplify_ring(ring, tolerance) for ring in polygon] for polygon in geometry['coordinates']]
+    else:
+        return geometry
+    return {'type': geometry['type'], 'coordinates': coordinates}
+
+
+def geometry_extent(features):
+    points = []
+    for feature in features:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        for polygon in polygons:
+            points.extend(polygon[0])
+    if not points:
+        return 0.0
+    points = np.asarray(points, dtype=float)
+    return float((points.max(axis=0) - points.min(axis=0)).max())
+
+
+class CountyGeometry:
+    '''
+    The US counties GeoJSON split by state FIPS prefix, so a choropleth only
+    ships the polygons of the state it draws. Simplified copies are built
+    on first use and kept for the life of the process.
+    '''
+    def __init__(self, geojson, simplify=SIMPLIFY):
+        self.simplify = simplify
+        self.by_state = {}
+        for feature in geojson['features']:
+            self.by_state.setdefault(str(feature['id'])[:2], []).append(feature)
+        self._subsets = {}
+        self._lock = threading.Lock()
+
+    def tolerance_for(self, features):
+        if not self.simplify:
+            return 0
+        target = geometry_extent(features) / 500
+        levels = [tolerance for tolerance in TOLERANCES if tolerance <= target]
+        return levels[-1] if levels else 0
+
+    def states(self, prefixes, tolerance=None):
+        key = (tuple(sorted(prefixes)), tolerance)
+        subset = self._subsets.get(key)
+        if subset is None:
+            features = [feature for prefix in key[0] for feature in self.by_state.get(prefix, [])]
+            if tolerance is None:
+                tolerance = self.tolerance_for(features)
+            if tolerance:
+                features = [dict(feature, geometry=simplify_geometry(feature['geometry'], tolerance)) for feature in features]
+            subset = {'type': 'FeatureCollection', 'features': features}
+            with self._lock:
+                self._subsets[key] = subset
+        return subset
+
+    def for_fips(self, fips, tolerance=None):
+        '''The states covering these county FIPS codes.'''
+        prefixes = {str(code)[:2] for code in fips if isinstance(code, str) and code}
+        return self.states(prefixes, tolerance)
+
+
+def date_strings(values):
+    return np.datetime_as_string(np.asarray(values, dtype='datetime64[D]'), unit='D')
+
+
+def visible_range(relayout):
+    '''
+    First and last day number of the x-range in a Graph's relayoutData, None
+    when autoscaled, or False when the event leaves the x-axis alone (a new
+    drag mode, autosize, a y-only zoom).
+    '''
+    if not relayout:
+        return None
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        start, end = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        start, end = relayout['xaxis.range']
+    elif relayout.get('xaxis.autorange'):
+        return None
+    else:
+        return False
+    try:
+        start, end = pd.Timestamp(start).value / DAY_NS, pd.Timestamp(end).value / DAY_NS
+    except (TypeError, ValueError):
+        return None
+    return math.floor(start), math.ceil(end)
+
+
+def min_max_buckets(values, max_points):
+    '''
+    Positions to keep so a line of `values` has at most about `max_points`
+    points: the first, last, lowest and highest point of equal-size buckets,
+    so peaks and dips survive.
+    '''
+    n = len(values)
+    if not max_points or n <= max_points:
+        return np.arange(n)
+    bucket = np.arange(n) * max(max_points // 4, 1) // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    stops = np.r_[starts[1:], n] - 1
+    # Within each bucket, ascending by value: the ends are the min and max
+    order = np.lexsort((values, bucket))
+    return np.unique(np.concatenate([starts, stops, order[starts], order[stops]]))
+
+
+class ChoroplethFactory:
+    '''
+    County choropleths of new cases. The layout and each state's trace
+    skeleton (geometry, hover template) are built once; a request only
+    fills in the locations, values and colour range.
+    '''
+    hovertemplate = '<b>%{hovertext}</b><br><br>fips=%{location}<br>date=%{customdata[0]}<br>new cases=%{z}<extra></extra>'
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        fig = go.Figure()
+        fig.update_geos(scope='usa', fitbounds='locations', visible=False)
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, legend_orientation="h",
+                          coloraxis={'colorscale': 'Blues', 'colorbar': {'title': {'text': 'new cases'}}, 'showscale': False})
+        self.layout = fig.to_plotly_json()['layout']
+        self._traces = {}
+
+    def trace(self, fips):
+        geojson = self.geometry.for_fips(fips)
+        # Subsets are cached, so the same object means the same state
+        trace = self._traces.get(id(geojson))
+        if trace is None:
+            trace = {'type': 'choropleth', 'geojson': geojson, 'featureidkey': 'id', 'geo': 'geo',
+                     'coloraxis': 'coloraxis', 'name': '', 'hovertemplate': self.hovertemplate}
+            self._traces[id(geojson)] = trace
+        return trace
+
+    def figure(self, df):
+        new_cases = df['new_cases'].to_numpy(dtype=float, na_value=np.nan)
+        trace = dict(self.trace(df['fips']),
+                     locations=np.asarray(df['fips'], dtype=object),
+                     z=new_cases,
+                     hovertext=np.asarray(df['county'], dtype=object),
+                     customdata=date_strings(df['date'].values)[:, None])
+        cmax = np.nanmax(new_cases) if np.isfinite(new_cases).any() else 0
+        layout = dict(self.layout, coloraxis=dict(self.layout['coloraxis'], cmin=0, cmax=float(cmax)))
+        return {'data': [trace], 'layout': layout}
+
+
+class CountyLineFactory:
+    '''
+    A metric over time, one trace per county. Trace skeletons with a
+    constant hover template are built once per county list and metric; a
+    request only fills in x, y and visibility.
+
+    Long series are cut to the visible x-range and bucketed to `max_points`
+    per trace, so a zoomed-out chart ships a few hundred points per county
+    and zooming in fetches the visible window at full resolution.
+    '''
+    hovertemplate = '<b>Date</b>: %{{x}}<br><b>{}</b>: %{{y}}<br><b>{}</b>: {}'
+
+    def __init__(self, legend='County', max_points=MAX_POINTS):
+        self.legend = legend
+        self.max_points = max_points
+        self.layout = go.Figure().to_plotly_json()['layout']
+        self._traces = {}
+
+    def traces(self, counties, label='New Cases'):
+        key = (tuple(counties), label)
+        traces = self._traces.get(key)
+        if traces is None:
+            traces = [{'type': 'scatter', 'name': county, 'hovertemplate': self.hovertemplate.format(label, self.legend, county)}
+                      for county in counties]
+            self._traces[key] = traces
+        return traces
+
+    def figure(self, series, selected, label='New Cases', x_range=None, revision=None):
+        '''
+        `series` is a list of (county, dates, values) with dates ascending;
+        counties not in `selected` start hidden. `x_range` is the visible
+        (first, last) day number. Redraws with the same `revision`, e.g. the
+        state and metric shown, keep the user's zoom and legend clicks.
+        '''
+        traces = self.traces([county for county, _, _ in series], label)
+        data = []
+        for skeleton, (county, x, y) in zip(traces, series):
+            if x_range is not None:
+                # One point past each edge so lines run off the chart
+                days = day_numbers(x)
+                start = max(np.searchsorted(days, x_range[0], 'left') - 1, 0)
+                stop = np.searchsorted(days, x_range[1], 'right') + 1
+                x, y = x[start:stop], y[start:stop]
+            keep = min_max_buckets(y, self.max_points)
+            trace = dict(skeleton, x=date_strings(x[keep]), y=y[keep])
+            if selected and county not in selected:
+                trace['visible'] = 'legendonly'
+            data.append(trace)
+        layout = dict(self.layout, uirevision=revision,
+                      xaxis={'title': {'text': 'Date'}},
+                      yaxis={'title': {'text': label}},
+                      legend={'title': {'text': self.legend}})
+        if x_range is not None:
+            layout['xaxis'] = dict(layout['xaxis'], range=list(date_strings(x_range)))
+        return {'data': data, 'layout': layout}
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+DAY_NS = 24 * 60 * 60 * 10 ** 9
+
+
+def day_number(value):
+    '''Days since 1970-01-01 of a date string or timestamp; a day number comes back as is.'''
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(value).value // DAY_NS)
+
+
+def day_numbers(values):
+    '''Days since 1970-01-01 of a datetime64 array, or of an array that already holds day numbers.'''
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[D]')
+    return values.astype(np.int64)
+
+
+def group_bounds(*keys):
+    '''Start/stop offsets of runs of equal keys in already sorted arrays.'''
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+        for key in keys:
+            change[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(change)
+    stops = np.append(starts[1:], n)
+    return starts, stops
+
+
+class CountyIndex:
+    '''
+    Offsets into the county table, built once per dataset version.
+
+    Rows are kept sorted by (state, county, date) so every county's time
+    series is a contiguous slice, and a second permutation sorted by
+    (state, date, county) gives the rows of one state on one day.
+    '''
+    def __init__(self, df):
+        state = df['state'].astype('category')
+        county = df['county'].astype('category')
+        days = day_numbers(df['date'].values)
+
+        order = np.lexsort((days, county.cat.codes.values, state.cat.codes.values))
+        if not (order == np.arange(len(order))).all():
+            df = df.take(order).reset_index(drop=True)
+            state, county, days = state.take(order), county.take(order), days[order]
+        self.df = df
+
+        state_codes = state.cat.codes.values
+        county_codes = county.cat.codes.values
+        state_names = state.cat.categories
+        county_names = county.cat.categories
+
+        self.state_bounds = {}
+        for start, stop in zip(*group_bounds(state_codes)):
+            self.state_bounds[state_names[state_codes[start]]] = (start, stop)
+
+        # Counties come out in sorted order because the rows are sorted by code
+        self.series_bounds = {}
+        self.state_counties = {}
+        for start, stop in zip(*group_bounds(state_codes, county_codes)):
+            key = (state_names[state_codes[start]], county_names[county_codes[start]])
+            self.series_bounds[key] = (start, stop)
+            self.state_counties.setdefault(key[0], []).append(key[1])
+
+        self.date_order = np.lexsort((county_codes, days, state_codes))
+        self.date_bounds = {}
+        for start, stop in zip(*group_bounds(state_codes[self.date_order], days[self.date_order])):
+            row = self.date_order[start]
+            self.date_bounds[(state_names[state_codes[row]], int(days[row]))] = (start, stop)
+
+    def states(self):
+        return sorted(self.state_counties)
+
+    def counties(self, state):
+        return self.state_counties.get(state, [])
+
+    def state_rows(self, state):
+        start, stop = self.state_bounds.get(state, (0, 0))
+        return self.df.iloc[start:stop]
+
+    def county_slices(self, state):
+        '''(county, slice) pairs into state_rows(state), one per county.'''
+        offset = self.state_bounds.get(state, (0, 0))[0]
+        return [(county, slice(self.series_bounds[(state, county)][0] - offset,
+                               self.series_bounds[(state, county)][1] - offset))
+                for county in self.counties(state)]
+
+    def series(self, state, county):
+        start, stop = self.series_bounds.get((state, county), (0, 0))
+        return self.df.iloc[start:stop]
+
+    def state_date(self, state, date):
+        start, stop = self.date_bounds.get((state, day_number(date)), (0, 0))
+        return self.df.take(self.date_order[start:stop])
+
+
+def format_counts(values):
+    '''Vectorized '{:,}' for a float array of whole numbers; NaN becomes ''.'''
+    missing = np.isnan(values)
+    whole = np.where(missing, 0, values).astype(np.int64)
+    rest = np.abs(whole)
+    text = np.char.mod('%d', rest % 1000)
+    rest = rest // 1000
+    while (rest > 0).any():
+        group = np.where(rest >= 1000, np.char.mod('%03d', rest % 1000), np.char.mod('%d', rest % 1000))
+        padded = np.char.zfill(text, 3)
+        text = np.where(rest > 0, np.char.add(np.char.add(group, ','), padded), text)
+        rest = rest // 1000
+    text = np.where(whole < 0, np.char.add('-', text), text)
+    return np.where(missing, '', text).astype(object)
+
+
+class StateRankings:
+    '''
+    Per-date ordering of states for each metric, from an argsort over a
+    date x state matrix, with the display strings formatted up front.
+    '''
+    metrics = ('new_cases', 'cases', 'deaths')
+
+    def __init__(self, df):
+        state = df['state'].astype('category')
+        state_codes = state.cat.codes.values
+        self.state_names = np.asarray(state.cat.categories, dtype=object)
+
+        days = day_numbers(df['date'].values)
+        self.days, date_pos = np.unique(days, return_inverse=True)
+        self.date_positions = {int(day): i for i, day in enumerate(self.days)}
+
+        shape = (len(self.days), len(self.state_names))
+        present = np.zeros(shape, dtype=bool)
+        present[date_pos, state_codes] = True
+        # States without a row on a date are left out, like the date filter did
+        self.counts = present.sum(axis=1)
+
+        self.order = {}
+        self.formatted = {}
+        for metric in self.metrics:
+            matrix = np.full(shape, np.nan)
+            matrix[date_pos, state_codes] = df[metric].to_numpy(dtype=float, na_value=np.nan)
+            # Missing values sort last, as with sort_values, and states
+            # without a row on that date after them
+            key = np.where(np.isnan(matrix), np.inf, -matrix)
+            key[~present] = np.nan
+            self.order[metric] = np.argsort(key, axis=1, kind='stable')
+            self.formatted[metric] = format_counts(matrix)
+
+    def top(self, date, metric, n=50):
+        position = self.date_positions.get(day_number(date))
+        if position is None:
+            return pd.DataFrame({' ': [], 'state': [], metric: []})
+        states = self.order[metric][position, :min(n, self.counts[position])]
+        return pd.DataFrame({' ': np.arange(1, len(states) + 1),
+                             'state': self.state_names[states],
+                             metric: self.formatted[metric][position, states]})
@@ -0,0 +1,79 @@
+import numpy as np
+
+# Days in the rolling window and in the week-over-week comparison
+WINDOW = 7
+
+# Metric columns of the county and state tables, with their chart labels
+METRICS = {'new_cases': 'New Cases',
+           'new_cases_avg7': 'New Cases (7-day avg)',
+           'new_cases_per_100k': 'New Cases per 100k (7-day avg)',
+           'growth_wow': 'Week-over-week Growth'}
+
+
+def series_order(codes, days):
+    '''Permutation that sorts rows by series then day, or None if they already are.'''
+    if len(codes) < 2:
+        return None
+    same = codes[1:] == codes[:-1]
+    if ((codes[1:] > codes[:-1]) | (same & (days[1:] > days[:-1]))).all():
+        return None
+    return np.lexsort((days, codes))
+
+
+def lag_positions(codes, days, lag):
+    '''Row of the same series `lag` days earlier, or -1, for rows sorted by series then day.'''
+    n = len(codes)
+    span = int(days.max()) - int(days.min()) + lag + 1 if n else 1
+    key = codes.astype(np.int64) * span + (days - (int(days.min()) if n else 0))
+    positions = np.searchsorted(key, key - lag)
+    found = positions < n
+    found[found] = key[positions[found]] == key[found] - lag
+    return np.where(found, positions, -1)
+
+
+def take_or_nan(values, positions):
+    out = np.full(len(positions), np.nan)
+    found = positions >= 0
+    out[found] = values[positions[found]]
+    return out
+
+
+def series_metrics(codes, days, cases, population=None):
+    '''
+    Daily deltas, the 7-day average of new cases, that average per 100k
+    people and its growth over the week before, for cumulative `cases`.
+
+    `codes` identifies each row's series and `days` its day number. Rows in
+    any order are sorted once and every metric is then a vectorized pass
+    over the contiguous series. Windows are by date, so a missing day makes
+    the windows that need it NaN instead of spanning a gap.
+    '''
+    codes, days = np.asarray(codes), np.asarray(days)
+    cases = np.asarray(cases, dtype=float)
+    order = series_order(codes, days)
+    if order is not None:
+        codes, days, cases = codes[order], days[order], cases[order]
+        population = None if population is None else np.asarray(population, dtype=float)[order]
+
+    new_cases = np.full(len(cases), np.nan)
+    if len(cases):
+        same = codes[1:] == codes[:-1]
+        new_cases[1:][same] = np.diff(cases)[same]
+
+    week = lag_positions(codes, days, WINDOW)
+    avg7 = (cases - take_or_nan(cases, week)) / WINDOW
+    previous = take_or_nan(avg7, week)
+    growth = np.full(len(cases), np.nan)
+    rising = previous > 0
+    growth[rising] = avg7[rising] / previous[rising] - 1
+    if population is None:
+        per_100k = np.full(len(cases), np.nan)
+    else:
+        per_100k = avg7 / np.asarray(population, dtype=float) * 100000
+
+    metrics = {'new_cases': new_cases, 'new_cases_avg7': avg7, 'new_cases_per_100k': per_100k, 'growth_wow': growth}
+    if order is not None:
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        metrics = {name: values[inverse] for name, values in metrics.items()}
+    return metrics
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# Local mirror of every dataset. Point this at a snapshot or fixture directory
+# (e.g. COVID19_DATA_DIR=fixtures COVID19_OFFLINE=1) to start without network.
+DATA_DIR = os.environ.get('COVID19_DATA_DIR', 'data')
+OFFLINE = os.environ.get('COVID19_OFFLINE', '') == '1'
+# Seconds a whole download may take, per attempt
+FETCH_TIMEOUT = int(os.environ.get('COVID19_FETCH_TIMEOUT', 30))
+# Attempts per source, and the delay before the first retry (doubled after each)
+FETCH_RETRIES = int(os.environ.get('COVID19_FETCH_RETRIES', 3))
+FETCH_BACKOFF = float(os.environ.get('COVID19_FETCH_BACKOFF', 1))
+
+SOURCE_URLS = {
+    'nyc_boro': 'https://raw.githubusercontent.com/nychealth/coronavirus-data/master/trends/data-by-day.csv',
+    'nyc_tests': 'https://raw.githubusercontent.com/nychealth/coronavirus-data/master/trends/tests.csv',
+    # The full file; Counties streams it into its snapshot (COVID19_COUNTY_STATES filters it)
+    'counties': 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv',
+    'states': 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv',
+    'geojson': 'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json',
+    # 2019 county and state population estimates, for per-100k rates
+    'population': 'https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv',
+}
+
+# Larger files get longer than FETCH_TIMEOUT
+SOURCE_TIMEOUTS = {'counties': 4 * FETCH_TIMEOUT, 'geojson': 2 * FETCH_TIMEOUT}
+
+
+class FetchError(OSError):
+    '''A refresh that could not fetch and validate every source it needed.'''
+
+
+def retryable(error):
+    # 4xx other than 429 won't change on a retry; dropped connections,
+    # timeouts, 5xx and truncated or garbled bodies might
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (OSError, HTTPException, ValueError, zlib.error))
+
+
+class DataSource:
+    '''
+    One dataset, resolved from the local mirror first and refreshed from its
+    remote with a conditional GET (ETag / If-Modified-Since).
+
+    A refresh is two steps: fetch() downloads and validates a new copy into a
+    staging file, with retries, and publish() moves it over the local copy.
+    '''
+    def __init__(self, name, url=None, data_dir=None, offline=None, timeout=None):
+        self.name = name
+        self.url = url
+        self.data_dir = DATA_DIR if data_dir is None else data_dir
+        self.offline = OFFLINE if offline is None else offline
+        self.timeout = SOURCE_TIMEOUTS.get(name, FETCH_TIMEOUT) if timeout is None else timeout
+
+        filename = os.path.basename(urlparse(url).path) if url else name
+        self.local_path = os.path.join(self.data_dir, filename)
+        self.meta_path = self.local_path + '.meta.json'
+        self._hash = (None, None)
+
+    def __repr__(self):
+        return 'DataSource({!r}, {!r})'.format(self.name, self.local_path)
+
+    def exists(self):
+        return os.path.exists(self.local_path)
+
+    def path(self):
+        # Never touch the network when a local copy is present; refreshing is
+        # an explicit step so that startup doesn't block on downloads.
+        if not self.exists():
+            self.refresh()
+        return self.local_path
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_meta(self, meta):
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    def content_hash(self):
+        stat = os.stat(self.path())
+        stamp = (stat.st_size, stat.st_mtime)
+        if self._hash[0] != stamp:
+            sha1 = hashlib.sha1()
+            with open(self.local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(chunk)
+            self._hash = (stamp, sha1.hexdigest())
+        return self._hash[1]
+
+    def age(self):
+        fetched_at = self.read_meta().get('fetched_at')
+        if fetched_at is None:
+            return None
+        return time.time() - fetched_at
+
+    def refresh(self, timeout=None):
+        '''Returns True when a new copy was downloaded.'''
+        return self.publish(self.fetch(timeout))
+
+    def fetch(self, timeout=None, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF):
+        '''
+        Downloads and validates a new copy without touching the local one.
+        Returns what publish() needs: (staging path or None when the remote
+        is unchanged, meta), or None when there is no remote to ask.
+        '''
+        if self.offline or not self.url:
+            if not self.exists():
+                raise FileNotFoundError('{} not found and no remote is available for {!r}'.format(self.local_path, self.name))
+            return None
+
+        meta = self.read_meta() if self.exists() else {}
+        headers = {'Accept-Encoding': 'gzip'}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(retries):
+            try:
+                return self._fetch(headers, timeout)
+            except HTTPError as e:
+                if e.code == 304:
+                    return None, dict(meta, fetched_at=time.time())
+                if attempt == retries - 1 or not retryable(e):
+                    raise
+                error = e
+            except Exception as e:
+                if attempt == retries - 1 or not retryable(e):
+                    raise
+                error = e
+            delay = backoff * 2 ** attempt
+            logger.info('Fetching %s failed (%s), retrying in %.1f s', self.name, error, delay)
+            time.sleep(delay)
+
+    def _fetch(self, headers, timeout):
+        deadline = time.monotonic() + timeout
+        with urlopen(Request(self.url, headers=headers), timeout=timeout) as response:
+            tmp_path = self._write(response, deadline)
+            meta = {'url': self.url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'fetched_at': time.time()}
+        try:
+            self.validate(tmp_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path, meta
+
+    def _write(self, response, deadline):
+        # gzip bodies are inflated as they stream in, never held whole in memory
+        if response.headers.get('Content-Encoding') == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decompressor = None
+        os.makedirs(self.data_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix='.' + self.name)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError('Fetching {} ran past its timeout'.format(self.name))
+                    # read1 returns what has arrived, so a trickling body still meets the deadline
+                    chunk = response.read1(1 << 16)
+                    if not chunk:
+                        break
+                    f.write(decompressor.decompress(chunk) if decompressor else chunk)
+                if decompressor:
+                    f.write(decompressor.flush())
+                    if not decompressor.eof:
+                        raise ValueError('Truncated gzip body for {}'.format(self.name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def validate(self, path):
+        '''Rejects a download that is not a CSV with a header and rows, or not JSON.'''
+        if self.local_path.endswith('.json'):
+            with open(path, 'rb') as f:
+                json.load(f)
+            return
+        with open(path, 'rb') as f:
+            header, row = f.readline(), f.readline()
+        if b',' not in header or not row.strip():
+            raise ValueError('{} is not a CSV with a header and rows'.format(self.name))
+
+    def publish(self, staged):
+        '''Moves a fetched copy into place; returns True when the file changed.'''
+        if staged is None:
+            return False
+        tmp_path, meta = staged
+        if tmp_path is not None:
+            os.replace(tmp_path, self.local_path)
+        self.write_meta(meta)
+        return tmp_path is not None
+
+    def discard(self, staged):
+        if staged is not None and staged[0] is not None:
+            os.unlink(staged[0])
+
+
+class DataSources:
+    def __init__(self, data_dir=None, offline=None, urls=SOURCE_URLS, timeouts=SOURCE_TIMEOUTS):
+        self.sources = {name: DataSource(name, url, data_dir, offline, timeouts.get(name))
+                        for name, url in urls.items()}
+
+    def __getitem__(self, name):
+        return self.sources[name]
+
+    def __iter__(self):
+        return iter(self.sources.values())
+
+    def path(self, name):
+        return self.sources[name].path()
+
+    def refresh(self, names=None, workers=None):
+        '''
+        Fetches the named sources (all by default) concurrently and publishes
+        them only once every one has downloaded and validated, so a failure
+        never leaves the mirror mixing old and new files. If any fails, the
+        local copies are kept, and FetchError is raised only when one of them
+        is missing. Returns {name: changed}.
+        '''
+        sources = [self.sources[name] for name in (self.sources if names is None else names)]
+        with ThreadPoolExecutor(max_workers=workers or len(sources) or 1) as pool:
+            futures = [(source, pool.submit(source.fetch)) for source in sources]
+        staged, errors = {}, {}
+        for source, future in futures:
+            try:
+                staged[source.name] = future.result()
+            except Exception as e:
+                errors[source.name] = e
+
+        if errors:
+            for name, item in staged.items():
+                self.sources[name].discard(item)
+            message = '; '.join('{}: {}'.format(name, e) for name, e in errors.items())
+            missing = [source.name for source in sources if not source.exists()]
+            if missing:
+                raise FetchError('No local copy of {} and refreshing failed ({})'.format(', '.join(missing), message))
+            logger.warning('Refreshing failed, keeping the local copies of %s: %s',
+                           ', '.join(source.name for source in sources), message)
+            return {source.name: False for source in sources}
+        return {name: self.sources[name].publish(item) for name, item in staged.items()}
+
+    def load_json(self, name):
+        with open(self.path(name)) as f:
+            return json.load(f)
+
+
+if __name__ == '__main__':
+    for name, changed in DataSources().refresh().items():
+        print('{}: {}'.format(name, 'updated' if changed else 'unchanged'))
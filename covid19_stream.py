@@ -0,0 +1,376 @@
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from covid19_index import group_bounds
+from covid19_metrics import WINDOW, series_metrics
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Rows parsed at a time when a series CSV is streamed into its snapshot
+CHUNK_ROWS = int(os.environ.get('COVID19_CHUNK_ROWS', 1 << 19))
+# Rows per record batch of the snapshot, as write_feather chunks it
+BATCH_ROWS = 1 << 16
+# Days of history a series carries into the next chunk: a 7-day average and the week before it
+CARRY_DAYS = 2 * WINDOW
+
+
+class OutOfOrder(ValueError):
+    '''Rows of a series that go back in time across chunks; only a full in-memory build can sort those.'''
+
+
+class _Ids:
+    '''Ids of the values of a categorical column, in first-seen order across chunks.'''
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, column):
+        categories = column.cat.categories
+        # Missing values (code -1) pick the trailing -1
+        lookup = np.array([self.ids.setdefault(value, len(self.ids)) for value in categories] + [-1], dtype=np.int32)
+        return lookup[column.cat.codes.values]
+
+    def sorted(self):
+        '''The values in the sorted order a full build gives them, and each id's code in that order.'''
+        values = list(self.ids)
+        order = sorted(range(len(values)), key=values.__getitem__)
+        codes = np.full(len(values) + 1, -1, dtype=np.int32)
+        codes[order] = np.arange(len(values), dtype=np.int32)
+        return [values[i] for i in order], codes
+
+
+class _Columns:
+    '''Raw int32/float columns in a directory, one file each.'''
+    def __init__(self, directory, dtypes):
+        self.directory = directory
+        self.dtypes = dtypes
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def append(self, values):
+        for name, dtype in self.dtypes.items():
+            with open(self.path(name), 'ab') as f:
+                np.asarray(values[name], dtype=dtype).tofile(f)
+
+    def read(self, rows):
+        '''The columns `rows` at a time, front to back.'''
+        files = {name: open(self.path(name), 'rb') for name in self.dtypes}
+        try:
+            while True:
+                chunk = {name: np.fromfile(f, dtype=self.dtypes[name], count=rows) for name, f in files.items()}
+                if not len(next(iter(chunk.values()))):
+                    return
+                yield chunk
+        finally:
+            for f in files.values():
+                f.close()
+
+
+def write_series_snapshot(cls, chunks, population, path, chunk_rows=CHUNK_ROWS):
+    '''
+    Writes the table of a SeriesDataset to a feather file at `path` from
+    `chunks` of parsed rows, holding only one chunk and a few days per
+    series in memory, with rows, categories and metrics as from_sources()
+    leaves them.
+
+    The rows are staged typed on disk first, to count the rows of every
+    series and learn every category. A second pass derives the metrics
+    chunk by chunk, with each series carrying its last CARRY_DAYS of cases
+    into the next chunk, and writes every row straight to its position in
+    the sorted table. Last, the columns are read back batch by batch into
+    the snapshot. Raises OutOfOrder unless each series' rows are in date
+    order, as they are in a file that grows by appending days.
+    '''
+    work_dir = tempfile.mkdtemp(prefix='.stream-', dir=os.path.dirname(path) or '.')
+    try:
+        columns, values, n_series, ids, series_ids, counts = _stage(cls, chunks, work_dir)
+        categories, codes = {}, {}
+        for column, column_ids in ids.items():
+            categories[column], codes[column] = column_ids.sorted()
+
+        # Series sort by their categories' codes, each one a contiguous run of rows
+        keys = np.array([[codes[column][series[i]] for series in series_ids] for i, column in enumerate(cls.series)],
+                        dtype=np.int64).reshape(len(cls.series), n_series)
+        order = np.lexsort(keys[::-1])
+        rank = np.empty(n_series, dtype=np.int64)
+        rank[order] = np.arange(n_series)
+        offsets = np.concatenate([[0], np.cumsum(counts[order])])
+        series_codes = {column: keys[i][order] for i, column in enumerate(cls.series)}
+
+        if cls.population_key in cls.series:
+            series_population = population.reindex(categories[cls.population_key]).values[series_codes[cls.population_key]]
+        else:
+            by_code = np.append(population.reindex(categories[cls.population_key]).values, np.nan)
+
+        staged = _Columns(work_dir, dict(values, series='int32'))
+        # Stored as float64 until compact() makes it Int32, like from_sources()
+        metrics = {'new_cases': 'float64', 'new_cases_avg7': 'float32', 'new_cases_per_100k': 'float32', 'growth_wow': 'float32'}
+        out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(out_dir)
+        row_columns = [name for name in values if name not in cls.series]
+        out = _Columns(out_dir, dict({name: values[name] for name in row_columns}, **metrics))
+        files = {name: os.open(out.path(name), os.O_WRONLY | os.O_CREAT) for name in out.dtypes}
+        try:
+            written = np.zeros(n_series, dtype=np.int64)
+            last_day = np.full(n_series, np.iinfo(np.int64).min)
+            carry = None
+            for chunk in staged.read(chunk_rows):
+                # Rows of this chunk by series, then date
+                chunk_rank = rank[chunk['series']]
+                order = np.lexsort((chunk['date'], chunk_rank))
+                chunk = {name: column[order] for name, column in chunk.items()}
+                chunk_rank = chunk_rank[order]
+                for column in row_columns:
+                    if column in codes:
+                        chunk[column] = codes[column][chunk[column]]
+                chunk['rank'] = chunk_rank
+                if cls.population_key in cls.series:
+                    chunk['population'] = series_population[chunk_rank]
+                else:
+                    chunk['population'] = by_code[chunk[cls.population_key]]
+                starts, stops = group_bounds(chunk_rank)
+                if (chunk['date'][starts] <= last_day[chunk_rank[starts]]).any():
+                    raise OutOfOrder('{} rows of a series go back in time'.format(cls.name))
+
+                # Metrics over the carried days and this chunk, kept for this chunk
+                both = chunk if carry is None else {name: np.concatenate([carry[name], chunk[name]])
+                                                    for name in ('rank', 'date', 'cases', 'population')}
+                derived = series_metrics(both['rank'], both['date'], both['cases'], both['population'])
+                skip = len(both['rank']) - len(chunk_rank)
+                for name in metrics:
+                    chunk[name] = derived[name][skip:].astype(metrics[name])
+
+                for start, stop, series in zip(starts, stops, chunk_rank[starts]):
+                    position = offsets[series] + written[series]
+                    for name, fd in files.items():
+                        data = chunk[name][start:stop]
+                        os.pwrite(fd, data.tobytes(), int(position) * data.itemsize)
+                    written[series] += stop - start
+                last_day[chunk_rank[starts]] = chunk['date'][stops - 1]
+                carry = _carry(both)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+        # The CSV's columns, then the metrics
+        _write_batches(cls, out.read(BATCH_ROWS), out.dtypes, columns + list(metrics), series_codes, offsets,
+                       categories, path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def append_series_snapshot(cls, df, rows, population, path, batch_rows=BATCH_ROWS):
+    '''
+    Writes the table of a SeriesDataset, `df` with `rows` of later days
+    added, to a feather file at `path`, as SeriesDataset.append() gives it.
+    The combined table is never held in memory: each record batch gathers
+    its rows from `df` and `rows` by position. Only the new rows' metrics are
+    derived, from the last CARRY_DAYS of each series. Raises OutOfOrder
+    unless `df` is sorted by series and date, as sort_rows keeps it.
+    '''
+    starts, stops = _series_runs(cls, df)
+
+    # Categories merged into the sorted order a full build gives, and each side's codes in them
+    categories, old_codes, new_codes = {}, {}, {}
+    for column in cls.categories:
+        old = df[column].cat.categories
+        new = rows[column].astype('category')
+        merged = old.append(new.cat.categories).unique().sort_values()
+        categories[column] = merged
+        # Missing values (code -1) pick the trailing -1
+        old_codes[column] = np.append(merged.get_indexer(old), -1).astype(np.int32)
+        new_codes[column] = np.append(merged.get_indexer(new.cat.categories), -1).astype(np.int32)[new.cat.codes.values]
+
+    counts = np.minimum(stops - starts, CARRY_DAYS + 1)
+    carried = np.repeat(stops - counts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    carried = df.take(carried)
+    carried = carried[carried['date'].values >= np.repeat(df['date'].values[stops - 1], counts) - CARRY_DAYS]
+    rows = cls.appended_metrics(carried, rows, population)
+
+    # One integer per series, in the order of the merged categories
+    radices = [len(categories[column]) + 1 for column in cls.series]
+
+    def series_key(codes):
+        key = np.zeros(len(codes[0]), dtype=np.int64)
+        for column_codes, radix in zip(codes, radices):
+            key = key * radix + column_codes + 1
+        return key
+
+    old_keys = series_key([old_codes[column][df[column].cat.codes.values[starts]] for column in cls.series])
+    row_keys = series_key([new_codes[column] for column in cls.series])
+    # Stable, so each series keeps its rows in date order
+    order = np.argsort(row_keys, kind='stable')
+    new_keys, new_starts, new_counts = np.unique(row_keys[order], return_index=True, return_counts=True)
+    keys = np.union1d(old_keys, new_keys)
+    old_start, old_count, new_start, new_count = (np.zeros(len(keys), dtype=np.int64) for _ in range(4))
+    old_at, new_at = np.searchsorted(keys, old_keys), np.searchsorted(keys, new_keys)
+    old_start[old_at], old_count[old_at] = starts, stops - starts
+    new_start[new_at], new_count[new_at] = new_starts, new_counts
+    offsets = np.concatenate([[0], np.cumsum(old_count + new_count)])
+    series_codes = {}
+    for column, radix in reversed(list(zip(cls.series, radices))):
+        keys, part = np.divmod(keys, radix)
+        series_codes[column] = (part - 1).astype(np.int32)
+
+    # Row columns as write_series_snapshot() stages them: categories as codes, Int32 as float64
+    names = list(df.columns)
+    old_columns, new_columns, dtypes, nullable = {}, {}, {}, set()
+    for name in names:
+        if name in cls.series:
+            continue
+        if name in categories:
+            old_columns[name] = df[name].cat.codes.values
+            new_columns[name] = new_codes[name][order]
+            dtypes[name] = np.dtype(np.int32)
+        elif _nullable(df[name]):
+            nullable.add(name)
+            old_columns[name] = df[name].array
+            new_columns[name] = rows[name].to_numpy(dtype='float64', na_value=np.nan)[order]
+            dtypes[name] = np.dtype('float64')
+        else:
+            old_columns[name] = df[name].values
+            new_columns[name] = np.asarray(rows[name])[order]
+            dtypes[name] = np.result_type(df[name].dtype, new_columns[name].dtype)
+
+    def gather(name, at):
+        '''Rows `at` of an old column, converted like the new one.'''
+        if name in categories:
+            return old_codes[name][old_columns[name][at]]
+        if name in nullable:
+            return old_columns[name][at].to_numpy(dtype='float64', na_value=np.nan)
+        return old_columns[name][at]
+
+    def batches():
+        for begin in range(0, offsets[-1], batch_rows):
+            positions = np.arange(begin, min(begin + batch_rows, offsets[-1]))
+            series = np.searchsorted(offsets, positions, side='right') - 1
+            within = positions - offsets[series]
+            old = within < old_count[series]
+            old_at = old_start[series[old]] + within[old]
+            new_at = new_start[series[~old]] + within[~old] - old_count[series[~old]]
+            batch = {}
+            for name, dtype in dtypes.items():
+                batch[name] = np.empty(len(positions), dtype=dtype)
+                batch[name][old] = gather(name, old_at)
+                batch[name][~old] = new_columns[name][new_at]
+            yield batch
+
+    _write_batches(cls, batches(), dtypes, names, series_codes, offsets, categories, path)
+
+
+def _series_runs(cls, df, chunk_rows=CHUNK_ROWS):
+    '''Start/stop of each series' rows in a table sorted by series, then date; raises OutOfOrder otherwise.'''
+    codes = [df[column].cat.codes.values for column in cls.series]
+    radices = [len(df[column].cat.categories) + 1 for column in cls.series]
+    dates = df['date'].values
+    starts = [np.zeros(min(len(dates), 1), dtype=np.int64)]
+    # A chunk at a time, each overlapping the last by a row
+    for begin in range(0, max(len(dates) - 1, 0), chunk_rows):
+        stop = min(begin + chunk_rows + 1, len(dates))
+        key = np.zeros(stop - begin, dtype=np.int64)
+        for column_codes, radix in zip(codes, radices):
+            key = key * radix + column_codes[begin:stop] + 1
+        new_series = key[1:] != key[:-1]
+        later = dates[begin + 1:stop] > dates[begin:stop - 1]
+        if not ((key[1:] > key[:-1]) | (~new_series & later)).all():
+            raise OutOfOrder('{} rows are not sorted by series and date'.format(cls.name))
+        starts.append(begin + 1 + np.flatnonzero(new_series))
+    starts = np.concatenate(starts)
+    return starts, np.append(starts[1:], len(dates))[:len(starts)]
+
+
+def _stage(cls, chunks, work_dir):
+    '''Typed rows in file order on disk, with the ids of every category and the row count of every series.'''
+    ids = {column: _Ids() for column in cls.categories}
+    series_index, series_ids = {}, []
+    counts = np.zeros(0, dtype=np.int64)
+    staged, columns = None, None
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            # Nullable integers as float64 with NaN, as compact() reads them back
+            values = {name: ('int32' if name in ids else 'float64' if _nullable(chunk[name]) else chunk[name].dtype.str)
+                      for name in columns}
+            staged = _Columns(work_dir, dict(values, series='int32'))
+        encoded = {name: ids[name].encode(chunk[name]) if name in ids
+                   else chunk[name].to_numpy(dtype=values[name], na_value=np.nan) if _nullable(chunk[name])
+                   else chunk[name].values for name in columns}
+        # One integer per series within this chunk, hashed rather than sorted
+        key, radices = np.zeros(len(chunk), dtype=np.int64), []
+        for column in cls.series:
+            radices.append(int(encoded[column].max()) + 2 if len(chunk) else 1)
+            key = key * radices[-1] + (encoded[column] + 1)
+        inverse, keys = pd.factorize(key)
+        parts = []
+        for radix in reversed(radices):
+            keys, part = np.divmod(np.asarray(keys), radix)
+            parts.append(part - 1)
+        lookup = np.array([series_index.setdefault(pair, len(series_index)) for pair in zip(*reversed(parts))],
+                          dtype=np.int32)
+        series_ids.extend(list(series_index)[len(series_ids):])
+        encoded['series'] = lookup[inverse] if len(lookup) else np.zeros(0, dtype=np.int32)
+        counts = np.append(counts, np.zeros(len(series_index) - len(counts), dtype=np.int64))
+        counts += np.bincount(encoded['series'], minlength=len(series_index))
+        staged.append(encoded)
+    if columns is None:
+        raise ValueError('no rows to stream for {}'.format(cls.name))
+    return columns, values, len(series_index), ids, series_ids, counts
+
+
+def _nullable(column):
+    '''Whether `column` holds nullable integers (Int32), which may be missing.'''
+    return pd.api.types.is_extension_array_dtype(column.dtype) and pd.api.types.is_integer_dtype(column.dtype)
+
+
+def _carry(rows):
+    '''The rows a chunk hands to the next: the last CARRY_DAYS of each series, and always its last row.'''
+    order = np.lexsort((rows['date'], rows['rank']))
+    rows = {name: rows[name][order] for name in ('rank', 'date', 'cases', 'population')}
+    starts, stops = group_bounds(rows['rank'])
+    last = np.repeat(rows['date'][stops - 1], stops - starts)
+    keep = rows['date'] >= last - CARRY_DAYS
+    return {name: column[keep] for name, column in rows.items()}
+
+
+def _write_batches(cls, batches, dtypes, names, series_codes, offsets, categories, path):
+    '''
+    Assembles batches of the sorted columns into a feather file, adding the
+    series columns, which hold one value per series between `offsets`.
+    '''
+    writer, schema = None, None
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    position = 0
+    try:
+        for batch in itertools.chain(batches, [None]):
+            if batch is None:
+                if writer is not None:
+                    break
+                # Every row was filtered out: an empty table, with its schema
+                batch = {name: np.zeros(0, dtype=dtype) for name, dtype in dtypes.items()}
+            rows = len(batch['new_cases'])
+            series = np.searchsorted(offsets, np.arange(position, position + rows), side='right') - 1
+            position += rows
+            columns = dict(batch)
+            for column, column_codes in series_codes.items():
+                columns[column] = column_codes[series]
+            for column in cls.categories:
+                columns[column] = pd.Categorical.from_codes(columns[column], categories=categories[column])
+            df = cls.compact(pd.DataFrame({name: columns[name] for name in names}))
+            if writer is None:
+                schema = pa.Schema.from_pandas(df, preserve_index=False)
+                writer = pa.ipc.new_file(tmp_path, schema)
+            writer.write_batch(pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False))
+        writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
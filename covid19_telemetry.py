@@ -0,0 +1,194 @@
+import bisect
+import os
+import threading
+import time
+
+# Set COVID19_TELEMETRY=0 to turn every timer into a no-op
+ENABLED = os.environ.get('COVID19_TELEMETRY', '1') == '1'
+# Adds a Server-Timing header with the phases of each request (shown in browser dev tools)
+SERVER_TIMING = os.environ.get('COVID19_SERVER_TIMING', '') == '1'
+
+# Upper bounds in seconds, Prometheus' defaults plus a sub-millisecond bucket for cache hits
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'covid19_callback_seconds': 'Callback latency by cache result',
+    'covid19_callback_phase_seconds': 'Time spent in each phase of a callback',
+    'covid19_request_seconds': 'Flask request latency by endpoint',
+    'covid19_dataset_load_seconds': 'Time to load a dataset from a snapshot or build it from its sources',
+    'covid19_dataset_refresh_seconds': 'Time to refresh a dataset, fetching its sources and swapping versions',
+}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+
+class _Timer:
+    __slots__ = ('telemetry', 'name', 'labels', 'span', 'start')
+
+    def __init__(self, telemetry, name, labels, span):
+        self.telemetry = telemetry
+        self.name = name
+        self.labels = labels
+        self.span = span
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.telemetry.observe(self.name, self.labels, time.perf_counter() - self.start, self.span)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _State(threading.local):
+    # Per thread: the callback being timed, how it was answered, and the
+    # spans of the current request when Server-Timing is on
+    callback = None
+    result = 'uncached'
+    trace = None
+
+
+class Telemetry:
+    '''
+    Latency histograms and collected gauges for one process, rendered in the
+    Prometheus text format. Every series carries the worker's pid: each
+    gunicorn worker keeps its own numbers, and a scrape sees the worker that
+    served it.
+    '''
+    def __init__(self, enabled=ENABLED, server_timing=SERVER_TIMING):
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.histograms = {}
+        self.collectors = []
+        self._local = _State()
+        self._lock = threading.Lock()
+
+    def timer(self, name, **labels):
+        '''Context manager observing its duration into histogram `name`.'''
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, tuple(sorted(labels.items())), None)
+
+    def callback(self, name):
+        '''Times a whole callback; phase() timers inside it are attributed to it.'''
+        if not self.enabled:
+            return NULL_TIMER
+        self._local.callback = name
+        return _Timer(self, 'covid19_callback_seconds', None, name)
+
+    def phase(self, phase):
+        if not self.enabled:
+            return NULL_TIMER
+        callback = self._local.callback
+        return _Timer(self, 'covid19_callback_phase_seconds', (('callback', callback), ('phase', phase)), (callback, phase))
+
+    def result(self, result):
+        '''How the current callback was answered: a local or shared cache hit, or a miss.'''
+        if self.enabled:
+            self._local.result = result
+
+    def observe(self, name, labels, seconds, span=None):
+        local = self._local
+        if labels is None:
+            # A callback: its labels are known once it has run
+            labels = (('callback', span), ('result', local.result))
+            local.callback, local.result = None, 'uncached'
+        with self._lock:
+            series = self.histograms.get(name)
+            if series is None:
+                series = self.histograms[name] = {}
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram()
+            histogram.observe(seconds)
+        if local.trace is not None and span is not None:
+            local.trace.append(('.'.join(span) if isinstance(span, tuple) else span, seconds))
+
+    def start_trace(self):
+        self._local.trace = [] if self.enabled and self.server_timing else None
+
+    def end_trace(self):
+        '''The Server-Timing header value for the spans recorded since start_trace().'''
+        trace, self._local.trace = self._local.trace, None
+        if not trace:
+            return None
+        return ', '.join('{};dur={:.2f}'.format(span.replace(' ', '_'), seconds * 1000) for span, seconds in trace)
+
+    def collect(self, fn):
+        '''Registers fn() -> [(name, type, help, labels, value)], called on every scrape.'''
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        pid = ('pid', str(os.getpid()))
+        lines = []
+        with self._lock:
+            histograms = {name: {labels: (list(h.counts), h.sum) for labels, h in series.items()}
+                          for name, series in self.histograms.items()}
+        for name in sorted(histograms):
+            lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+            lines.append('# TYPE {} histogram'.format(name))
+            for labels, (counts, total) in sorted(histograms[name].items(), key=lambda item: str(item[0])):
+                labels = (pid,) + labels
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', str(bound)),)), cumulative))
+                lines.append('{}_sum{} {!r}'.format(name, format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), cumulative))
+
+        described = set()
+        for fn in self.collectors:
+            for name, kind, help, labels, value in fn():
+                if name not in described:
+                    described.add(name)
+                    lines.append('# HELP {} {}'.format(name, help))
+                    lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{}{} {!r}'.format(name, format_labels((pid,) + tuple(sorted(labels.items()))), float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                          for key, value in labels) + '}'
+
+
+def memory_kb():
+    '''Rss, Pss and shared memory of this process, from /proc where available.'''
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty'):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        # ru_maxrss is the peak, in kB on Linux
+        memory['MaxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if 'Shared_Clean' in memory:
+        memory['Shared'] = memory.pop('Shared_Clean') + memory.pop('Shared_Dirty')
+    return memory
+
+
+# One per process, shared by the data, cache and app modules
+telemetry = Telemetry()
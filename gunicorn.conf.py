@@ -0,0 +1,21 @@
+import gc
+
+# Read by gunicorn from the working directory. With --preload (see Procfile)
+# the master loads the datasets, geometry and startup layout once and the
+# forked workers share those pages copy-on-write. Without it every worker
+# loads what it needs on its first request.
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import covid19_dash
+        covid19_dash.preload()
+        # Move everything loaded so far out of the collector's reach, so that
+        # collections in the workers don't write to (and so copy) shared pages
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    from covid19_export import EXPORT_ON_REFRESH, start_export
+    if EXPORT_ON_REFRESH:
+        # The port is bound by now, so a long export never holds up the boot
+        start_export()
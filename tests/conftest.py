@@ -0,0 +1,20 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURES = os.path.join(ROOT, 'fixtures')
+
+sys.path.insert(0, ROOT)
+# Short retry backoff, so the failing fetches in test_sources finish quickly; read at import
+os.environ.setdefault('COVID19_FETCH_BACKOFF', '0.1')
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    '''A copy of the fixtures, for tests that rewrite the sources.'''
+    directory = tmp_path / 'data'
+    shutil.copytree(FIXTURES, str(directory))
+    return str(directory)
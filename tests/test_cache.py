@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+
+from covid19_cache import CallbackCache, response_body, serialize
+
+
+class Version:
+    version = 'v1'
+
+
+class Live:
+    current = Version()
+
+
+def test_response_body_splits_outputs_without_decoding():
+    outputs = [('map-state', 'figure'), ('header-state', 'children'), ('table-states', 'children')]
+    values = ({'data': [{'z': np.array([1.5, np.nan])}]}, 'Texas\nCounties', ['a', ',\n,', {'b': None}])
+    body = json.loads(response_body(outputs, serialize(values), multi=True))
+    assert body == {'multi': True, 'response': {'map-state': {'figure': {'data': [{'z': [1.5, None]}]}},
+                                                'header-state': {'children': 'Texas\nCounties'},
+                                                'table-states': {'children': ['a', ',\n,', {'b': None}]}}}
+
+    # A single output is the whole payload, even when its value is a list
+    body = json.loads(response_body([('state-dropdown', 'options')], serialize(['a', 'b']), multi=False))
+    assert body == {'multi': True, 'response': {'state-dropdown': {'options': ['a', 'b']}}}
+
+
+def test_memoized_callback_is_called_once():
+    calls = []
+    cache = CallbackCache()
+
+    @cache.memoize(Live())
+    def header(state):
+        calls.append(state)
+        return 'Header', state
+
+    assert header('Texas') == header('Texas') == ['Header', 'Texas']
+    assert calls == ['Texas'] and cache.local_hits == 1 and cache.misses == 1
+    assert json.loads(cache.payload(header, ('Texas',))) == ['Header', 'Texas'] and calls == ['Texas']
@@ -0,0 +1,14 @@
+from covid19_figures import visible_range
+from covid19_index import day_number
+
+
+def test_visible_range_of_relayout_events():
+    zoomed = (day_number('2020-09-10'), day_number('2020-09-20'))
+    assert visible_range({'xaxis.range[0]': '2020-09-10 03:00', 'xaxis.range[1]': '2020-09-19 12:00'}) == zoomed
+    assert visible_range({'xaxis.range': ['2020-09-10', '2020-09-20']}) == zoomed
+    # Zoomed out
+    assert visible_range(None) is None
+    assert visible_range({'xaxis.autorange': True, 'yaxis.autorange': True}) is None
+    # Events that leave the x-axis as it is
+    for relayout in ({'dragmode': 'pan'}, {'autosize': True}, {'yaxis.range[0]': 0, 'yaxis.range[1]': 10}):
+        assert visible_range(relayout) is False
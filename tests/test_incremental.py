@@ -0,0 +1,137 @@
+import io
+
+import pandas as pd
+import pytest
+
+from covid19_data import Counties, DatasetCache, States, read_population, read_snapshot
+from covid19_sources import DataSources
+from covid19_stream import append_series_snapshot
+
+
+def hold_back_last_day(path):
+    '''Rewrites `path` without its last day and returns that day's rows.'''
+    with open(path) as f:
+        header, *lines = f.readlines()
+    last = max(line[:10] for line in lines)
+    with open(path, 'w') as f:
+        f.writelines([header] + [line for line in lines if line[:10] < last])
+    return ''.join(line for line in lines if line[:10] == last)
+
+
+@pytest.mark.parametrize('cls', [Counties, States])
+def test_append_matches_full_rebuild(cls, data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    path = sources[cls.sources[0]].local_path
+    new_rows = hold_back_last_day(path)
+
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(cls)
+    with open(path, 'a') as f:
+        f.write(new_rows)
+
+    incremental = cache.build(cls, previous)
+    full = cls.from_sources(sources)
+
+    assert cache.increments == 1
+    pd.testing.assert_frame_equal(incremental.df, full.df, check_exact=True, check_categorical=True)
+    for column in cls.categories:
+        assert list(incremental.df[column].cat.categories) == list(full.df[column].cat.categories)
+    assert incremental.manifest == full.manifest
+
+
+def test_stream_append_matches_full_rebuild(data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    path = sources['counties'].local_path
+    new_rows = hold_back_last_day(path)
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(Counties)
+    with open(path, 'a') as f:
+        f.write(new_rows)
+
+    # Written batch by batch into the snapshot, not built in memory
+    version_dir, dataset = cache.snapshot(Counties, previous=previous)
+    assert dataset is None and cache.increments == 1
+    streamed = Counties.from_snapshot(version_dir)
+    full = Counties.from_sources(sources)
+    pd.testing.assert_frame_equal(streamed.df, full.df, check_exact=True)
+    assert streamed.manifest == full.manifest
+    # Adjuntas reports no deaths on some days, the appended one among them
+    assert streamed.df['deaths'].isna().sum() == 2
+
+    # Batches that end mid-series, old rows and new
+    population = read_population(sources.path('population'))['fips']
+    rows = Counties.parse(io.StringIO('date,county,state,fips,cases,deaths\n' + new_rows))
+    small = str(tmp_path / 'small.feather')
+    append_series_snapshot(Counties, previous.df, rows, population, small, batch_rows=50)
+    pd.testing.assert_frame_equal(read_snapshot(small), full.df, check_exact=True)
+
+
+def test_stream_append_of_unsorted_table_rebuilds(data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    path = sources['counties'].local_path
+    new_rows = hold_back_last_day(path)
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(Counties)
+    previous.df = previous.df.iloc[::-1].reset_index(drop=True)
+    with open(path, 'a') as f:
+        f.write(new_rows)
+
+    version_dir, _ = cache.snapshot(Counties, previous=previous)
+    assert cache.increments == 0
+    pd.testing.assert_frame_equal(Counties.from_snapshot(version_dir).df, Counties.from_sources(sources).df)
+
+
+@pytest.mark.parametrize('streamed', [False, True])
+def test_append_new_and_quiet_counties(streamed, data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    path = sources['counties'].local_path
+    new_rows = hold_back_last_day(path)
+    # One county skips the day, another reports for the first time
+    new_rows = ''.join(line for line in new_rows.splitlines(True) if ',Sussex,Delaware,' not in line)
+    new_rows += '2020-10-15,Adams,Delaware,10099,3,0\n'
+
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(Counties)
+    with open(path, 'a') as f:
+        f.write(new_rows)
+
+    if streamed:
+        version_dir, _ = cache.snapshot(Counties, previous=previous)
+        incremental = Counties.from_snapshot(version_dir)
+    else:
+        incremental = cache.build(Counties, previous)
+    assert cache.increments == 1
+    pd.testing.assert_frame_equal(incremental.df, Counties.from_sources(sources).df, check_exact=True)
+
+
+def test_new_population_rebuilds_in_full(data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    path = sources['counties'].local_path
+    new_rows = hold_back_last_day(path)
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(Counties)
+    with open(path, 'a') as f:
+        f.write(new_rows)
+    # Every stored per-100k value depends on the estimates
+    with open(sources['population'].local_path, 'a') as f:
+        f.write('050,10,099,Delaware,Adams County,1000\n')
+
+    rebuilt = cache.build(Counties, previous)
+    assert cache.increments == 0
+    pd.testing.assert_frame_equal(rebuilt.df, Counties.from_sources(sources).df)
+
+
+def test_revised_rows_rebuild_in_full(data_dir, tmp_path):
+    sources = DataSources(data_dir=data_dir, offline=True)
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    previous = cache.get(Counties)
+    path = sources['counties'].local_path
+    with open(path) as f:
+        text = f.read()
+    # An earlier day revised in place: the ingested prefix no longer matches
+    with open(path, 'w') as f:
+        f.write(text.replace('2020-09-01,Kent,Delaware,10001,1978', '2020-09-01,Kent,Delaware,10001,1979', 1))
+
+    rebuilt = cache.build(Counties, previous)
+    assert cache.increments == 0
+    pd.testing.assert_frame_equal(rebuilt.df, Counties.from_sources(sources).df)
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19_data import Counties, read_population
+from covid19_metrics import METRICS, WINDOW, series_metrics
+from covid19_sources import DataSources
+from conftest import FIXTURES
+
+
+def reference_metrics(df, population):
+    '''One county at a time, in plain Python.'''
+    out = {name: np.full(len(df), np.nan) for name in METRICS}
+    rows = {}
+    for i, key in enumerate(zip(df['state'].values, df['county'].values)):
+        rows.setdefault(key, []).append(i)
+    dates, cases = df['date'].values, df['cases'].values
+    for key, positions in rows.items():
+        positions = sorted(positions, key=lambda i: dates[i])
+        by_day = {int(dates[i]): float(cases[i]) for i in positions}
+        averages = {}
+        for j, i in enumerate(positions):
+            day = int(dates[i])
+            if j:
+                out['new_cases'][i] = cases[i] - cases[positions[j - 1]]
+            if day - WINDOW in by_day:
+                averages[day] = (cases[i] - by_day[day - WINDOW]) / WINDOW
+                out['new_cases_avg7'][i] = averages[day]
+                out['new_cases_per_100k'][i] = averages[day] / population[i] * 100000
+                if averages.get(day - WINDOW, 0) > 0:
+                    out['growth_wow'][i] = averages[day] / averages[day - WINDOW] - 1
+    return out
+
+
+def assert_matches_reference(df, population, metrics):
+    reference = reference_metrics(df, population)
+    for name in METRICS:
+        got = np.asarray(metrics[name], dtype=float)
+        assert np.array_equal(np.isnan(got), np.isnan(reference[name])), name
+        # Stored as float32, so compare in float32 precision
+        assert np.allclose(got, reference[name], rtol=1e-6, equal_nan=True), name
+
+
+@pytest.fixture(scope='module')
+def counties():
+    sources = DataSources(data_dir=FIXTURES, offline=True)
+    df = Counties.from_sources(sources).df
+    population = read_population(sources.path('population'))['fips']
+    return df, population.reindex(df['fips'].astype(object)).values
+
+
+def test_county_table_matches_reference(counties):
+    df, population = counties
+    assert_matches_reference(df, population, {name: df[name].to_numpy(dtype=float, na_value=np.nan) for name in METRICS})
+
+
+def test_shuffled_rows_with_missing_days(counties):
+    df, population = counties
+    rng = np.random.RandomState(1)
+    sample = rng.permutation(len(df))[:int(len(df) * 0.9)]
+    gappy = df.take(sample).reset_index(drop=True)
+    metrics = series_metrics(Counties.series_codes(gappy), gappy['date'].values, gappy['cases'].values,
+                             population[sample])
+    assert_matches_reference(gappy, population[sample], metrics)
+    # A missing day leaves the windows that need it empty instead of spanning the gap
+    assert np.isnan(metrics['new_cases_avg7']).sum() > np.isnan(df['new_cases_avg7'].values[sample]).sum()
+
+
+def test_unsorted_rows_give_the_sorted_result(counties):
+    df, population = counties
+    codes = Counties.series_codes(df)
+    order = np.random.RandomState(2).permutation(len(df))
+    in_order = series_metrics(codes, df['date'].values, df['cases'].values, population)
+    shuffled = series_metrics(codes[order], df['date'].values[order], df['cases'].values[order], population[order])
+    for name in METRICS:
+        np.testing.assert_array_equal(shuffled[name], in_order[name][order])
+
+
+def test_no_population_leaves_per_100k_empty():
+    metrics = series_metrics(np.zeros(10, dtype=np.int64), np.arange(10), np.arange(10) * 7.0)
+    assert np.isnan(metrics['new_cases_per_100k']).all()
+    assert list(metrics['new_cases_avg7'][WINDOW:]) == [7.0] * (10 - WINDOW)
+    assert pd.isnull(metrics['growth_wow']).all()
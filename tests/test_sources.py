@@ -0,0 +1,142 @@
+import os
+import time
+
+import pytest
+
+from covid19_cache import CallbackCache
+from covid19_data import Counties, DatasetCache, ingest
+from covid19_index import day_number
+from covid19_sources import SOURCE_URLS, DataSources, FetchError
+from upstream import Upstream, same_as_upstream
+
+NEW_DAY = b'2020-10-16,El Paso,Texas,48141,10100,612\n'
+
+
+@pytest.fixture(scope='module')
+def upstream():
+    server = Upstream()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def sources_in(upstream, tmp_path):
+    '''DataSources in a fresh directory of tmp_path, fetching from the stand-in.'''
+    upstream.reset()
+    files = dict(upstream.files)
+    yield lambda name, **kwargs: DataSources(data_dir=str(tmp_path / name), offline=False, urls=upstream.urls(), **kwargs)
+    upstream.files = files
+
+
+def wait_for_refresh(live, timeout=10):
+    deadline = time.time() + timeout
+    while live.refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert not live.refreshing
+
+
+def staging_files(data_dir):
+    return [name for name in os.listdir(data_dir) if name.startswith('.') and not name.endswith('.meta.json')]
+
+
+def test_refresh_fetches_gzip_then_revalidates(upstream, sources_in):
+    upstream.modes = {upstream.filename(name): ('slow', 0.2) for name in SOURCE_URLS}
+    sources = sources_in('mirror')
+    assert all(sources.refresh().values())
+    assert same_as_upstream(upstream, sources)
+    assert upstream.gzipped == len(SOURCE_URLS)
+
+    upstream.reset()
+    assert not any(sources.refresh().values())
+    assert upstream.not_modified == len(SOURCE_URLS)
+
+
+def test_flaky_source_recovers_on_retry(upstream, sources_in):
+    tests_csv = upstream.filename('nyc_tests')
+    upstream.modes = {tests_csv: ('flaky', 2)}
+    sources = sources_in('flaky')
+    assert all(sources.refresh().values())
+    assert upstream.requests[tests_csv] == 3
+    assert same_as_upstream(upstream, sources)
+
+
+def test_failing_source_publishes_nothing(upstream, sources_in):
+    sources = sources_in('failing')
+    sources.refresh()
+    counties_csv, population_csv = upstream.filename('counties'), upstream.filename('population')
+    original = upstream.files[counties_csv]
+    # counties changes upstream while population fails: neither is published
+    upstream.files[counties_csv] = original + NEW_DAY
+    upstream.reset()
+    upstream.modes = {population_csv: ('fail', None)}
+
+    assert not any(sources.refresh(['counties', 'population']).values())
+    assert upstream.requests[population_csv] == 3
+    assert not staging_files(sources['counties'].data_dir)
+    with open(sources['counties'].local_path, 'rb') as f:
+        assert f.read() == original
+
+    with pytest.raises(FetchError):
+        sources_in('empty').refresh(['counties', 'population'])
+
+
+def test_trickling_source_times_out(upstream, sources_in):
+    geojson = upstream.filename('geojson')
+    upstream.modes = {geojson: ('trickle', 0.1)}
+    sources = sources_in('trickle', timeouts={'geojson': 0.5})
+    with pytest.raises(FetchError):
+        sources.refresh(['geojson', 'states'])
+    assert upstream.requests[geojson] == 3
+    assert not sources['states'].exists()
+    assert not staging_files(sources['states'].data_dir)
+
+
+def test_dataset_swaps_once_every_source_validates(upstream, sources_in, tmp_path):
+    sources = sources_in('dataset')
+    sources.refresh()
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'))
+    live = cache.live(Counties)
+    before = live.current.version
+    swapped = []
+    cache.on_swap.append(swapped.append)
+
+    counties_csv = upstream.filename('counties')
+    upstream.files[counties_csv] += NEW_DAY
+    upstream.modes = {upstream.filename('population'): ('fail', None)}
+    cache.refresh(live)
+    assert live.current.version == before and cache.swaps == 0 and not swapped
+
+    upstream.modes = {}
+    cache.refresh(live)
+    assert live.current.version != before and cache.swaps == 1 and swapped == [live]
+    assert live.current.df['date'].max() == day_number('2020-10-16')
+
+
+def test_ingest_fetches_missing_sources_together(upstream, sources_in, tmp_path):
+    upstream.modes = {upstream.filename(name): ('slow', 0.5) for name in SOURCE_URLS}
+    sources = sources_in('ingest')
+    ingest(sources, str(tmp_path / 'snapshots'))
+    assert all(source.exists() for source in sources)
+    # Each source was asked for once, all at the same time
+    assert sum(upstream.requests.values()) == len(SOURCE_URLS)
+    assert upstream.most_concurrent == len(SOURCE_URLS)
+
+
+def test_cached_callback_starts_a_refresh(sources_in, tmp_path):
+    sources = sources_in('revalidate')
+    sources.refresh()
+    cache = DatasetCache(sources, str(tmp_path / 'snapshots'), ttl=0)
+    live = cache.live(Counties)
+    callbacks = CallbackCache()
+
+    @callbacks.memoize(live)
+    def last_day():
+        return int(live.current.df['date'].max())
+
+    last_day()
+    wait_for_refresh(live)
+    refreshes = cache.refreshes
+    # Served from the callback cache, yet the stale version is still revalidated
+    assert last_day() == day_number('2020-10-15') and callbacks.local_hits == 1
+    wait_for_refresh(live)
+    assert cache.refreshes == refreshes + 1
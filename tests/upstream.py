@@ -0,0 +1,106 @@
+'''
+A local HTTP stand-in for the remote sources, serving the fixtures under the
+file names of SOURCE_URLS, gzip-encoded when asked, with ETags.
+'''
+import collections
+import gzip
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from covid19_sources import SOURCE_URLS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fixtures')
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.lstrip('/')
+        upstream = self.server
+        upstream.requests[path] += 1
+        mode, arg = upstream.modes.get(path, (None, None))
+        if mode == 'fail' or (mode == 'flaky' and upstream.requests[path] <= arg):
+            self.send_error(503)
+            return
+        if mode == 'slow':
+            with upstream.lock:
+                upstream.active += 1
+                upstream.most_concurrent = max(upstream.most_concurrent, upstream.active)
+            time.sleep(arg)
+            with upstream.lock:
+                upstream.active -= 1
+
+        body = upstream.files[path]
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            upstream.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            upstream.gzipped += 1
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if mode == 'trickle':
+            try:
+                for i in range(0, len(body), 64):
+                    self.wfile.write(body[i:i + 64])
+                    self.wfile.flush()
+                    time.sleep(arg)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client gave up, as it should
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Upstream(ThreadingHTTPServer):
+    '''
+    The fixture files by name; `modes` makes a file slow, flaky, failing or
+    trickling. `most_concurrent` counts the slow requests answered at once.
+    '''
+    daemon_threads = True
+    # Room for every source connecting at once
+    request_queue_size = 32
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.files = {}
+        for name in os.listdir(FIXTURES):
+            with open(os.path.join(FIXTURES, name), 'rb') as f:
+                self.files[name] = f.read()
+        self.reset()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def reset(self):
+        self.modes = {}
+        self.requests = collections.Counter()
+        self.gzipped = 0
+        self.not_modified = 0
+        self.most_concurrent = 0
+
+    def urls(self):
+        return {name: 'http://127.0.0.1:{}/{}'.format(self.server_port, os.path.basename(urlparse(url).path))
+                for name, url in SOURCE_URLS.items()}
+
+    def filename(self, source):
+        return os.path.basename(urlparse(SOURCE_URLS[source]).path)
+
+
+def same_as_upstream(upstream, sources):
+    for source in sources:
+        with open(source.local_path, 'rb') as f:
+            if f.read() != upstream.files[upstream.filename(source.name)]:
+                return False
+    return True